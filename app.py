@@ -1,14 +1,25 @@
 import eventlet
 eventlet.monkey_patch()
 
+import io
 import os
+import gzip
+import hashlib
 import time
-from flask import Flask, request, session, redirect, url_for, render_template_string
-from flask_socketio import SocketIO, emit
+import bisect
+import collections
+from flask import Flask, request, session, redirect, url_for, jsonify
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_socketio import disconnect as server_disconnect_client
+from eventlet import tpool
+from PIL import Image
 import traceback
 import sys
 import logging
+import cluster
+import control_protocol
+try: import brotli # Optional: brotli variants of the static assets
+except ImportError: brotli = None
 
 # --- Logging Setup (same) ---
 log_format = '%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
@@ -18,6 +29,20 @@ logger = logging.getLogger(__name__)
 # --- Configuration (same) ---
 SECRET_KEY = os.environ.get('FLASK_SECRET_KEY', 'change_this_strong_secret_key_12345_server_v3')
 ACCESS_PASSWORD = os.environ.get('REMOTE_ACCESS_PASSWORD', '1')
+VIEWER_ACK_TIMEOUT = float(os.environ.get('VIEWER_ACK_TIMEOUT', 5.0)) # Seconds to wait for a viewer to confirm a frame before sending the next anyway
+VIEWER_MAX_PENDING_BYTES = int(os.environ.get('VIEWER_MAX_PENDING_BYTES', 8 * 1024 * 1024)) # Merged backlog per viewer/stream before it is dropped for a keyframe
+VIEWER_MAX_PENDING_VIDEO_FRAMES = int(os.environ.get('VIEWER_MAX_PENDING_VIDEO_FRAMES', 30))
+CONTROL_ACK_TIMEOUT = float(os.environ.get('CONTROL_ACK_TIMEOUT', 1.0)) # Seconds to wait for the PC to take an input message before sending the next anyway
+FRAME_CACHE_MAX_BYTES = int(os.environ.get('FRAME_CACHE_MAX_BYTES', 2 * 1024 * 1024)) # Per stream: last keyframe plus later deltas, replayed to joining viewers (0 disables)
+RELAY_CLUSTER_URL = os.environ.get('RELAY_CLUSTER_URL', '') # redis://... shares hosts across gunicorn workers and nodes; empty runs single-process
+RELAY_NODE_ID = os.environ.get('RELAY_NODE_ID', '') # Unique per relay process; defaults to hostname-pid
+THUMBNAIL_INTERVAL = float(os.environ.get('THUMBNAIL_INTERVAL', 2.0)) # Seconds between overview thumbnails per host (0 disables)
+THUMBNAIL_WIDTH = int(os.environ.get('THUMBNAIL_WIDTH', 320)) # Per display; hosts with several displays get them side by side
+THUMBNAIL_QUALITY = int(os.environ.get('THUMBNAIL_QUALITY', 60))
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2)) # Concurrent transcodes on eventlet's native thread pool
+LATENCY_LOG_INTERVAL = float(os.environ.get('LATENCY_LOG_INTERVAL', 60.0)) # Seconds between per-host latency summaries in the log (0 disables)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static') # Viewer CSS/JS plus the vendored socket.io client (vendor/)
+SOCKETIO_CDN_URL = 'https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.7.5/socket.io.min.js' # Only if static/vendor/socket.io.min.js is missing
 
 # --- Flask App Setup (same) ---
 app = Flask(__name__)
@@ -25,8 +50,383 @@ app.config['SECRET_KEY'] = SECRET_KEY
 socketio = SocketIO(app, async_mode='eventlet', ping_timeout=90, ping_interval=30,
                     max_http_buffer_size=20 * 1024 * 1024, logger=False, engineio_logger=False)
 
-# --- Global Variables (same) ---
-client_pc_sid = None
+# --- Host Registry ---
+# Every remote PC registers under a host id and owns the Socket.IO room 'host:<id>'. A viewer subscribes to one
+# host at a time and joins only that room, so frames, cursor and status updates from a PC reach its own viewers
+# and viewer input reaches only the PC it is watching, however many hosts share the relay.
+# In cluster mode the PC and its viewers may sit on different relay processes: the node holding the PC socket
+# (the owner) forwards frames and room events to the nodes that have viewers, and those nodes forward viewer
+# input and their viewers' summary back to it, all over the cluster bus.
+class Host:
+    def __init__(self, host_id):
+        self.id, self.room = host_id, f"host:{host_id}"
+        self.sid = None # SID of the PC when it is registered on this node; None while it is offline or elsewhere
+        self.owner_node = None # Node holding the PC socket when that is another process (cluster mode)
+        self.stream_info = None # Last {'streams': [...]} layout from the PC (one entry per captured display), replayed to new viewers
+        self.viewer_viewports = {} # Viewer SID -> (width, height) of its rendered screen area in device pixels
+        self.viewer_video_codecs = {} # Viewer SID -> set of video codecs its browser can decode (WebCodecs)
+        self.viewer_streams = {} # Viewer SID -> list of stream ids it is displaying
+        self.outboxes = {} # Viewer SID -> ViewerOutbox
+        self.frame_cache = {} # Stream id -> (event, packet): last keyframe with every later delta merged in
+        self.cache_version = self.thumbnail_version = 0 # Bumped per cached frame; a thumbnail is due when they differ
+        self.thumbnail_at = self.thumbnail_keyframe_at = 0.0
+        self.control = ControlOutbox(self) # Viewer input waiting for the PC
+        self.remote_nodes = set() # Owner only: other nodes with viewers of this host
+        self.node_viewers = {} # Owner only: node id -> viewer summary reported by that node
+        self.last_viewport_sent = self.last_codecs_sent = self.last_streams_sent = None # To skip redundant updates
+        self.last_viewers_published = None
+
+    @property
+    def online(self): return bool(self.sid or self.owner_node)
+
+    def send_to_pc(self, event, data=None):
+        if self.sid and event in ControlOutbox.EVENTS: self.control.offer(event, data)
+        elif self.sid: socketio.emit(event, data if data is not None else {}, to=self.sid)
+        elif self.owner_node: bus.publish(self.owner_node, {'type': 'pc', 'host': self.id, 'event': event, 'data': data})
+
+    def send_to_viewers(self, event, data):
+        socketio.emit(event, data, to=self.room)
+        for node_id in list(self.remote_nodes): bus.publish(node_id, {'type': 'room', 'host': self.id, 'event': event, 'data': data})
+
+    def viewer_summary(self): # This node's viewers, combined the way the PC consumes them
+        viewports = self.viewer_viewports.values()
+        return {'viewport': [max(w for w, _ in viewports), max(h for _, h in viewports)] if viewports else None,
+                'codecs': sorted(set.intersection(*self.viewer_video_codecs.values())) if self.viewer_video_codecs else None,
+                'streams': sorted(set().union(*self.viewer_streams.values())) if self.viewer_streams else None}
+
+    def push_viewers(self, force=False):
+        summary = self.viewer_summary()
+        if not self.sid: # The owner combines every node's summary; just report this node's share
+            if self.owner_node and (force or summary != self.last_viewers_published):
+                self.last_viewers_published = summary
+                bus.publish(self.owner_node, {'type': 'viewers', 'host': self.id, 'viewers': summary})
+            return
+        parts = [summary] + list(self.node_viewers.values())
+        # The PC downscales to the largest area any viewer can show; None means no limit (native resolution)
+        viewports = [p['viewport'] for p in parts if p['viewport']]
+        target = (max(w for w, _ in viewports), max(h for _, h in viewports)) if viewports else None
+        if force or target != self.last_viewport_sent:
+            self.last_viewport_sent = target
+            socketio.emit('viewport_update', {'w': target[0], 'h': target[1]} if target else {}, to=self.sid)
+        # Video mode is only used when every viewer that reported can decode the codec; the PC falls back to tiles otherwise
+        codec_sets = [set(p['codecs']) for p in parts if p['codecs'] is not None]
+        common = sorted(set.intersection(*codec_sets)) if codec_sets else []
+        if force or common != self.last_codecs_sent:
+            self.last_codecs_sent = common
+            socketio.emit('stream_codecs', {'codecs': common}, to=self.sid)
+        # Streams no viewer displays drop to a background rate on the PC; None = no viewer reported, keep all at full rate
+        stream_sets = [set(p['streams']) for p in parts if p['streams'] is not None]
+        active = sorted(set().union(*stream_sets)) if stream_sets else None
+        if not self.outboxes and not self.node_viewers: active = [] # Nobody watching: the background rate is plenty for thumbnails
+        if force or active != self.last_streams_sent:
+            self.last_streams_sent = active
+            socketio.emit('active_streams', {'streams': active}, to=self.sid)
+
+    def add_viewer(self, sid):
+        if not self.outboxes:
+            bus.add_subscriber(self.id)
+            if self.owner_node: bus.publish(self.owner_node, {'type': 'watch', 'host': self.id})
+        outbox = self.outboxes[sid] = ViewerOutbox(sid, self)
+        if self.stream_info: socketio.emit('stream_info', self.stream_info, to=sid)
+        for event, packet in list(self.frame_cache.values()): outbox.offer(event, packet) # First pixels without waiting on the PC
+        self.request_missing_keyframes()
+
+    def remove_viewer(self, sid):
+        self.viewer_viewports.pop(sid, None); self.viewer_video_codecs.pop(sid, None); self.viewer_streams.pop(sid, None)
+        outbox = self.outboxes.pop(sid, None)
+        if outbox: logger.info(f"VIEWER_DELIVERY_STATS[{self.id}/{sid}]: {outbox.stats()}")
+        if self.outboxes: self.push_viewers(); return
+        bus.remove_subscriber(self.id)
+        if self.owner_node: bus.publish(self.owner_node, {'type': 'unwatch', 'host': self.id})
+        else: self.push_viewers()
+
+    def request_keyframe(self, stream=None):
+        self.send_to_pc('request_keyframe', {'stream': stream} if isinstance(stream, int) else {})
+
+    def request_missing_keyframes(self): # A joining viewer needs a full frame to composite deltas onto, unless one is cached
+        streams = [s.get('id') for s in (self.stream_info or {}).get('streams', []) if isinstance(s, dict)]
+        if not streams: streams = [] if self.frame_cache else [None]
+        for stream in streams:
+            if stream is None or stream not in self.frame_cache: self.request_keyframe(stream)
+
+    def cache_frame(self, event, packet):
+        # Keeps each stream's current picture as a replayable packet: a keyframe, with later deltas (tiles paint over,
+        # video frames decode in order) appended until it outgrows the cache; then joining viewers wait for a keyframe.
+        if not FRAME_CACHE_MAX_BYTES: return
+        stream = packet.get('stream') if isinstance(packet, dict) else None
+        cached = self.frame_cache.get(stream)
+        if is_key_packet(event, packet): entry = replay_packet(packet)
+        elif cached and cached[0] == event: entry = replay_packet(merge_frame_packets(event, cached[1], packet))
+        else: self.frame_cache.pop(stream, None); return
+        if (frame_packet_bytes(event, entry) > FRAME_CACHE_MAX_BYTES
+                or (event == 'screen_video' and len(entry['frames']) > VIEWER_MAX_PENDING_VIDEO_FRAMES)):
+            self.frame_cache.pop(stream, None); return
+        self.frame_cache[stream] = (event, entry); self.cache_version += 1
+
+class ControlOutbox:
+    # Viewer input for one PC, in order, one message in flight. Whatever arrives meanwhile queues behind it and queued
+    # batches merge with superseded moves dropped, so a PC that falls behind jumps to the latest pointer position
+    # instead of replaying the whole path. Clicks and keys are never dropped or reordered.
+    EVENTS = ('control_batch', 'command')
+
+    def __init__(self, host):
+        self.host = host; self.queue = collections.deque(); self.in_flight = None # (message number, time sent)
+        self.sent = self.dropped_moves = 0
+
+    def offer(self, event, data):
+        if event == 'control_batch' and self.queue and self.queue[-1][0] == 'control_batch':
+            merged, dropped = control_protocol.merge_batches(self.queue[-1][1], data)
+            if merged is not None: self.queue[-1] = (event, merged); self.dropped_moves += dropped; self.flush(); return
+        self.queue.append((event, data)); self.flush()
+
+    def flush(self):
+        if self.in_flight and time.time() - self.in_flight[1] < CONTROL_ACK_TIMEOUT: return
+        self.in_flight = None
+        if not self.queue or not self.host.sid: return
+        event, data = self.queue.popleft(); self.sent += 1; number = self.sent
+        self.in_flight = (number, time.time())
+        socketio.emit(event, data, to=self.host.sid, callback=lambda *args: self.confirmed(number))
+        eventlet.spawn_after(CONTROL_ACK_TIMEOUT, self.flush) # Don't strand queued clicks if the ack never comes
+
+    def confirmed(self, number):
+        if self.in_flight and self.in_flight[0] == number: self.in_flight = None; self.flush()
+
+    def reset(self): self.queue.clear(); self.in_flight = None
+
+bus = cluster.open_bus(RELAY_CLUSTER_URL, RELAY_NODE_ID or None)
+hosts = {} # Host id -> Host, kept while its PC is registered here or any local viewer is subscribed to it
+host_by_sid = {} # PC SID -> Host
+viewer_hosts = {} # Viewer SID -> Host it is subscribed to
+VIEWERS_ROOM = 'viewers' # Every authenticated viewer, for host list updates
+
+def host_list():
+    online = bus.online_hosts() # Cluster-wide in cluster mode
+    return {'hosts': [{'id': host_id, 'online': host_id in online} for host_id in sorted(set(online) | set(hosts))]}
+
+def push_host_list(): socketio.emit('host_list', host_list(), to=VIEWERS_ROOM)
+
+def release_host(host):
+    if host.sid is None and not host.outboxes and hosts.get(host.id) is host: del hosts[host.id]
+
+def unsubscribe_viewer(sid):
+    host = viewer_hosts.pop(sid, None)
+    if host is None: return
+    leave_room(host.room, sid=sid); host.remove_viewer(sid); latency_by_viewer.pop(sid, None); release_host(host)
+
+def owner_changed(host_id, node_id):
+    # A PC registered on (node_id) or left (None) another node: re-point local viewers and hand the owner our share
+    push_host_list()
+    host = hosts.get(host_id)
+    if host is None: return
+    if host.sid and node_id != bus.node_id: # Same host id registered elsewhere; the newest registration wins
+        old_sid = host.sid; host_by_sid.pop(old_sid, None); host.sid = None; host.control.reset()
+        host.remote_nodes.clear(); host.node_viewers.clear()
+        try: socketio.server.disconnect(old_sid, namespace='/')
+        except Exception as e: logger.error(f"Error disconnecting old client {old_sid} of {host_id}: {e}")
+    if host.sid: return
+    host.owner_node = node_id; host.last_viewers_published = None
+    if node_id is None: host.stream_info = None; host.frame_cache.clear()
+    elif host.outboxes: bus.publish(node_id, {'type': 'watch', 'host': host.id}); host.push_viewers(force=True)
+    release_host(host)
+
+def on_bus_message(message):
+    # Messages from other relay nodes; runs on the bus listener, outside any request
+    host, origin, kind = hosts.get(message.get('host')), message.get('origin'), message.get('type')
+    if origin == bus.node_id: return # Our own broadcast
+    if kind == 'owner': owner_changed(message['host'], message.get('node')); return
+    if host is None: return
+    if kind == 'frame': deliver_local(host, message['event'], message['packet'])
+    elif kind == 'room':
+        if message['event'] == 'stream_info': host.stream_info = message['data']
+        socketio.emit(message['event'], message['data'], to=host.room)
+    elif not host.sid: return # The rest is addressed to the owner
+    elif kind == 'pc': socketio.emit(message['event'], message['data'] if message['data'] is not None else {}, to=host.sid)
+    elif kind == 'watch':
+        host.remote_nodes.add(origin)
+        if host.stream_info: bus.publish(origin, {'type': 'room', 'host': host.id, 'event': 'stream_info', 'data': host.stream_info})
+        for event, packet in list(host.frame_cache.values()): bus.publish(origin, {'type': 'frame', 'host': host.id, 'event': event, 'packet': packet})
+        host.request_missing_keyframes()
+    elif kind == 'unwatch':
+        host.remote_nodes.discard(origin); host.node_viewers.pop(origin, None); host.push_viewers()
+    elif kind == 'viewers':
+        host.node_viewers[origin] = message['viewers']; host.push_viewers()
+
+def stream_field(data):
+    # Optional 'stream' id carried on viewer -> PC events
+    stream = data.get('stream') if isinstance(data, dict) else None
+    return {'stream': stream} if isinstance(stream, int) else {}
+
+# --- Frame Latency Tracing ---
+# Frames carry server-clock epoch-ms stamps: cap/enc/sent from the PC, in/out added here, and the viewer echoes them
+# back in frame_ack with recv/decoded/painted. Each hop goes into a histogram per host and per viewer.
+LATENCY_BUCKETS_MS = (5, 10, 20, 35, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 2000, 5000) # Upper bounds; last bucket is open
+LATENCY_HOPS = (('encode', 'cap', 'enc'), ('queue', 'enc', 'sent'), ('upload', 'sent', 'in'), ('relay', 'in', 'out'),
+                ('download', 'out', 'recv'), ('decode', 'recv', 'decoded'), ('paint', 'decoded', 'painted'), ('total', 'cap', 'painted'))
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1); self.count = 0; self.total = 0.0
+
+    def add(self, ms):
+        ms = max(0.0, ms) # Clock sync error can make a short hop come out slightly negative
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1; self.count += 1; self.total += ms
+
+    def percentile(self, fraction): # Upper bound of the bucket holding that fraction of samples
+        target, seen = fraction * self.count, 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= target and n: return LATENCY_BUCKETS_MS[i] if i < len(LATENCY_BUCKETS_MS) else float('inf')
+        return 0
+
+    def summary(self):
+        return {'count': self.count, 'avg_ms': round(self.total / self.count, 1) if self.count else 0.0,
+                'p50_ms': self.percentile(0.5), 'p95_ms': self.percentile(0.95), 'p99_ms': self.percentile(0.99),
+                'buckets': dict(zip([str(b) for b in LATENCY_BUCKETS_MS] + ['inf'], self.counts))}
+
+latency_by_host = {} # Host id -> {hop: LatencyHistogram}
+latency_by_viewer = {} # Viewer SID -> {hop: LatencyHistogram}
+last_latency_log = time.time()
+
+def record_frame_timing(host, viewer_sid, stamps):
+    global last_latency_log
+    for table, key in ((latency_by_host, host), (latency_by_viewer, viewer_sid)):
+        hops = table.setdefault(key, {})
+        for hop, start, end in LATENCY_HOPS:
+            if isinstance(stamps.get(start), (int, float)) and isinstance(stamps.get(end), (int, float)):
+                hops.setdefault(hop, LatencyHistogram()).add(stamps[end] - stamps[start])
+    if LATENCY_LOG_INTERVAL and time.time() - last_latency_log >= LATENCY_LOG_INTERVAL:
+        last_latency_log = time.time()
+        summary = {hop: (h.percentile(0.5), h.percentile(0.95)) for hop, h in latency_by_host.get(host, {}).items()}
+        logger.info(f"LATENCY_STATS[{host}] p50/p95 ms: {summary}")
+
+def latency_report():
+    summarize = lambda table: {str(key): {hop: h.summary() for hop, h in hops.items()} for key, hops in table.items()}
+    return {'buckets_ms': LATENCY_BUCKETS_MS, 'hosts': summarize(latency_by_host), 'viewers': summarize(latency_by_viewer)}
+
+def stamp_relay(data, stage): # Adds a server-clock hop stamp to a traced frame packet
+    if isinstance(data.get('ts'), dict): data['ts'][stage] = round(time.time() * 1000)
+
+# --- Per-Viewer Delivery (latest frame wins) ---
+# Each viewer has at most one frame per (event, stream) on the wire and one waiting. A newer frame replaces the
+# waiting one; delta tiles and video frames can't simply be dropped, so those are merged into it instead. The next
+# frame goes out once the viewer confirms the previous one, so slow links get the freshest frame, not a backlog.
+def is_key_packet(event, packet):
+    if event == 'screen_update': return bool(packet.get('key'))
+    if event == 'screen_video': return bool(packet['frames'][0][1])
+    return True # screen_frame_bytes: every frame is a full JPEG
+
+def frame_packet_bytes(event, packet):
+    if event == 'screen_update': return sum(len(t[2]) for t in packet['tiles'])
+    if event == 'screen_video': return sum(len(f[2]) for f in packet['frames'])
+    return len(packet)
+
+def replay_packet(packet): # A cached frame is not a live one: nothing to ack back to the PC, no latency stamps
+    return {k: v for k, v in packet.items() if k not in ('seq', 'ts')} if isinstance(packet, dict) else packet
+
+def merge_frame_packets(event, old, new):
+    # Later tiles paint over earlier ones and video frames decode in order, so concatenation is lossless
+    if event == 'screen_update': return dict(new, key=old.get('key', False), tiles=old['tiles'] + new['tiles'])
+    return dict(new, frames=old['frames'] + new['frames'])
+
+class ViewerOutbox:
+    def __init__(self, sid, host):
+        self.sid, self.host = sid, host
+        self.pending = {} # (event, stream) -> packet waiting to be sent
+        self.in_flight = {} # (event, stream) -> time the unconfirmed packet was sent
+        self.needs_key = set() # (event, stream) whose backlog was dropped; deltas wait for the next keyframe
+        self.sent = self.dropped = self.merged = 0
+
+    def offer(self, event, packet):
+        key = (event, packet.get('stream') if isinstance(packet, dict) else None)
+        if key in self.needs_key:
+            if not is_key_packet(event, packet): self.dropped += 1; return
+            self.needs_key.discard(key)
+        waiting = self.pending.get(key)
+        if waiting is not None:
+            if event == 'screen_frame_bytes' or is_key_packet(event, packet): self.dropped += 1 # Superseded outright
+            else:
+                packet = merge_frame_packets(event, waiting, packet); self.merged += 1
+                if (frame_packet_bytes(event, packet) > VIEWER_MAX_PENDING_BYTES
+                        or (event == 'screen_video' and len(packet['frames']) > VIEWER_MAX_PENDING_VIDEO_FRAMES)):
+                    del self.pending[key]; self.needs_key.add(key); self.dropped += 1
+                    logger.warning(f"VIEWER_BACKLOG_DROPPED: {self.host.id}/{self.sid} {key}, requesting keyframe")
+                    self.host.request_keyframe(key[1])
+                    return
+        self.pending[key] = packet
+        self.flush(key)
+
+    def flush(self, key):
+        sent_at = self.in_flight.get(key)
+        if sent_at is not None and time.time() - sent_at < VIEWER_ACK_TIMEOUT: return # Previous frame not confirmed yet
+        packet = self.pending.pop(key, None)
+        if packet is None: self.in_flight.pop(key, None); return
+        if isinstance(packet, dict) and isinstance(packet.get('ts'), dict): packet = dict(packet, ts=dict(packet['ts'], out=round(time.time() * 1000)))
+        self.in_flight[key] = time.time(); self.sent += 1
+        socketio.emit(key[0], packet, to=self.sid, callback=lambda *args: self.confirmed(key))
+        eventlet.spawn_after(VIEWER_ACK_TIMEOUT, self.flush, key) # Release a held frame even if the ack never comes
+
+    def confirmed(self, key):
+        self.in_flight.pop(key, None); self.flush(key)
+
+    def stats(self): return {'sent': self.sent, 'dropped': self.dropped, 'merged': self.merged, 'waiting': len(self.pending)}
+
+def deliver_frame(host, event, packet): # Only the host's own subscribers, and only nodes that have some
+    for node_id in list(host.remote_nodes): bus.publish(node_id, {'type': 'frame', 'host': host.id, 'event': event, 'packet': packet})
+    deliver_local(host, event, packet)
+
+def deliver_local(host, event, packet):
+    host.cache_frame(event, packet)
+    for outbox in list(host.outboxes.values()): outbox.offer(event, packet)
+
+# --- Host Thumbnails (overview grid) ---
+# The owning node renders each host's cached frame into a small JPEG every THUMBNAIL_INTERVAL while it changes.
+# Decoding and scaling run on eventlet's native thread pool (Pillow releases the GIL there), at most
+# THUMBNAIL_WORKERS at a time; a host whose turn comes while the pool is busy waits for the next round.
+# Thumbnails are stored on the bus so any node can serve them to /overview.
+thumbnail_pool = eventlet.GreenPool(max(1, THUMBNAIL_WORKERS))
+
+def render_thumbnail(frames):
+    # frames: [(stream, event, packet)] from a frame cache -> JPEG of the displays side by side, or None
+    images = []
+    for stream, event, packet in sorted(frames, key=lambda f: f[0] if isinstance(f[0], int) else -1):
+        if event == 'screen_video': continue # Needs a video decoder; the host shows once it sends tiles again
+        tiles = [[0, 0, packet]] if event == 'screen_frame_bytes' else packet['tiles']
+        width, height = (packet['w'], packet['h']) if isinstance(packet, dict) and packet.get('w') else Image.open(io.BytesIO(tiles[0][2])).size
+        scale = min(1.0, THUMBNAIL_WIDTH / width)
+        thumb = Image.new('RGB', (max(1, round(width * scale)), max(1, round(height * scale))))
+        for x, y, data, *_ in tiles:
+            tile = Image.open(io.BytesIO(data)); size = (max(1, round(tile.width * scale)), max(1, round(tile.height * scale)))
+            tile.draft('RGB', size) # JPEG tiles decode straight at 1/2 to 1/8 scale
+            thumb.paste(tile.convert('RGB').resize(size, Image.BILINEAR), (round(x * scale), round(y * scale)))
+        images.append(thumb)
+    if not images: return None
+    sheet = Image.new('RGB', (sum(i.width for i in images) + 4 * (len(images) - 1), max(i.height for i in images)))
+    x = 0
+    for image in images: sheet.paste(image, (x, 0)); x += image.width + 4
+    output = io.BytesIO(); sheet.save(output, format='JPEG', quality=THUMBNAIL_QUALITY)
+    return output.getvalue()
+
+def update_thumbnail(host, version, frames):
+    try: jpeg = tpool.execute(render_thumbnail, frames)
+    except Exception as e: logger.warning(f"THUMBNAIL_ERROR[{host.id}]: {e}"); return
+    host.thumbnail_version = version
+    if jpeg: bus.store_thumbnail(host.id, jpeg, ttl=max(60.0, 30 * THUMBNAIL_INTERVAL))
+
+def thumbnail_loop():
+    while True:
+        socketio.sleep(THUMBNAIL_INTERVAL)
+        now = time.time()
+        for host in list(hosts.values()):
+            if not host.sid: continue # Rendered where the PC's frames arrive
+            if not host.frame_cache:
+                # Cache outgrew its limit and nobody is watching to ask for a keyframe; ask now and then
+                if now - host.thumbnail_keyframe_at >= 15 * THUMBNAIL_INTERVAL: host.thumbnail_keyframe_at = now; host.request_missing_keyframes()
+                continue
+            if host.cache_version == host.thumbnail_version or now - host.thumbnail_at < THUMBNAIL_INTERVAL: continue
+            if not thumbnail_pool.free(): break
+            host.thumbnail_at = now
+            thumbnail_pool.spawn_n(update_thumbnail, host, host.cache_version,
+                                   [(stream, event, packet) for stream, (event, packet) in list(host.frame_cache.items())])
 
 # --- Authentication (same) ---
 def check_auth(password):
@@ -40,9 +440,7 @@ LOGIN_HTML = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Remote Control - Login</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">
-    <style> body { font-family: 'Inter', sans-serif; } </style>
+    <link rel="stylesheet" href="{{ asset_url('tailwind.css') }}">
 </head>
 <body class="bg-gray-100 flex items-center justify-center h-screen">
     <div class="bg-white p-8 rounded-lg shadow-md w-full max-w-sm">
@@ -76,68 +474,32 @@ INTERFACE_HTML = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Remote Control Interface</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <script src="https://cdnjs.cloudflare.com/ajax/libs/socket.io/4.7.4/socket.io.min.js"></script>
-    <link href="https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap" rel="stylesheet">
-    <style>
-        html, body { height: 100%; overflow: hidden; font-family: 'Inter', sans-serif; margin: 0; padding: 0; box-sizing: border-box; }
-        
-        /* Main layout containers */
-        #main-content { display: flex; flex-direction: column; height: calc(100% - 3.5rem); /* Adjust based on header height */ }
-        #screen-view-area { flex-grow: 1; display: flex; align-items: center; justify-content: center; background-color: #000; overflow: hidden; position: relative; transition: height 0.3s ease-in-out; }
-        #text-input-area { height: 0; overflow: hidden; background-color: #f9fafb; padding:0; transition: height 0.3s ease-in-out, padding 0.3s ease-in-out; display: flex; flex-direction: column; }
-        
-        /* Text Input Mode Active */
-        body.text-input-mode #screen-view-area { height: 50%; /* Or your desired height */ }
-        body.text-input-mode #text-input-area { height: 50%; padding: 1rem; /* Or your desired height */ }
-
-        #screen-view-area img { max-width: 100%; max-height: 100%; height: auto; width: auto; display: block; cursor: crosshair; object-fit: contain; }
-        
-        .status-dot { height: 10px; width: 10px; border-radius: 50%; display: inline-block; margin-right: 5px; }
-        .status-connected { background-color: #4ade80; } .status-disconnected { background-color: #f87171; } .status-connecting { background-color: #fbbf24; }
-        .click-feedback { position: absolute; border: 2px solid red; border-radius: 50%; width: 20px; height: 20px; transform: translate(-50%, -50%) scale(0); pointer-events: none; background-color: rgba(255, 0, 0, 0.3); animation: click-pulse 0.4s ease-out forwards; }
-        @keyframes click-pulse { 0% { transform: translate(-50%, -50%) scale(0.5); opacity: 1; } 100% { transform: translate(-50%, -50%) scale(2); opacity: 0; } }
-        body:focus { outline: none; }
-
-        #injection-text {
-            width: 100%;
-            flex-grow: 1; /* Take remaining space in text-input-area */
-            padding: 0.75rem;
-            border: 1px solid #d1d5db; 
-            border-radius: 0.375rem;
-            font-family: monospace;
-            font-size: 0.95rem;
-            resize: none; /* Prevent manual resize */
-        }
-        .control-button {
-            padding: 0.5rem 1rem;
-            background-color: #2563eb; color: white; border: none;
-            border-radius: 0.375rem; cursor: pointer; transition: background-color 0.2s;
-            margin-right: 0.5rem;
-        }
-        .control-button:hover { background-color: #1d4ed8; }
-        .control-button.active { background-color: #16a34a; } /* Green when active */
-        .control-button.active:hover { background-color: #15803d; }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('tailwind.css') }}">
+    <link rel="stylesheet" href="{{ asset_url('viewer.css') }}">
+    <script src="{{ asset_url('vendor/socket.io.min.js', SOCKETIO_CDN_URL) }}"></script>
 </head>
 <body class="bg-gray-200 flex flex-col h-screen" tabindex="0">
 
     <header class="bg-gray-800 text-white p-3 flex justify-between items-center shadow-md flex-shrink-0 h-14">
         <h1 class="text-lg font-semibold">Remote Desktop Control</h1>
         <div class="flex items-center space-x-3">
+            <select id="host-selector" class="text-xs text-gray-900 rounded-md py-1 px-1"></select>
+            <div id="stream-selector" class="flex items-center space-x-1"></div>
+            <button id="zoom-button" class="control-button text-xs">Zoom</button>
             <button id="toggle-text-mode-button" class="control-button text-xs">Text Input Mode</button>
+            <span id="stream-status" class="text-xs text-gray-400"></span>
             <div id="connection-status" class="flex items-center text-xs">
                 <span id="status-dot" class="status-dot status-connecting"></span>
                 <span id="status-text">Connecting...</span>
             </div>
+            <a href="{{ url_for('overview') }}" class="text-xs text-gray-300 hover:text-white">Overview</a>
             <a href="{{ url_for('logout') }}" class="bg-red-600 hover:bg-red-700 text-white text-xs font-medium py-1 px-2 rounded-md transition duration-150 ease-in-out">Logout</a>
         </div>
     </header>
 
     <main id="main-content" class="p-2">
         <div id="screen-view-area">
-            <img id="screen-image" src="https://placehold.co/1920x1080/333333/CCCCCC?text=Waiting+for+Remote+Screen..." alt="Remote Screen"
-                 onerror="this.onerror=null; this.src='https://placehold.co/600x338/333333/CCCCCC?text=Error+Loading+Screen'; console.error('Image load error (placeholder):', this.src);">
+            <div id="screen-placeholder">Waiting for Remote Screen...</div>
         </div>
         <div id="text-input-area">
             <textarea id="injection-text" placeholder="Text entered here will be saved. Client types it on F1 press..."></textarea>
@@ -148,134 +510,134 @@ INTERFACE_HTML = """
         </div>
     </main>
 
+    <script src="{{ asset_url('viewer.js') }}"></script>
+</body>
+</html>
+"""
+
+OVERVIEW_HTML = """
+<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Remote Control - Overview</title>
+    <link rel="stylesheet" href="{{ asset_url('tailwind.css') }}">
+    <style>
+        .status-dot { height: 8px; width: 8px; border-radius: 50%; display: inline-block; margin-right: 5px; }
+        .thumb { aspect-ratio: 16 / 9; object-fit: contain; background-color: #000; }
+    </style>
+</head>
+<body class="bg-gray-100 min-h-screen">
+    <header class="bg-gray-800 text-white p-3 flex justify-between items-center shadow-md h-14">
+        <h1 class="text-lg font-semibold">Remote Desktop Overview</h1>
+        <div class="flex items-center space-x-3">
+            <span id="host-count" class="text-xs text-gray-400"></span>
+            <a href="{{ url_for('logout') }}" class="bg-red-600 hover:bg-red-700 text-white text-xs font-medium py-1 px-2 rounded-md transition duration-150 ease-in-out">Logout</a>
+        </div>
+    </header>
+    <main id="grid" class="p-4 grid gap-4" style="grid-template-columns: repeat(auto-fill, minmax(240px, 1fr));"></main>
     <script>
-        document.addEventListener('DOMContentLoaded', () => {
-            const socket = io(window.location.origin, { path: '/socket.io/' });
-            const screenImage = document.getElementById('screen-image');
-            const connectionStatusDot = document.getElementById('status-dot');
-            const connectionStatusText = document.getElementById('status-text');
-            let remoteScreenWidth = null;
-            let remoteScreenHeight = null;
-            let activeModifiers = { ctrl: false, shift: false, alt: false, meta: false };
-            let currentImageUrl = null;
-
-            // UI Elements for layout and text injection
-            const bodyElement = document.body;
-            const toggleTextModeButton = document.getElementById('toggle-text-mode-button');
-            const injectionTextarea = document.getElementById('injection-text');
-            const sendInjectionTextButton = document.getElementById('send-injection-text-button');
-            const injectionStatus = document.getElementById('injection-status');
-
-
-            document.body.focus(); // For keyboard events
-            // Avoid re-focusing if clicking inside textarea
-            document.addEventListener('click', (e) => {
-                if (e.target !== screenImage && e.target !== injectionTextarea && !injectionTextarea.contains(e.target)) {
-                    document.body.focus();
-                }
-            });
-
-            function updateStatus(status, message) { connectionStatusText.textContent = message; connectionStatusDot.className = `status-dot ${status}`; }
-            function showClickFeedback(x, y) { /* ... same as before ... */ }
-
-
-            socket.on('connect', () => { updateStatus('status-connecting', 'Server connected, waiting for PC...'); });
-            socket.on('disconnect', (reason) => { updateStatus('status-disconnected', 'Server disconnected'); /* ... cleanup ... */ });
-            socket.on('connect_error', (error) => { updateStatus('status-disconnected', 'Connection Error'); /* ... cleanup ... */ });
-            socket.on('client_connected', (data) => { updateStatus('status-connected', 'Remote PC Connected'); document.body.focus(); });
-            socket.on('client_disconnected', (data) => { updateStatus('status-disconnected', 'Remote PC Disconnected'); /* ... cleanup ... */ });
-            socket.on('command_error', (data) => { console.error(`IO: Command Error: ${data.message}`); });
-            socket.on('text_injection_set_ack', (data) => {
-                injectionStatus.textContent = data.status === 'success' ? 'Text saved for client!' : `Error: ${data.message || 'Failed to save.'}`;
-                setTimeout(() => { injectionStatus.textContent = ''; }, 3000);
-            });
-
-            socket.on('screen_frame_bytes', (imageDataBytes) => { /* ... same as before ... */
-                const blob = new Blob([imageDataBytes], { type: 'image/jpeg' });
-                const newImageUrl = URL.createObjectURL(blob);
-                if (remoteScreenWidth === null) { /* ... dimension detection ... */
-                    const tempImg = new Image();
-                    tempImg.onload = () => {
-                       remoteScreenWidth = tempImg.naturalWidth; remoteScreenHeight = tempImg.naturalHeight;
-                       URL.revokeObjectURL(tempImg.src);
-                    };
-                    tempImg.src = newImageUrl;
-                }
-                const oldUrl = currentImageUrl; currentImageUrl = newImageUrl;
-                screenImage.onload = () => { if (oldUrl) URL.revokeObjectURL(oldUrl); };
-                screenImage.src = newImageUrl;
-            });
-
-            // --- Mouse Handling (same) ---
-            screenImage.addEventListener('mousemove', (event) => { if (!remoteScreenWidth) return; const rect = screenImage.getBoundingClientRect(); const x = event.clientX - rect.left; const y = event.clientY - rect.top; const remoteX = Math.round((x / rect.width) * remoteScreenWidth); const remoteY = Math.round((y / rect.height) * remoteScreenHeight); socket.emit('control_command', { action: 'move', x: remoteX, y: remoteY }); });
-            screenImage.addEventListener('click', (event) => { if (!remoteScreenWidth) return; const rect = screenImage.getBoundingClientRect(); const x = event.clientX - rect.left; const y = event.clientY - rect.top; const remoteX = Math.round((x / rect.width) * remoteScreenWidth); const remoteY = Math.round((y / rect.height) * remoteScreenHeight); socket.emit('control_command', { action: 'click', button: 'left', x: remoteX, y: remoteY }); /*showClickFeedback*/ document.body.focus(); });
-            screenImage.addEventListener('contextmenu', (event) => { event.preventDefault(); if (!remoteScreenWidth) return; const rect = screenImage.getBoundingClientRect(); const x = event.clientX - rect.left; const y = event.clientY - rect.top; const remoteX = Math.round((x / rect.width) * remoteScreenWidth); const remoteY = Math.round((y / rect.height) * remoteScreenHeight); socket.emit('control_command', { action: 'click', button: 'right', x: remoteX, y: remoteY }); /*showClickFeedback*/ document.body.focus(); });
-            screenImage.addEventListener('wheel', (event) => { event.preventDefault(); const dY = event.deltaY > 0 ? 1 : (event.deltaY < 0 ? -1 : 0); const dX = event.deltaX > 0 ? 1 : (event.deltaX < 0 ? -1 : 0); if (dY || dX) socket.emit('control_command', { action: 'scroll', dx: dX, dy: dY }); document.body.focus(); });
-
-            // --- Keyboard Event Handling ---
-            document.body.addEventListener('keydown', (event) => {
-                if (document.activeElement === injectionTextarea || injectionTextarea.contains(document.activeElement)) {
-                     // Allow typing in textarea, but capture F1 if it's for text injection trigger (handled by client)
-                    if (event.key === "F1") {
-                        // Optionally, prevent default F1 behavior if it does anything in browser
-                        // event.preventDefault(); 
-                        // We still send F1 to the client to trigger typing.
-                    } else {
-                        return; // Don't send other keys as control commands
-                    }
-                }
-
-                // ... (rest of existing keydown logic for modifiers and sending commands)
-                if (event.key === 'Control') activeModifiers.ctrl = true; if (event.key === 'Shift') activeModifiers.shift = true; if (event.key === 'Alt') activeModifiers.alt = true; if (event.key === 'Meta') activeModifiers.meta = true;
-                let shouldPreventDefault = false; const isModifierKey = ['Control', 'Shift', 'Alt', 'Meta', 'CapsLock', 'NumLock', 'ScrollLock'].includes(event.key); const isFKey = event.key.startsWith('F') && event.key.length > 1 && !isNaN(parseInt(event.key.substring(1))); const keysToPrevent = [ 'Tab', 'Enter', 'Escape', 'Backspace', 'Delete', 'Insert', 'Home', 'End', 'PageUp', 'PageDown', 'ArrowUp', 'ArrowDown', 'ArrowLeft', 'ArrowRight', ' ' ];
-                if (event.key.length === 1 && !event.ctrlKey && !event.altKey && !event.metaKey) { shouldPreventDefault = true; } else if (keysToPrevent.includes(event.key) && !(event.altKey && event.key === 'Tab')) { shouldPreventDefault = true; }
-                if (event.metaKey && event.shiftKey && event.key.toLowerCase() === 's') { shouldPreventDefault = false; } if (event.altKey && event.key === 'Tab') { shouldPreventDefault = false; } if (event.ctrlKey && ['c', 'v', 'x', 'a', 'z', 'y', 'r', 't', 'w', 'l', 'p', 'f'].includes(event.key.toLowerCase())) { shouldPreventDefault = false; } if (isFKey && event.key !== "F1") { shouldPreventDefault = false; } /* Allow F1 to pass through */ if (event.ctrlKey && event.shiftKey && ['i', 'j', 'c'].includes(event.key.toLowerCase())) { shouldPreventDefault = false; } if (event.ctrlKey && event.key === 'Tab') { shouldPreventDefault = false; }
-                
-                // For F1, we always want to send it, but might not prevent default if textarea is focused
-                // For other keys that should be prevented, do so.
-                if (shouldPreventDefault && event.key !== "F1") { event.preventDefault(); }
-
-
-                const command = { action: 'keydown', key: event.key, code: event.code, ctrlKey: event.ctrlKey, shiftKey: event.shiftKey, altKey: event.altKey, metaKey: event.metaKey };
-                socket.emit('control_command', command);
-            });
-            document.body.addEventListener('keyup', (event) => {
-                if (document.activeElement === injectionTextarea || injectionTextarea.contains(document.activeElement)) return;
-                // ... (rest of existing keyup logic)
-                 if (event.key === 'Control') activeModifiers.ctrl = false; if (event.key === 'Shift') activeModifiers.shift = false; if (event.key === 'Alt') activeModifiers.alt = false; if (event.key === 'Meta') activeModifiers.meta = false;
-                 const command = { action: 'keyup', key: event.key, code: event.code }; socket.emit('control_command', command);
-            });
-            window.addEventListener('blur', () => { /* ... same as before ... */ });
-
-            // --- UI Mode Toggle & Text Injection ---
-            toggleTextModeButton.addEventListener('click', () => {
-                bodyElement.classList.toggle('text-input-mode');
-                if (bodyElement.classList.contains('text-input-mode')) {
-                    toggleTextModeButton.textContent = 'Screen View Mode';
-                    toggleTextModeButton.classList.add('active');
-                    injectionTextarea.focus(); // Focus textarea when mode is active
-                } else {
-                    toggleTextModeButton.textContent = 'Text Input Mode';
-                    toggleTextModeButton.classList.remove('active');
-                    document.body.focus(); // Focus body for general controls
-                }
-            });
-
-            sendInjectionTextButton.addEventListener('click', () => {
-                const text = injectionTextarea.value;
-                // No need to check for empty here, client can receive empty string to clear
-                socket.emit('set_injection_text', { text_to_inject: text });
-                injectionStatus.textContent = 'Saving...';
-            });
-
-            updateStatus('status-connecting', 'Initializing...');
-            document.body.focus();
-        });
+        // Thumbnails only; a host's full stream starts when its tile is opened in the interface
+        const grid = document.getElementById('grid'), hostCount = document.getElementById('host-count');
+        const cards = new Map(); // host id -> { card, img, dot, thumb }
+        function card(host) {
+            let entry = cards.get(host.id);
+            if (entry) return entry;
+            const link = document.createElement('a'); link.href = `{{ url_for('interface') }}?host=${encodeURIComponent(host.id)}`;
+            link.className = 'block bg-white rounded-lg shadow hover:shadow-lg overflow-hidden';
+            const img = document.createElement('img'); img.className = 'thumb w-full'; img.alt = host.id;
+            const label = document.createElement('div'); label.className = 'p-2 text-sm text-gray-700 flex items-center truncate';
+            const dot = document.createElement('span'); dot.className = 'status-dot';
+            label.appendChild(dot); label.appendChild(document.createTextNode(host.id));
+            link.appendChild(img); link.appendChild(label); grid.appendChild(link);
+            entry = { card: link, img, dot, thumb: null }; cards.set(host.id, entry);
+            return entry;
+        }
+        async function refresh() {
+            try {
+                const response = await fetch('{{ url_for('overview_hosts') }}', { cache: 'no-store' });
+                if (response.status === 401) { window.location = '{{ url_for('index') }}'; return; }
+                const hosts = (await response.json()).hosts || [], ids = new Set(hosts.map(h => h.id));
+                for (const [id, entry] of cards) if (!ids.has(id)) { entry.card.remove(); cards.delete(id); }
+                hosts.forEach(host => {
+                    const entry = card(host);
+                    entry.dot.style.backgroundColor = host.online ? '#4CAF50' : '#F44336';
+                    if (host.thumb && host.thumb !== entry.thumb) { entry.thumb = host.thumb; entry.img.src = `/thumbnail/${encodeURIComponent(host.id)}.jpg?t=${host.thumb}`; }
+                });
+                hostCount.textContent = `${hosts.filter(h => h.online).length} of ${hosts.length} hosts online`;
+            } catch (err) { console.error('Overview refresh failed:', err); }
+            setTimeout(refresh, {{ refresh_ms }});
+        }
+        refresh();
     </script>
 </body>
 </html>
 """
 
+# --- Static Assets & Templates ---
+# Files under STATIC_DIR are read, fingerprinted and gzip/brotli-compressed once at startup, then served from memory
+# under /assets/<hash>/<name>. A changed file gets a new URL, so responses can be cached for a year; ETags still let a
+# browser revalidate an old URL cheaply. The page templates are compiled once here instead of on every request.
+ASSET_MIMETYPES = {'.css': 'text/css', '.js': 'application/javascript', '.map': 'application/json', '.svg': 'image/svg+xml',
+                   '.woff2': 'font/woff2', '.png': 'image/png', '.ico': 'image/x-icon'}
+ASSET_COMPRESSIBLE = ('.css', '.js', '.map', '.svg')
+
+class StaticAsset:
+    def __init__(self, name, body):
+        self.name, self.body = name, body
+        self.version = hashlib.sha256(body).hexdigest()[:16]
+        self.mimetype = ASSET_MIMETYPES.get(os.path.splitext(name)[1], 'application/octet-stream')
+        self.encoded = {} # Content-Encoding -> bytes, only where it is actually smaller
+        if name.endswith(ASSET_COMPRESSIBLE):
+            candidates = {'gzip': gzip.compress(body, 9, mtime=0)}
+            if brotli is not None: candidates['br'] = brotli.compress(body, quality=11)
+            self.encoded = {encoding: data for encoding, data in candidates.items() if len(data) < len(body)}
+
+def load_static_assets(root):
+    assets = {}
+    if not os.path.isdir(root): return assets
+    for folder, _, files in os.walk(root):
+        for filename in files:
+            if os.path.splitext(filename)[1] not in ASSET_MIMETYPES: continue
+            path = os.path.join(folder, filename); name = os.path.relpath(path, root).replace(os.sep, '/')
+            with open(path, 'rb') as f: assets[name] = StaticAsset(name, f.read())
+    for asset in assets.values():
+        logger.info(f"STATIC_ASSET: {asset.name} {len(asset.body)} B, " + (', '.join(f"{e} {len(d)} B" for e, d in asset.encoded.items()) or 'uncompressed'))
+    return assets
+
+static_assets = load_static_assets(STATIC_DIR)
+
+def asset_url(name, fallback=None): # Versioned URL of a static asset, or fallback (e.g. a CDN) if it isn't bundled
+    asset = static_assets.get(name)
+    if asset is None:
+        if fallback is None: logger.warning(f"STATIC_ASSET_MISSING: {name}")
+        return fallback or ''
+    return url_for('static_asset', version=asset.version, name=name)
+
+app.jinja_env.globals.update(asset_url=asset_url, SOCKETIO_CDN_URL=SOCKETIO_CDN_URL)
+LOGIN_TEMPLATE = app.jinja_env.from_string(LOGIN_HTML)
+INTERFACE_TEMPLATE = app.jinja_env.from_string(INTERFACE_HTML)
+OVERVIEW_TEMPLATE = app.jinja_env.from_string(OVERVIEW_HTML)
+
+def render_page(template, **context): # render_template_string minus the per-request parse and compile
+    app.update_template_context(context)
+    return template.render(context)
+
+@app.route('/assets/<version>/<path:name>')
+def static_asset(version, name):
+    asset = static_assets.get(name)
+    if asset is None: return '', 404
+    encoding = next((e for e in ('br', 'gzip') if e in asset.encoded and request.accept_encodings[e]), None)
+    response = app.response_class(asset.encoded[encoding] if encoding else asset.body, mimetype=asset.mimetype)
+    if encoding: response.headers['Content-Encoding'] = encoding
+    if asset.encoded: response.vary.add('Accept-Encoding')
+    response.set_etag(f"{asset.version}-{encoding or 'identity'}")
+    # An outdated hash in the URL still gets the current file, but must not be cached as if it were that version
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if version == asset.version else 'no-cache'
+    return response.make_conditional(request)
+
+
 # --- Flask Routes (same) ---
 @app.route('/', methods=['GET', 'POST'])
 def index():
@@ -284,72 +646,262 @@ def index():
         if check_auth(password):
             session['authenticated'] = True; return redirect(url_for('interface'))
         else:
-            return render_template_string(LOGIN_HTML, error="Invalid password")
+            return render_page(LOGIN_TEMPLATE, error="Invalid password")
     if session.get('authenticated'): return redirect(url_for('interface'))
-    return render_template_string(LOGIN_HTML)
+    return render_page(LOGIN_TEMPLATE)
 
 @app.route('/interface')
 def interface():
     if not session.get('authenticated'): return redirect(url_for('index'))
-    return render_template_string(INTERFACE_HTML)
+    return render_page(INTERFACE_TEMPLATE)
+
+@app.route('/latency')
+def latency():
+    if not session.get('authenticated'): return redirect(url_for('index'))
+    return jsonify(latency_report())
+
+@app.route('/delivery')
+def delivery():
+    if not session.get('authenticated'): return redirect(url_for('index'))
+    return jsonify({host.id: {'viewers': {sid: outbox.stats() for sid, outbox in host.outboxes.items()},
+                              'control': {'sent': host.control.sent, 'dropped_moves': host.control.dropped_moves, 'queued': len(host.control.queue)}}
+                    for host in list(hosts.values())})
+
+@app.route('/hosts')
+def host_registry():
+    if not session.get('authenticated'): return redirect(url_for('index'))
+    return jsonify(host_list())
+
+@app.route('/overview')
+def overview():
+    if not session.get('authenticated'): return redirect(url_for('index'))
+    return render_page(OVERVIEW_TEMPLATE, refresh_ms=int(max(THUMBNAIL_INTERVAL, 1.0) * 1000))
+
+@app.route('/overview/hosts')
+def overview_hosts():
+    if not session.get('authenticated'): return jsonify({'error': 'unauthorized'}), 401
+    listed, times = host_list()['hosts'], bus.thumbnail_times()
+    known = {h['id'] for h in listed}
+    listed += [{'id': host_id, 'online': False} for host_id in times if host_id not in known] # Recently offline; last picture kept
+    return jsonify({'hosts': [dict(h, thumb=times.get(h['id'])) for h in sorted(listed, key=lambda h: h['id'])]})
+
+@app.route('/thumbnail/<path:host_id>.jpg')
+def thumbnail(host_id):
+    if not session.get('authenticated'): return '', 401
+    entry = bus.thumbnail(host_id)
+    if entry is None: return '', 404
+    response = app.response_class(entry[1], mimetype='image/jpeg')
+    response.headers['Cache-Control'] = 'private, max-age=60' # URLs carry the thumbnail time, so a new image is a new URL
+    return response
 
 @app.route('/logout')
 def logout():
     session.pop('authenticated', None); return redirect(url_for('index'))
 
 # --- SocketIO Events (mostly same, set_injection_text updated) ---
+# PC events are only accepted from a registered PC SID and go to its host's room; viewer events go to the PC of
+# the host the viewer is subscribed to.
+def sender_host(): return host_by_sid.get(request.sid)
+
+def viewer_host():
+    return viewer_hosts.get(request.sid) if session.get('authenticated') else None
+
 @socketio.on('connect')
-def handle_connect(): logger.info(f"SOCKET_CONNECT SID: {request.sid}, IP: {request.remote_addr}")
+def handle_connect():
+    logger.info(f"SOCKET_CONNECT SID: {request.sid}, IP: {request.remote_addr}")
+    if session.get('authenticated'):
+        join_room(VIEWERS_ROOM); emit('host_list', host_list(), room=request.sid) # The viewer picks a host and subscribes
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    global client_pc_sid
-    if request.sid == client_pc_sid:
-        logger.warning(f"Remote PC (SID: {client_pc_sid}) disconnected.")
-        client_pc_sid = None
-        emit('client_disconnected', {'message': 'Remote PC disconnected.'}, broadcast=True, include_self=False)
+    unsubscribe_viewer(request.sid)
+    host = host_by_sid.pop(request.sid, None)
+    if host:
+        logger.warning(f"Remote PC {host.id} (SID: {request.sid}) disconnected.")
+        bus.release_host(host.id, request.sid)
+        host.send_to_viewers('client_disconnected', {'message': 'Remote PC disconnected.', 'host': host.id})
+        host.sid = None; host.stream_info = None; host.frame_cache.clear(); host.control.reset(); host.remote_nodes.clear(); host.node_viewers.clear()
+        host.last_viewport_sent = host.last_codecs_sent = host.last_streams_sent = None
+        bus.broadcast({'type': 'owner', 'host': host.id, 'node': None})
+        release_host(host); push_host_list()
 
 @socketio.on('register_client')
 def handle_register_client(data):
-    global client_pc_sid
-    client_token = data.get('token'); sid = request.sid
+    client_token = data.get('token') if isinstance(data, dict) else None; sid = request.sid
     if client_token == ACCESS_PASSWORD:
-        if client_pc_sid and client_pc_sid != sid:
-            try: server_disconnect_client(client_pc_sid, silent=True)
-            except Exception as e: logger.error(f"Error disconnecting old client {client_pc_sid}: {e}")
-        client_pc_sid = sid
-        logger.info(f"Remote PC (SID: {sid}) registered.")
-        emit('client_connected', {'message': 'Remote PC connected.'}, broadcast=True, include_self=False)
+        host_id = str(data.get('host') or sid)[:128]
+        host = hosts.get(host_id) or hosts.setdefault(host_id, Host(host_id))
+        if host.sid and host.sid != sid: # Same host id reconnecting (or a duplicate): the newest registration wins
+            host_by_sid.pop(host.sid, None)
+            try: server_disconnect_client(host.sid, silent=True)
+            except Exception as e: logger.error(f"Error disconnecting old client {host.sid} of {host_id}: {e}")
+        previous = host_by_sid.get(sid)
+        if previous and previous is not host: # PC re-registered under a new id
+            bus.release_host(previous.id, sid); previous.sid = None; release_host(previous)
+        bus.claim_host(host_id, sid) # Any other node still holding this host drops its PC on the owner broadcast
+        host.sid = sid; host.owner_node = None; host_by_sid[sid] = host; host.control.reset()
+        host.remote_nodes = bus.subscriber_nodes(host_id) - {bus.node_id}
+        logger.info(f"Remote PC {host_id} (SID: {sid}) registered on {bus.node_id}. {len(host_by_sid)} host(s) online here.")
+        host.send_to_viewers('client_connected', {'message': 'Remote PC connected.', 'host': host_id})
         emit('registration_success', room=sid)
+        bus.broadcast({'type': 'owner', 'host': host_id, 'node': bus.node_id})
+        host.push_viewers(force=True)
+        if host.outboxes: host.request_keyframe()
+        push_host_list()
     else:
         emit('registration_fail', {'message': 'Auth failed.'}, room=sid); server_disconnect_client(sid)
 
+@socketio.on('subscribe_host')
+def handle_subscribe_host(data):
+    if not session.get('authenticated') or not isinstance(data, dict) or not data.get('host'): return
+    host_id = str(data['host'])
+    current = viewer_hosts.get(request.sid)
+    if current and current.id == host_id: return
+    unsubscribe_viewer(request.sid)
+    host = hosts.get(host_id)
+    if host is None: # Subscribing ahead of the PC is fine; it waits
+        host = hosts[host_id] = Host(host_id)
+        owner = bus.host_owner(host_id)
+        if owner and owner[0] != bus.node_id: host.owner_node = owner[0]
+    viewer_hosts[request.sid] = host; join_room(host.room)
+    logger.info(f"VIEWER_SUBSCRIBE: {request.sid} -> {host_id}")
+    host.add_viewer(request.sid)
+    emit('client_connected' if host.online else 'client_disconnected',
+         {'message': 'Remote PC connected.' if host.online else 'Remote PC not connected.', 'host': host_id}, room=request.sid)
+
 @socketio.on('screen_data_bytes')
 def handle_screen_data_bytes(data):
-    if request.sid == client_pc_sid and data and isinstance(data, bytes):
-        emit('screen_frame_bytes', data, broadcast=True, include_self=False)
+    host = sender_host()
+    if host and data and isinstance(data, bytes):
+        deliver_frame(host, 'screen_frame_bytes', data)
+
+@socketio.on('screen_update')
+def handle_screen_update(data):
+    host = sender_host()
+    if host and isinstance(data, dict) and data.get('tiles'):
+        stamp_relay(data, 'in') # 'out' is stamped per viewer when its outbox actually sends
+        deliver_frame(host, 'screen_update', data)
+
+@socketio.on('viewer_viewport')
+def handle_viewer_viewport(data):
+    host = viewer_host()
+    if not host or not isinstance(data, dict): return
+    try: width, height = int(data.get('w', 0)), int(data.get('h', 0))
+    except (TypeError, ValueError): return
+    if width > 0 and height > 0:
+        host.viewer_viewports[request.sid] = (width, height); host.push_viewers()
+
+@socketio.on('viewer_codecs')
+def handle_viewer_codecs(data):
+    host = viewer_host()
+    if not host or not isinstance(data, dict): return
+    codecs = data.get('codecs')
+    host.viewer_video_codecs[request.sid] = {c for c in codecs if isinstance(c, str)} if isinstance(codecs, list) else set()
+    host.push_viewers()
+
+@socketio.on('stream_info')
+def handle_stream_info(data):
+    host = sender_host()
+    if host and isinstance(data, dict) and isinstance(data.get('streams'), list):
+        host.stream_info = data
+        ids = {s.get('id') for s in data['streams'] if isinstance(s, dict)}
+        for stream in [s for s in host.frame_cache if s not in ids]: del host.frame_cache[stream]
+        logger.info(f"STREAM_INFO[{host.id}]: {[s.get('id') for s in data['streams'] if isinstance(s, dict)]}")
+        host.send_to_viewers('stream_info', data)
+
+@socketio.on('viewer_streams')
+def handle_viewer_streams(data):
+    host = viewer_host()
+    if not host or not isinstance(data, dict): return
+    streams = data.get('streams')
+    host.viewer_streams[request.sid] = [s for s in streams if isinstance(s, int)] if isinstance(streams, list) else []
+    host.push_viewers()
+
+@socketio.on('set_roi')
+def handle_set_roi(data):
+    # Zoom: the PC captures only rect = [x, y, w, h] (native pixels) of the stream, or the whole display for rect None
+    host = viewer_host()
+    if not host or not host.online or not isinstance(data, dict): return
+    rect = data.get('rect')
+    if rect is not None and not (isinstance(rect, list) and len(rect) == 4 and all(isinstance(v, (int, float)) for v in rect)): return
+    host.send_to_pc('set_roi', {'rect': rect, **stream_field(data)})
+
+@socketio.on('request_keyframe')
+def handle_request_keyframe(data=None):
+    host = viewer_host()
+    if host: host.request_keyframe(stream_field(data).get('stream'))
+
+@socketio.on('screen_video')
+def handle_screen_video(data):
+    host = sender_host()
+    if host and isinstance(data, dict) and data.get('frames'):
+        stamp_relay(data, 'in')
+        deliver_frame(host, 'screen_video', data)
+
+@socketio.on('clock_sync')
+def handle_clock_sync(data=None):
+    return {'t': time.time() * 1000} # Ack value; PC and viewers estimate their offset to this clock from the round trip
+
+@socketio.on('cursor_update')
+def handle_cursor_update(data):
+    host = sender_host()
+    if host and isinstance(data, dict):
+        host.send_to_viewers('cursor_update', data)
+
+@socketio.on('typing_progress')
+def handle_typing_progress(data):
+    host = sender_host()
+    if host and isinstance(data, dict):
+        host.send_to_viewers('typing_progress', data)
+
+@socketio.on('frame_ack')
+def handle_frame_ack(data):
+    host = viewer_host()
+    if host and host.online and isinstance(data, dict):
+        if isinstance(data.get('timing'), dict): record_frame_timing(host.id, request.sid, data['timing'])
+        host.send_to_pc('frame_ack', {'seq': data.get('seq'), **stream_field(data)})
+
+@socketio.on('stream_status')
+def handle_stream_status(data):
+    host = sender_host()
+    if host and isinstance(data, dict):
+        logger.info(f"STREAM_STATUS[{host.id}]: {data}")
+        host.send_to_viewers('stream_status', data)
 
 @socketio.on('control_command')
 def handle_control_command(data):
-    if session.get('authenticated') and client_pc_sid:
-        emit('command', data, room=client_pc_sid)
-    elif not client_pc_sid:
+    host = viewer_host()
+    if host and host.online:
+        host.send_to_pc('command', data)
+    elif session.get('authenticated'):
         emit('command_error', {'message': 'Remote PC not connected.'}, room=request.sid)
 
+@socketio.on('control_batch')
+def handle_control_batch(data):
+    # Binary input batch (control_protocol.py); only checked for shape and passed on as-is
+    host = viewer_host()
+    if not host or control_protocol.check_batch(data) is None: return
+    if host.online: host.send_to_pc('control_batch', bytes(data))
+    else: emit('command_error', {'message': 'Remote PC not connected.'}, room=request.sid)
+
 @socketio.on('set_injection_text')
 def handle_set_injection_text(data):
     if not session.get('authenticated'): return
     text_to_inject = data.get('text_to_inject') # Can be empty string
-    if client_pc_sid:
+    host = viewer_hosts.get(request.sid)
+    if host and host.online:
         if text_to_inject is not None:
-            logger.info(f"SERVER_INJECT_TEXT_SEND: To SID {client_pc_sid}, Text: '{text_to_inject[:30]}...'")
-            emit('receive_injection_text', {'text': text_to_inject}, room=client_pc_sid)
+            logger.info(f"SERVER_INJECT_TEXT_SEND: To {host.id}, Text: '{text_to_inject[:30]}...'")
+            host.send_to_pc('receive_injection_text', {'text': text_to_inject})
             emit('text_injection_set_ack', {'status': 'success'}, room=request.sid)
         else:
             emit('text_injection_set_ack', {'status': 'error', 'message': 'No text data received.'}, room=request.sid)
     else:
         emit('text_injection_set_ack', {'status': 'error', 'message': 'Remote PC not connected.'}, room=request.sid)
 
+bus.start(on_bus_message, socketio.start_background_task)
+if THUMBNAIL_INTERVAL and FRAME_CACHE_MAX_BYTES: socketio.start_background_task(thumbnail_loop)
+
 if __name__ == '__main__':
     logger.info("--- Server with Toggleable Text Input Mode ---")
     port = int(os.environ.get('PORT', 5000)); host = '0.0.0.0'
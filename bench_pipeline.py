@@ -0,0 +1,193 @@
+# --- Capture -> Encode -> Emit Pipeline Benchmark ---
+# Drives client.CapturePipeline (the code screen_capture_loop runs) with synthetic desktops and an in-process
+# stand-in for the server, so encoder settings can be compared without a real display or a live app.py.
+#   python bench_pipeline.py --seconds 5 --scenarios static,scroll,video,typing --configs delta,delta-palette
+import argparse
+import json
+import sys
+import threading
+import time
+import numpy as np
+import client
+from capture_backends import SyntheticBackend
+from frame_encoder import EncoderPool
+
+# --- Synthetic Desktops ---
+# Each factory returns source(index) -> (BGRA bytes, damage) for SyntheticBackend. Damage is None so the
+# pipeline finds changes the same way it does for mss frames.
+def _desktop(width, height, rng):
+    frame = np.empty((height, width, 4), dtype=np.uint8); frame[:] = (165, 110, 58, 255) # Blue-ish wallpaper (BGRA)
+    window = (width // 8, height // 10, width * 7 // 8, height * 9 // 10)
+    frame[window[1]:window[3], window[0]:window[2]] = 255
+    frame[window[1]:window[1] + 28, window[0]:window[2]] = (64, 64, 64, 255) # Title bar
+    return frame, window
+
+def _text_block(width, height, rng, line=18, glyph=(8, 12)):
+    # Rows of dark glyph-sized blocks on white, with ragged line ends: close enough to text for the codecs
+    block = np.full((height, width, 4), 255, dtype=np.uint8)
+    for y in range(4, height - glyph[1], line):
+        length = rng.integers(width // 3, width - 8)
+        for x in range(8, length, glyph[0] + 1):
+            if rng.random() < 0.82: block[y:y + glyph[1], x:x + glyph[0], :3] = rng.integers(0, 60)
+    return block
+
+def static_desktop(width, height, seed=1):
+    rng = np.random.default_rng(seed); frame, window = _desktop(width, height, rng)
+    x0, y0, x1, y1 = window; frame[y0 + 36:y1 - 8, x0 + 8:x1 - 8] = _text_block(x1 - x0 - 16, y1 - y0 - 44, rng)
+    raw = frame.tobytes()
+    return lambda index: (raw, None)
+
+def scrolling_document(width, height, seed=1, pixels_per_frame=24):
+    rng = np.random.default_rng(seed); frame, window = _desktop(width, height, rng)
+    x0, y0, x1, y1 = window; view_h = y1 - y0 - 44
+    document = _text_block(x1 - x0 - 16, view_h * 4, rng)
+    def source(index):
+        top = (index * pixels_per_frame) % (document.shape[0] - view_h)
+        frame[y0 + 36:y1 - 8, x0 + 8:x1 - 8] = document[top:top + view_h]
+        return frame.tobytes(), None
+    return source
+
+def full_motion_video(width, height, seed=1):
+    rng = np.random.default_rng(seed); frame, window = _desktop(width, height, rng)
+    x0, y0, x1, y1 = window; vy0, vx0 = y0 + 28, x0
+    yy, xx = np.mgrid[0:y1 - vy0, 0:x1 - vx0]
+    def source(index):
+        # Smooth moving gradients plus sensor-like noise: every pixel changes, nothing compresses as flat colour
+        noise = rng.integers(0, 24, size=xx.shape, dtype=np.uint8)
+        video = frame[vy0:y1, vx0:x1]
+        video[..., 0] = ((xx + index * 5) % 256).astype(np.uint8) + noise
+        video[..., 1] = ((yy + index * 3) % 256).astype(np.uint8) + noise
+        video[..., 2] = (((xx + yy) // 2 + index * 7) % 256).astype(np.uint8)
+        return frame.tobytes(), None
+    return source
+
+def typing_editor(width, height, seed=1, glyph=(8, 12), line=18):
+    rng = np.random.default_rng(seed); frame, window = _desktop(width, height, rng)
+    x0, y0, x1, y1 = window; left, top, right, bottom = x0 + 16, y0 + 40, x1 - 16, y1 - 16
+    state = {'x': left, 'y': top}
+    def source(index):
+        # One new character per frame at the caret; the line wraps and the page clears when full
+        if rng.random() < 0.85: frame[state['y']:state['y'] + glyph[1], state['x']:state['x'] + glyph[0], :3] = rng.integers(0, 60)
+        state['x'] += glyph[0] + 1
+        if state['x'] + glyph[0] > right: state['x'] = left; state['y'] += line
+        if state['y'] + glyph[1] > bottom: state['y'] = top; frame[top:bottom, left:right] = 255
+        return frame.tobytes(), None
+    return source
+
+SCENARIOS = {'static': static_desktop, 'scroll': scrolling_document, 'video': full_motion_video, 'typing': typing_editor}
+
+
+# --- Server Stand-In ---
+class LoopbackServer:
+    # Takes the pipeline's emits in-process like app.py would relay them, optionally holding each emit for the
+    # time it would take on a link of link_kbps, and acks every frame after viewer_delay like a viewer painting it.
+    def __init__(self, link_kbps=0, viewer_delay=0.0):
+        self.link_kbps, self.viewer_delay = link_kbps, viewer_delay
+        self.pipeline = None; self.events = {}; self.bytes = 0
+
+    @staticmethod
+    def payload_bytes(event, data):
+        if isinstance(data, (bytes, bytearray)): return len(data)
+        if event == 'screen_update': return sum(len(tile[2]) for tile in data.get('tiles', []))
+        if event == 'screen_video': return sum(len(frame[2]) for frame in data.get('frames', []))
+        return len(json.dumps(data, default=str))
+
+    def emit(self, event, data=None):
+        nbytes = self.payload_bytes(event, data)
+        self.events[event] = self.events.get(event, 0) + 1; self.bytes += nbytes
+        if self.link_kbps: time.sleep(8 * nbytes / 1000 / self.link_kbps) # socket.io's emit blocks while the link drains
+        seq = data.get('seq') if isinstance(data, dict) else None
+        controller = self.pipeline.controller if self.pipeline else None
+        if seq is not None and controller:
+            if self.viewer_delay: threading.Timer(self.viewer_delay, controller.on_ack, (seq,)).start()
+            else: controller.on_ack(seq)
+
+
+# --- Runner ---
+# name -> pipeline kwargs plus client module settings to override while that configuration runs
+CONFIGS = {
+    'jpeg-full': {'delta': False, 'settings': {'PALETTE_MAX_COLORS': 0}},
+    'delta': {'delta': True, 'settings': {'PALETTE_MAX_COLORS': 0}},
+    'delta-palette': {'delta': True, 'settings': {'PALETTE_MAX_COLORS': 256}},
+    'delta-pool': {'delta': True, 'workers': 2, 'settings': {'PALETTE_MAX_COLORS': 256}},
+    'video-vp8': {'delta': True, 'video': 'vp8', 'settings': {'VIDEO_MODE': 'vp8'}},
+    'video-h264': {'delta': True, 'video': 'h264', 'settings': {'VIDEO_MODE': 'h264'}},
+    'adaptive-slow-link': {'delta': True, 'adaptive': True, 'link_kbps': 4000, 'viewer_delay': 0.05, 'settings': {}},
+}
+
+def percentile(samples, fraction):
+    if not samples: return 0.0
+    ordered = sorted(samples)
+    return round(1000 * ordered[min(len(ordered) - 1, int(fraction * (len(ordered) - 1) + 0.5))], 2)
+
+def run_benchmark(scenario, config_name, seconds=5.0, width=1920, height=1080, fps=30, quality=client.JPEG_QUALITY):
+    config = CONFIGS[config_name]
+    if config.get('video') and client.frame_encoder.av is None: return {'scenario': scenario, 'config': config_name, 'skipped': 'PyAV not installed'}
+    saved = {name: getattr(client, name) for name in config['settings']}; saved_codecs = client.viewer_codecs
+    for name, value in config['settings'].items(): setattr(client, name, value)
+    client.viewer_codecs = {config['video']} if config.get('video') else None
+    monitor = {'left': 0, 'top': 0, 'width': width, 'height': height}
+    server = LoopbackServer(config.get('link_kbps', 0), config.get('viewer_delay', 0.0))
+    pool = EncoderPool(config['workers'], width * height * 4) if config.get('workers') else None
+    try:
+        backend = SyntheticBackend(monitor, SCENARIOS[scenario](width, height))
+        deadline = time.time() + seconds
+        pipeline = make_pipeline(monitor, server.emit, lambda: time.time() < deadline, fps, quality, config, pool)
+        server.pipeline = pipeline
+        cpu_started, wall_started = time.process_time(), time.time()
+        pipeline.run(backend)
+        cpu, wall = time.process_time() - cpu_started, time.time() - wall_started
+    finally:
+        if pool: pool.close()
+        for name, value in saved.items(): setattr(client, name, value)
+        client.viewer_codecs = saved_codecs
+    frames = max(pipeline.frames_sent, 1)
+    result = {'scenario': scenario, 'config': config_name, 'captured': backend.index, 'sent': pipeline.frames_sent,
+              'fps': round(pipeline.frames_sent / wall, 2), 'kb_per_frame': round(pipeline.bytes_sent / frames / 1024, 2),
+              'cpu_ms_per_captured': round(1000 * cpu / max(backend.index, 1), 2), # Parent process only; pool workers are not counted
+              'cpu_ms_per_sent': round(1000 * cpu / frames, 2), # Static scenarios send few frames, so this one can run high
+              'dropped': dict(pipeline.stats()['dropped']), 'events': server.events}
+    for stage, timer in pipeline.timers.items():
+        samples = list(timer.samples)
+        result[stage] = {'p50_ms': percentile(samples, 0.5), 'p95_ms': percentile(samples, 0.95), 'p99_ms': percentile(samples, 0.99)}
+    if pipeline.controller: result['operating_point'] = {'quality': pipeline.quality, 'fps': pipeline.fps, 'scale': pipeline.scale}
+    return result
+
+def make_pipeline(monitor, emit, should_run, fps, quality, config, pool):
+    pipeline = client.CapturePipeline(monitor, emit, should_run, fps=fps, quality=quality, delta=config.get('delta', True),
+                                      pool=pool, adaptive=config.get('adaptive', False), stream_id=0)
+    for timer in pipeline.timers.values(): timer.samples = type(timer.samples)(maxlen=100000) # Keep every sample for percentiles
+    return pipeline
+
+def format_result(result):
+    if 'skipped' in result: return f"{result['scenario']:<8} {result['config']:<20} skipped: {result['skipped']}"
+    stages = '  '.join(f"{stage} {result[stage]['p50_ms']}/{result[stage]['p95_ms']}/{result[stage]['p99_ms']}"
+                       for stage in ('capture', 'encode', 'send', 'latency'))
+    return (f"{result['scenario']:<8} {result['config']:<20} {result['fps']:>6} fps  {result['kb_per_frame']:>8} KiB/frame  "
+            f"{result['cpu_ms_per_captured']:>7}/{result['cpu_ms_per_sent']:<7} cpu-ms captured/sent  [p50/p95/p99 ms] {stages}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the client capture pipeline on synthetic desktops.")
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    parser.add_argument('--fps', type=float, default=30, help="Target capture rate; set high to measure capacity")
+    parser.add_argument('--quality', type=int, default=client.JPEG_QUALITY)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--configs', default='jpeg-full,delta,delta-palette')
+    parser.add_argument('--json', help="Also write the results to this file")
+    args = parser.parse_args(argv)
+    client.PIPELINE_STATS_INTERVAL = 0 # The runner prints its own summary
+    results = []
+    for scenario in args.scenarios.split(','):
+        for config_name in args.configs.split(','):
+            if scenario not in SCENARIOS or config_name not in CONFIGS: print(f"Unknown scenario/config: {scenario}/{config_name}", file=sys.stderr); return 2
+            result = run_benchmark(scenario, config_name, args.seconds, args.width, args.height, args.fps, args.quality)
+            results.append(result); print(format_result(result), flush=True)
+    if args.json:
+        with open(args.json, 'w') as f: json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
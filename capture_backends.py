@@ -0,0 +1,289 @@
+# --- Screen Capture Backends ---
+# Every backend hands the capture pipeline BGRA frames for one monitor. Polling backends (mss, xshm) grab
+# whenever asked; damage-driven ones (xdamage) block in wait() until the X server reports changed pixels and
+# attach those rects to the frame so the encoder can skip the full-frame diff.
+# Backends are opened and used on a single thread (X connections and mss handles are not shared).
+import ctypes
+import ctypes.util
+import logging
+import platform
+import select
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Grab:
+    __slots__ = ('raw', 'width', 'height', 'damage')
+    def __init__(self, raw, width, height, damage=None):
+        self.raw, self.width, self.height = raw, width, height
+        self.damage = damage # List of (x0, y0, x1, y1) rects changed since the previous grab, or None if unknown
+
+
+class CaptureBackend:
+    name = None
+    event_driven = False # True if wait() blocks on change notifications instead of returning at once
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.region = None # Sub-rectangle to capture instead of the whole monitor (same keys as a monitor, absolute coordinates)
+
+    @property
+    def target(self): return self.region or self.monitor
+
+    def set_region(self, region): self.region = region # Takes effect on the next grab
+
+    def wait(self, timeout): return True # Whether a grab now could show something new
+    def grab(self): raise NotImplementedError
+    def close(self): pass
+
+
+class MssBackend(CaptureBackend):
+    name = 'mss'
+
+    def __init__(self, monitor):
+        super().__init__(monitor)
+        import mss
+        self._sct = mss.mss()
+        self._sct.with_cursor = False # Linux mss can composite the pointer into grabs; the cursor channel draws it instead
+
+    def grab(self):
+        sct_img = self._sct.grab(self.target)
+        return Grab(sct_img.raw, sct_img.width, sct_img.height)
+
+    def close(self): self._sct.close()
+
+
+# --- X11 (MIT-SHM / DAMAGE / XFIXES) via ctypes ---
+class _XImage(ctypes.Structure): # Leading fields of Xlib's XImage; only these are touched
+    _fields_ = (("width", ctypes.c_int), ("height", ctypes.c_int), ("xoffset", ctypes.c_int), ("format", ctypes.c_int),
+                ("data", ctypes.c_void_p), ("byte_order", ctypes.c_int), ("bitmap_unit", ctypes.c_int),
+                ("bitmap_bit_order", ctypes.c_int), ("bitmap_pad", ctypes.c_int), ("depth", ctypes.c_int),
+                ("bytes_per_line", ctypes.c_int), ("bits_per_pixel", ctypes.c_int))
+
+class _XShmSegmentInfo(ctypes.Structure):
+    _fields_ = (("shmseg", ctypes.c_ulong), ("shmid", ctypes.c_int), ("shmaddr", ctypes.c_void_p), ("readOnly", ctypes.c_int))
+
+class _XRectangle(ctypes.Structure):
+    _fields_ = (("x", ctypes.c_short), ("y", ctypes.c_short), ("width", ctypes.c_ushort), ("height", ctypes.c_ushort))
+
+class _XEvent(ctypes.Union):
+    _fields_ = (("type", ctypes.c_int), ("pad", ctypes.c_long * 24))
+
+_ZPIXMAP = 2
+_ALL_PLANES = 0xFFFFFFFF
+_IPC_PRIVATE, _IPC_CREAT, _IPC_RMID = 0, 0o1000, 0
+_X_DAMAGE_NOTIFY = 0
+_X_DAMAGE_REPORT_NON_EMPTY = 3
+_x_libs = None
+_x_libs_lock = threading.Lock()
+
+def _load_x_libs():
+    # Returns (x11, xext, libc, xdamage, xfixes); xdamage/xfixes may be None. Raises OSError if X11/Xext are missing.
+    global _x_libs
+    with _x_libs_lock:
+        if _x_libs is not None: return _x_libs
+        def load(name, required=True):
+            path = ctypes.util.find_library(name)
+            if not path:
+                if required: raise OSError(f"lib{name} not found")
+                return None
+            return ctypes.CDLL(path)
+        x11, xext, libc = load('X11'), load('Xext'), ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        xdamage, xfixes = load('Xdamage', False), load('Xfixes', False)
+        vp, ip, ul = ctypes.c_void_p, ctypes.c_int, ctypes.c_ulong
+        for fn, args, res in ((x11.XOpenDisplay, (ctypes.c_char_p,), vp), (x11.XCloseDisplay, (vp,), ip),
+                              (x11.XDefaultRootWindow, (vp,), ul), (x11.XDefaultScreen, (vp,), ip),
+                              (x11.XDefaultVisual, (vp, ip), vp), (x11.XDefaultDepth, (vp, ip), ip),
+                              (x11.XSync, (vp, ip), ip), (x11.XFree, (vp,), ip), (x11.XPending, (vp,), ip),
+                              (x11.XNextEvent, (vp, ctypes.POINTER(_XEvent)), ip), (x11.XConnectionNumber, (vp,), ip),
+                              (x11.XFlush, (vp,), ip),
+                              (xext.XShmQueryExtension, (vp,), ip),
+                              (xext.XShmCreateImage, (vp, vp, ctypes.c_uint, ip, ctypes.c_char_p, ctypes.POINTER(_XShmSegmentInfo),
+                                                      ctypes.c_uint, ctypes.c_uint), ctypes.POINTER(_XImage)),
+                              (xext.XShmAttach, (vp, ctypes.POINTER(_XShmSegmentInfo)), ip),
+                              (xext.XShmDetach, (vp, ctypes.POINTER(_XShmSegmentInfo)), ip),
+                              (xext.XShmGetImage, (vp, ul, ctypes.POINTER(_XImage), ip, ip, ul), ip),
+                              (libc.shmget, (ip, ctypes.c_size_t, ip), ip), (libc.shmat, (ip, vp, ip), vp),
+                              (libc.shmdt, (vp,), ip), (libc.shmctl, (ip, ip, vp), ip)):
+            fn.argtypes, fn.restype = args, res
+        if xdamage and xfixes:
+            for fn, args, res in ((xdamage.XDamageQueryExtension, (vp, ctypes.POINTER(ip), ctypes.POINTER(ip)), ip),
+                                  (xdamage.XDamageCreate, (vp, ul, ip), ul), (xdamage.XDamageDestroy, (vp, ul), None),
+                                  (xdamage.XDamageSubtract, (vp, ul, ul, ul), None),
+                                  (xfixes.XFixesCreateRegion, (vp, vp, ip), ul), (xfixes.XFixesDestroyRegion, (vp, ul), None),
+                                  (xfixes.XFixesFetchRegion, (vp, ul, ctypes.POINTER(ip)), ctypes.POINTER(_XRectangle))):
+                fn.argtypes, fn.restype = args, res
+        _x_libs = (x11, xext, libc, xdamage, xfixes)
+        return _x_libs
+
+
+class XShmBackend(CaptureBackend):
+    # XShmGetImage into one shared-memory segment created up front; each grab is a single server-side copy
+    # into that segment plus one copy out of it, with no per-frame XImage allocation or socket transfer.
+    name = 'xshm'
+
+    def __init__(self, monitor):
+        super().__init__(monitor)
+        self._x11, self._xext, self._libc, self._xdamage, self._xfixes = _load_x_libs()
+        self._display = self._x11.XOpenDisplay(None)
+        if not self._display: raise OSError("cannot open X display")
+        self._image = None; self._shminfo = _XShmSegmentInfo(shmid=-1); self._attached = False
+        try:
+            if not self._xext.XShmQueryExtension(self._display): raise OSError("MIT-SHM extension not available")
+            self._screen = self._x11.XDefaultScreen(self._display)
+            self._root = self._x11.XDefaultRootWindow(self._display)
+            self._create_image(monitor['width'], monitor['height'])
+        except Exception:
+            self.close(); raise
+
+    def _create_image(self, width, height):
+        self._image = self._xext.XShmCreateImage(self._display, self._x11.XDefaultVisual(self._display, self._screen),
+                                                 self._x11.XDefaultDepth(self._display, self._screen), _ZPIXMAP, None,
+                                                 ctypes.byref(self._shminfo), width, height)
+        if not self._image: raise OSError("XShmCreateImage failed")
+        image = self._image.contents
+        if image.bits_per_pixel != 32 or image.bytes_per_line != width * 4: raise OSError(f"unsupported X image layout ({image.bits_per_pixel} bpp)")
+        self._size = image.bytes_per_line * height
+        self._shminfo.shmid = self._libc.shmget(_IPC_PRIVATE, self._size, _IPC_CREAT | 0o600)
+        if self._shminfo.shmid < 0: raise OSError(ctypes.get_errno(), "shmget failed")
+        address = self._libc.shmat(self._shminfo.shmid, None, 0)
+        if address in (None, ctypes.c_void_p(-1).value): raise OSError(ctypes.get_errno(), "shmat failed")
+        self._shminfo.shmaddr = image.data = address; self._shminfo.readOnly = 0
+        if not self._xext.XShmAttach(self._display, ctypes.byref(self._shminfo)): raise OSError("XShmAttach failed")
+        self._x11.XSync(self._display, 0); self._attached = True
+        self._libc.shmctl(self._shminfo.shmid, _IPC_RMID, None) # Freed by the kernel once both sides detach
+
+    def _destroy_image(self):
+        if self._attached: self._xext.XShmDetach(self._display, ctypes.byref(self._shminfo)); self._x11.XSync(self._display, 0)
+        if self._shminfo.shmaddr: self._libc.shmdt(self._shminfo.shmaddr); self._shminfo.shmaddr = None
+        if self._shminfo.shmid >= 0 and not self._attached: self._libc.shmctl(self._shminfo.shmid, _IPC_RMID, None)
+        if self._image: self._image.contents.data = None; self._x11.XFree(self._image); self._image = None
+        self._attached = False; self._shminfo.shmid = -1
+
+    def set_region(self, region):
+        # The segment is sized to what is captured, so a new region means a new segment
+        super().set_region(region)
+        self._destroy_image(); self._create_image(self.target['width'], self.target['height'])
+
+    def _grab_raw(self):
+        target = self.target
+        if not self._xext.XShmGetImage(self._display, self._root, self._image, target['left'], target['top'], _ALL_PLANES):
+            raise OSError("XShmGetImage failed")
+        return ctypes.string_at(self._shminfo.shmaddr, self._size) # The pipeline keeps frames around, so copy out of the segment
+
+    def grab(self): return Grab(self._grab_raw(), self.target['width'], self.target['height'])
+
+    def close(self):
+        if self._display is None: return
+        self._destroy_image(); self._close_display()
+
+    def _close_display(self):
+        self._x11.XCloseDisplay(self._display); self._display = None
+
+
+class XDamageBackend(XShmBackend):
+    # Grabs only after the X server reports damage on the root window, and passes the damaged rects (clipped
+    # to the captured area, in its coordinates) along with the frame. Nothing is polled or grabbed while idle.
+    name = 'xdamage'
+    event_driven = True
+
+    def __init__(self, monitor):
+        super().__init__(monitor)
+        try:
+            if not (self._xdamage and self._xfixes): raise OSError("libXdamage/libXfixes not found")
+            event_base, error_base = ctypes.c_int(), ctypes.c_int()
+            if not self._xdamage.XDamageQueryExtension(self._display, ctypes.byref(event_base), ctypes.byref(error_base)):
+                raise OSError("DAMAGE extension not available")
+            self._damage_event = event_base.value + _X_DAMAGE_NOTIFY
+            self._damage = self._xdamage.XDamageCreate(self._display, self._root, _X_DAMAGE_REPORT_NON_EMPTY)
+            self._region = self._xfixes.XFixesCreateRegion(self._display, None, 0)
+            self._x11.XFlush(self._display)
+        except Exception:
+            self.close(); raise
+        self._fd = self._x11.XConnectionNumber(self._display)
+        self._event = _XEvent(); self._rects = []; self._pending = True # First grab is always a full frame
+
+    def _drain(self):
+        notified = False
+        while self._x11.XPending(self._display):
+            self._x11.XNextEvent(self._display, ctypes.byref(self._event))
+            if self._event.type == self._damage_event: notified = True
+        if not notified: return
+        # Take the accumulated damage and re-arm the NonEmpty notification in one request
+        self._xdamage.XDamageSubtract(self._display, self._damage, 0, self._region)
+        count = ctypes.c_int()
+        rects = self._xfixes.XFixesFetchRegion(self._display, self._region, ctypes.byref(count))
+        target = self.target; left, top, width, height = target['left'], target['top'], target['width'], target['height']
+        for i in range(count.value):
+            r = rects[i]
+            x0, y0 = max(r.x - left, 0), max(r.y - top, 0)
+            x1, y1 = min(r.x + r.width - left, width), min(r.y + r.height - top, height)
+            if x0 < x1 and y0 < y1: self._rects.append((x0, y0, x1, y1)); self._pending = True
+        if rects: self._x11.XFree(rects)
+
+    def wait(self, timeout):
+        self._drain()
+        deadline = time.time() + timeout
+        while not self._pending:
+            remaining = deadline - time.time()
+            if remaining <= 0: break
+            if select.select([self._fd], [], [], remaining)[0]: self._drain()
+        return self._pending
+
+    def grab(self):
+        self._drain()
+        damage = self._rects or None # The first grab and keyframe-forced grabs without damage fall back to diffing
+        self._rects = []; self._pending = False
+        return Grab(self._grab_raw(), self.target['width'], self.target['height'], damage)
+
+    def set_region(self, region):
+        super().set_region(region); self._rects = []; self._pending = True # Damage was clipped to the old area
+
+    def _close_display(self):
+        if getattr(self, '_region', None): self._xfixes.XFixesDestroyRegion(self._display, self._region); self._region = None
+        if getattr(self, '_damage', None): self._xdamage.XDamageDestroy(self._display, self._damage); self._damage = None
+        super()._close_display()
+
+
+class SyntheticBackend(CaptureBackend):
+    # Generated frames, for tests and benchmarks without a desktop. source(index) returns (raw, damage);
+    # the default draws a small square sliding across a grey background.
+    name = 'synthetic'
+
+    def __init__(self, monitor, source=None):
+        super().__init__(monitor)
+        self.index = 0
+        self._source = source or self._sliding_square
+
+    def _sliding_square(self, index):
+        width, height, size = self.monitor['width'], self.monitor['height'], 32
+        frame = bytearray(b'\x40\x40\x40\xff' * (width * height))
+        x0 = (index * 8) % max(1, width - size); y0 = height // 2 - size // 2
+        for y in range(max(0, y0), min(height, y0 + size)): frame[(y * width + x0) * 4:(y * width + x0 + size) * 4] = b'\x00\x80\xff\xff' * size
+        return bytes(frame), None
+
+    def grab(self):
+        raw, damage = self._source(self.index); self.index += 1
+        if self.region is None: return Grab(raw, self.monitor['width'], self.monitor['height'], damage)
+        # Sources draw whole monitors; crop rows out for a region (damage is unknown then)
+        stride = self.monitor['width'] * 4; x0 = (self.region['left'] - self.monitor['left']) * 4; width = self.region['width']
+        y0 = self.region['top'] - self.monitor['top']
+        rows = [raw[y * stride + x0:y * stride + x0 + width * 4] for y in range(y0, y0 + self.region['height'])]
+        return Grab(b''.join(rows), width, self.region['height'])
+
+
+BACKENDS = {backend.name: backend for backend in (MssBackend, XShmBackend, XDamageBackend, SyntheticBackend)}
+
+def open_backend(name, monitor):
+    # 'auto' prefers xdamage, then xshm, on Linux and uses mss everywhere else or when X extensions are missing
+    if name == 'auto': candidates = ['xdamage', 'xshm', 'mss'] if platform.system() == 'Linux' else ['mss']
+    elif name in BACKENDS: candidates = [name] if name in ('mss', 'synthetic') else [name, 'mss']
+    else: logger.warning(f"CAPTURE_BACKEND: Unknown backend '{name}', using mss."); candidates = ['mss']
+    for candidate in candidates:
+        try:
+            backend = BACKENDS[candidate](monitor)
+            logger.info(f"CAPTURE_BACKEND: Using {candidate} for monitor {monitor}"); return backend
+        except Exception as e: logger.warning(f"CAPTURE_BACKEND: {candidate} unavailable: {e}")
+    raise OSError("no capture backend available")
@@ -4,164 +4,68 @@ import os
 import io
 import threading
 import logging
+import collections
+import bisect
+import queue
 from PIL import Image
 import mss
+import frame_encoder
+import capture_backends
+import control_protocol
+import input_injection
+from frame_encoder import EncoderPool, FrameBuffers, VideoEncoder, encode_regions, make_video_frame
 # Note: PyAutoGUI is NOT imported by default, ctypes handles input on Windows
 import platform
 import sys
 import keyboard # For listening to local F2 press
 import random
+try: import numpy as np # Used for vectorized dirty-tile detection in delta mode
+except ImportError: np = None
+
+# --- Logging Setup ---
+log_format = '%(asctime)s - %(threadName)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
+logging.basicConfig(level=logging.INFO, format=log_format, stream=sys.stdout)
+logger = logging.getLogger(__name__)
 
 # --- Ctypes for Windows Low-Level Input ---
 if platform.system() == "Windows":
     import ctypes
     import ctypes.wintypes as wintypes # Use alias for clarity
 
-    # Define constants first
-    INPUT_MOUSE = 0
-    INPUT_KEYBOARD = 1
-    INPUT_HARDWARE = 2
-
-    KEYEVENTF_KEYDOWN = 0x0000 # Technically it's 0 for keydown
-    KEYEVENTF_EXTENDEDKEY = 0x0001
-    KEYEVENTF_KEYUP = 0x0002
-    KEYEVENTF_UNICODE = 0x0004
-    KEYEVENTF_SCANCODE = 0x0008
-
-    MAPVK_VK_TO_VSC = 0
-
-    MOUSEEVENTF_MOVE = 0x0001
-    MOUSEEVENTF_ABSOLUTE = 0x8000
-    MOUSEEVENTF_LEFTDOWN = 0x0002
-    MOUSEEVENTF_LEFTUP = 0x0004
-    MOUSEEVENTF_RIGHTDOWN = 0x0008
-    MOUSEEVENTF_RIGHTUP = 0x0010
-    MOUSEEVENTF_MIDDLEDOWN = 0x0020
-    MOUSEEVENTF_MIDDLEUP = 0x0040
-    MOUSEEVENTF_WHEEL = 0x0800
-    WHEEL_DELTA = 120
-
-    # Define Structures
-    ULONG_PTR = ctypes.POINTER(wintypes.ULONG)
-
-    class MOUSEINPUT(ctypes.Structure):
-        _fields_ = (("dx", wintypes.LONG),
-                    ("dy", wintypes.LONG),
-                    ("mouseData", wintypes.DWORD),
-                    ("dwFlags", wintypes.DWORD),
-                    ("time", wintypes.DWORD),
-                    ("dwExtraInfo", ULONG_PTR))
-
-    class KEYBDINPUT(ctypes.Structure):
-        _fields_ = (("wVk", wintypes.WORD),
-                    ("wScan", wintypes.WORD),
-                    ("dwFlags", wintypes.DWORD),
-                    ("time", wintypes.DWORD),
-                    ("dwExtraInfo", ULONG_PTR))
-
-    class HARDWAREINPUT(ctypes.Structure):
-        _fields_ = (("uMsg", wintypes.DWORD),
-                    ("wParamL", wintypes.WORD),
-                    ("wParamH", wintypes.WORD))
-
-    # Redefine Union correctly
-    class _INPUT_UNION(ctypes.Union):
-        _fields_ = (("mi", MOUSEINPUT),
-                    ("ki", KEYBDINPUT),
-                    ("hi", HARDWAREINPUT))
-
-    class INPUT(ctypes.Structure):
-        _fields_ = (("type", wintypes.DWORD), # The type identifier
-                    ("union", _INPUT_UNION)) # Embed the union
-
-    # Define SendInput function prototype
-    SendInput = ctypes.windll.user32.SendInput
-    SendInput.argtypes = (wintypes.UINT, ctypes.POINTER(INPUT), ctypes.c_int)
-    SendInput.restype = wintypes.UINT
-
-    # Define GetSystemMetrics if needed for absolute mouse coords
-    GetSystemMetrics = ctypes.windll.user32.GetSystemMetrics
-    SM_CXSCREEN = 0
-    SM_CYSCREEN = 1
+    # SendInput structures, virtual-desktop metrics and batching live in input_injection.py
 
     # MapVirtualKey for Scan Code conversion if needed (advanced)
     MapVirtualKeyA = ctypes.windll.user32.MapVirtualKeyA
     MapVirtualKeyA.argtypes = (wintypes.UINT, wintypes.UINT)
     MapVirtualKeyA.restype = wintypes.UINT
 
-
-    # --- Corrected Helper Functions ---
-
-    def _create_input(input_type, input_union):
-        inp = INPUT()
-        inp.type = wintypes.DWORD(input_type)
-        inp.union = input_union
-        # Set dwExtraInfo to 0 explicitly
-        if input_type == INPUT_MOUSE: inp.union.mi.dwExtraInfo = ULONG_PTR(wintypes.ULONG(0))
-        elif input_type == INPUT_KEYBOARD: inp.union.ki.dwExtraInfo = ULONG_PTR(wintypes.ULONG(0))
-        return inp
-
-    def _send_inputs(inputs):
-        nInputs = len(inputs)
-        LPINPUT = INPUT * nInputs
-        pInputs = LPINPUT(*inputs)
-        cbSize = ctypes.c_int(ctypes.sizeof(INPUT))
-        return SendInput(nInputs, pInputs, cbSize)
-
-    def press_key_ctypes(vk_code):
-        ki = KEYBDINPUT(wVk=wintypes.WORD(vk_code), wScan=0, dwFlags=KEYEVENTF_KEYDOWN, time=0)
-        inp = _create_input(INPUT_KEYBOARD, _INPUT_UNION(ki=ki))
-        _send_inputs([inp])
-
-    def release_key_ctypes(vk_code):
-        ki = KEYBDINPUT(wVk=wintypes.WORD(vk_code), wScan=0, dwFlags=KEYEVENTF_KEYUP, time=0)
-        inp = _create_input(INPUT_KEYBOARD, _INPUT_UNION(ki=ki))
-        _send_inputs([inp])
-
-    def type_char_ctypes(char): # Accepts character string
-        char_code = ord(char)
-        # Key down using Unicode
-        ki_down = KEYBDINPUT(wVk=0, wScan=wintypes.WORD(char_code), dwFlags=KEYEVENTF_UNICODE, time=0)
-        inp_down = _create_input(INPUT_KEYBOARD, _INPUT_UNION(ki=ki_down))
-        # Key up using Unicode
-        ki_up = KEYBDINPUT(wVk=0, wScan=wintypes.WORD(char_code), dwFlags=KEYEVENTF_UNICODE | KEYEVENTF_KEYUP, time=0)
-        inp_up = _create_input(INPUT_KEYBOARD, _INPUT_UNION(ki=ki_up))
-        _send_inputs([inp_down, inp_up])
-
-    def move_mouse_ctypes(x, y, absolute=True):
-        flags = MOUSEEVENTF_MOVE
-        dx_val, dy_val = x, y
-        if absolute:
-            screen_width = GetSystemMetrics(SM_CXSCREEN)
-            screen_height = GetSystemMetrics(SM_CYSCREEN)
-            if screen_width == 0 or screen_height == 0:
-                 logger.error("CTYPES_MOUSE_MOVE: Failed to get screen metrics."); return
-            dx_val = int(x * 65535 / screen_width)
-            dy_val = int(y * 65535 / screen_height)
-            flags |= MOUSEEVENTF_ABSOLUTE
-
-        mi = MOUSEINPUT(dx=wintypes.LONG(dx_val), dy=wintypes.LONG(dy_val), mouseData=0, dwFlags=wintypes.DWORD(flags), time=0)
-        inp = _create_input(INPUT_MOUSE, _INPUT_UNION(mi=mi))
-        _send_inputs([inp])
-
-    def click_mouse_ctypes(button='left'):
-        down_flag, up_flag = 0, 0
-        if button == 'left': down_flag, up_flag = MOUSEEVENTF_LEFTDOWN, MOUSEEVENTF_LEFTUP
-        elif button == 'right': down_flag, up_flag = MOUSEEVENTF_RIGHTDOWN, MOUSEEVENTF_RIGHTUP
-        elif button == 'middle': down_flag, up_flag = MOUSEEVENTF_MIDDLEDOWN, MOUSEEVENTF_MIDDLEUP
-        else: logger.warning(f"CTYPES_CLICK: Unknown button '{button}'"); return
-
-        mi_down = MOUSEINPUT(dx=0, dy=0, mouseData=0, dwFlags=wintypes.DWORD(down_flag), time=0)
-        inp_down = _create_input(INPUT_MOUSE, _INPUT_UNION(mi=mi_down))
-        mi_up = MOUSEINPUT(dx=0, dy=0, mouseData=0, dwFlags=wintypes.DWORD(up_flag), time=0)
-        inp_up = _create_input(INPUT_MOUSE, _INPUT_UNION(mi=mi_up))
-        _send_inputs([inp_down, inp_up])
-
-    def scroll_mouse_ctypes(amount): # Server sends dy > 0 for scroll DOWN. SendInput needs negative mouseData for DOWN.
-        send_input_amount = int(amount * -WHEEL_DELTA) # Invert and multiply by standard delta
-        mi = MOUSEINPUT(dx=0, dy=0, mouseData=wintypes.DWORD(send_input_amount), dwFlags=MOUSEEVENTF_WHEEL, time=0)
-        inp = _create_input(INPUT_MOUSE, _INPUT_UNION(mi=mi))
-        _send_inputs([inp])
+    # Cursor position/shape for the separate cursor channel (frames are captured without the pointer)
+    class CURSORINFO(ctypes.Structure):
+        _fields_ = (("cbSize", wintypes.DWORD),
+                    ("flags", wintypes.DWORD),
+                    ("hCursor", wintypes.HANDLE),
+                    ("ptScreenPos", wintypes.POINT))
+    CURSOR_SHOWING = 0x0001
+    GetCursorInfo = ctypes.windll.user32.GetCursorInfo
+    GetCursorInfo.argtypes = (ctypes.POINTER(CURSORINFO),)
+    GetCursorInfo.restype = wintypes.BOOL
+    LoadCursorW = ctypes.windll.user32.LoadCursorW
+    LoadCursorW.argtypes = (wintypes.HINSTANCE, ctypes.c_void_p)
+    LoadCursorW.restype = wintypes.HANDLE
+    # Shared system cursor handles (IDC_*) -> CSS cursor names the viewer can show; other cursors fall back to 'default'
+    CURSOR_CSS_NAMES = {}
+    for _idc, _css in ((32512, 'default'), (32513, 'text'), (32514, 'wait'), (32515, 'crosshair'), (32642, 'nwse-resize'),
+                       (32643, 'nesw-resize'), (32644, 'ew-resize'), (32645, 'ns-resize'), (32646, 'move'), (32648, 'not-allowed'),
+                       (32649, 'pointer'), (32650, 'progress'), (32651, 'help')):
+        _handle = LoadCursorW(None, ctypes.c_void_p(_idc))
+        if _handle: CURSOR_CSS_NAMES[_handle] = _css
+    _cursor_info = CURSORINFO(cbSize=ctypes.sizeof(CURSORINFO)) # Reused by every poll
+
+
+    def get_cursor_state_ctypes(): # (x, y, css_shape, visible) in virtual-screen pixels, or None
+        if not GetCursorInfo(ctypes.byref(_cursor_info)): return None
+        return (_cursor_info.ptScreenPos.x, _cursor_info.ptScreenPos.y, CURSOR_CSS_NAMES.get(_cursor_info.hCursor, 'default'),
+                bool(_cursor_info.flags & CURSOR_SHOWING))
 
     # --- VK Code Definitions & Map ---
     VK_LBUTTON = 0x01; VK_RBUTTON = 0x02; VK_MBUTTON = 0x04; VK_BACK = 0x08; VK_TAB = 0x09;
@@ -198,27 +102,48 @@ if platform.system() == "Windows":
 else: # Non-Windows systems
     logger.warning("Non-Windows system detected. Low-level ctypes input will not be used.")
     # Define stub functions to prevent errors if called
-    def press_key_ctypes(vk_code_name): logger.warning(f"CTYPES_STUB: Press {vk_code_name} (no-op)")
-    def release_key_ctypes(vk_code_name): logger.warning(f"CTYPES_STUB: Release {vk_code_name} (no-op)")
-    def type_char_ctypes(char): logger.warning(f"CTYPES_STUB: Type {char} (no-op)")
-    def move_mouse_ctypes(x,y,absolute=True): logger.warning(f"CTYPES_STUB: Move mouse to {x},{y} (no-op)")
-    def click_mouse_ctypes(button='left'): logger.warning(f"CTYPES_STUB: Click {button} (no-op)")
-    def scroll_mouse_ctypes(amount): logger.warning(f"CTYPES_STUB: Scroll {amount} (no-op)")
+    def get_cursor_state_ctypes(): return None
     CTYPES_VK_MAP = {}
 
 
-# --- Logging Setup ---
-log_format = '%(asctime)s - %(threadName)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'
-logging.basicConfig(level=logging.INFO, format=log_format, stream=sys.stdout)
-logger = logging.getLogger(__name__)
-
 # --- Configuration ---
 SERVER_URL = os.environ.get('REMOTE_SERVER_URL', 'https://newspoogunicorn-worker-class-eventlet-w.onrender.com')
 ACCESS_PASSWORD = os.environ.get('REMOTE_ACCESS_PASSWORD', '1')
+HOST_ID = os.environ.get('HOST_ID', '') or platform.node() # Name viewers pick this PC by on a relay serving many hosts; must be unique per relay
 CLIENT_TARGET_FPS = int(os.environ.get('CLIENT_TARGET_FPS', 7))
 JPEG_QUALITY = int(os.environ.get('JPEG_QUALITY', 65))
 CAPTURE_MONITOR_INDEX = int(os.environ.get('CAPTURE_MONITOR_INDEX', 1))
+CAPTURE_MONITORS = os.environ.get('CAPTURE_MONITORS', str(CAPTURE_MONITOR_INDEX)) # Comma-separated mss indexes streamed concurrently, or 'all'
+BACKGROUND_FPS = float(os.environ.get('BACKGROUND_FPS', 0.5)) # Rate for displays no viewer is looking at
+CAPTURE_BACKEND = os.environ.get('CAPTURE_BACKEND', 'mss').lower() # mss, xshm, xdamage (Linux, grabs only on X damage), synthetic or auto
 LIST_MONITORS_ONLY = os.environ.get('LIST_MONITORS_ONLY', 'false').lower() == 'true'
+CAPTURE_PATH_BENCH_ONLY = os.environ.get('CAPTURE_PATH_BENCH_ONLY', 'false').lower() == 'true' # Compare old/new capture->JPEG path and exit
+CAPTURE_PATH_BENCH_FRAMES = int(os.environ.get('CAPTURE_PATH_BENCH_FRAMES', 30))
+DELTA_MODE = os.environ.get('DELTA_MODE', 'true').lower() == 'true' # Send only changed tiles between keyframes
+DELTA_TILE_SIZE = int(os.environ.get('DELTA_TILE_SIZE', 64)) # Multiple of 16 keeps JPEG blocks aligned to tile edges
+KEYFRAME_INTERVAL = float(os.environ.get('KEYFRAME_INTERVAL', 10.0)) # Seconds between forced full frames
+PALETTE_MAX_COLORS = int(os.environ.get('PALETTE_MAX_COLORS', 256)) # Regions with at most this many colours go out as lossless PNG (0 = JPEG only)
+DELTA_MAX_DIRTY_RATIO = float(os.environ.get('DELTA_MAX_DIRTY_RATIO', 0.5)) # Above this share of changed tiles send a keyframe instead
+VIDEO_MODE = os.environ.get('VIDEO_MODE', 'off').lower() # 'vp8' or 'h264' streams inter-frame video (needs PyAV) to viewers that can decode it
+VIDEO_BITRATE_KBPS = int(os.environ.get('VIDEO_BITRATE_KBPS', 2500)) # At JPEG_QUALITY; scaled with the adaptive quality
+VIDEO_MAX_BACKLOG_FRAMES = int(os.environ.get('VIDEO_MAX_BACKLOG_FRAMES', 15)) # Unsent video frames merged into one packet before dropping
+ENCODER_POOL_WORKERS = int(os.environ.get('ENCODER_POOL_WORKERS', 0)) # >0 encodes frames in that many worker processes
+VIEWPORT_SCALING = os.environ.get('VIEWPORT_SCALING', 'true').lower() == 'true' # Downscale to the largest viewer viewport
+ADAPTIVE_MODE = os.environ.get('ADAPTIVE_MODE', 'true').lower() == 'true' # Trade quality/FPS/scale for latency on slow links
+ADAPTIVE_LATENCY_TARGET_MS = float(os.environ.get('ADAPTIVE_LATENCY_TARGET_MS', 300)) # Capture -> viewer ack round trip to hold
+ADAPTIVE_INTERVAL = float(os.environ.get('ADAPTIVE_INTERVAL', 1.0)) # Seconds between controller decisions
+ADAPTIVE_MIN_QUALITY = int(os.environ.get('ADAPTIVE_MIN_QUALITY', 30))
+ADAPTIVE_MAX_QUALITY = int(os.environ.get('ADAPTIVE_MAX_QUALITY', JPEG_QUALITY))
+ADAPTIVE_MIN_FPS = float(os.environ.get('ADAPTIVE_MIN_FPS', 2))
+ADAPTIVE_MAX_FPS = float(os.environ.get('ADAPTIVE_MAX_FPS', CLIENT_TARGET_FPS))
+ADAPTIVE_MIN_SCALE = float(os.environ.get('ADAPTIVE_MIN_SCALE', 1.0)) # <1.0 lets the controller downscale frames as a last resort
+CURSOR_CHANNEL = os.environ.get('CURSOR_CHANNEL', 'true').lower() == 'true' # Report pointer position/shape as its own event; viewers draw it locally
+CURSOR_POLL_HZ = float(os.environ.get('CURSOR_POLL_HZ', 60)) # Pointer polls per second; an event is only sent when something changed
+ROI_FPS = float(os.environ.get('ROI_FPS', 15)) # Frame rate while a viewer has zoomed into a region
+ROI_QUALITY = int(os.environ.get('ROI_QUALITY', 85)) # JPEG quality for zoomed regions, which are always sent at native resolution
+LATENCY_TRACING = os.environ.get('LATENCY_TRACING', 'true').lower() == 'true' # Stamp frames with server-clock times for per-hop latency stats
+CLOCK_SYNC_INTERVAL = float(os.environ.get('CLOCK_SYNC_INTERVAL', 60.0)) # Seconds between server clock offset measurements
+PIPELINE_STATS_INTERVAL = float(os.environ.get('PIPELINE_STATS_INTERVAL', 30.0)) # Seconds between per-stage timing logs (0 disables)
 SCROLL_SENSITIVITY_VERTICAL = 20 # Unused with ctypes scroll, sensitivity is OS defined
 SCROLL_SENSITIVITY_HORIZONTAL = 20 # Unused with ctypes scroll
 
@@ -229,6 +154,7 @@ is_typing_active = False
 is_typing_paused = False
 typing_thread_obj: threading.Thread | None = None
 typing_stop_event = threading.Event()
+typing_batch = input_injection.InputBatch() # Owned by the typing thread
 
 BASE_TYPING_INTERVAL = 0.12
 TYPING_INTERVAL_VARIATION = 0.06
@@ -237,6 +163,10 @@ BACKSPACE_PAUSE_MIN = 0.15
 BACKSPACE_PAUSE_MAX = 0.4
 CORRECTION_PAUSE_MIN = 0.1
 CORRECTION_PAUSE_MAX = 0.3
+BULK_TYPING = os.environ.get('BULK_TYPING', 'false').lower() == 'true' # Inject the whole text as pre-built SendInput batches (no pacing or mistakes)
+BULK_TYPING_BATCH = int(os.environ.get('BULK_TYPING_BATCH', 512)) # INPUT records per SendInput call
+BULK_TYPING_PAUSE = float(os.environ.get('BULK_TYPING_PAUSE', 0.005)) # Seconds between batches so the target app drains its queue
+BULK_TYPING_PROGRESS_INTERVAL = 0.5 # Seconds between typing_progress reports
 
 local_key_listener_stop_event = threading.Event()
 
@@ -246,7 +176,12 @@ is_registered = False
 screen_capture_stop_event = threading.Event()
 capture_thread_obj: threading.Thread | None = None
 local_key_listener_thread_obj: threading.Thread | None = None
-selected_monitor_details: dict | None = None
+stream_monitors: dict = {} # Stream id (mss monitor index) -> monitor geometry, for mapping input coordinates
+active_pipelines: dict = {} # Stream id -> running CapturePipeline, for server events that tune it
+active_stream_ids: set | None = None # Streams some viewer is displaying, from the server; None = not reported yet
+viewer_viewport: tuple | None = None # Largest (w, h) any viewer displays, from the server; None = native
+viewer_codecs: set | None = None # Video codecs every connected viewer can decode, from the server
+server_clock_offset = 0.0 # Seconds to add to time.time() to get the server's clock, from sync_server_clock()
 
 # --- PyAutoGUI Key Name Mapping (Used for translating server commands) ---
 # Map from JS Event Key Name -> PyAutoGUI Key Name
@@ -285,6 +220,7 @@ def execute_typing_task():
     if platform.system() != "Windows":
         logger.error("TYPING_TASK_ERROR: ctypes-based typing is only supported on Windows."); is_typing_active=False; return
 
+    if BULK_TYPING: return execute_bulk_typing_task()
     logger.info(f"TYPING_TASK_START (ctypes): Typing {len(remaining_text_to_type)} chars.")
     text_buffer = list(remaining_text_to_type); remaining_text_to_type = ""
 
@@ -318,30 +254,27 @@ def execute_typing_task():
                     wrong_char = get_nearby_char(char_to_type)
                     if wrong_char != char_to_type:
                         logger.debug(f"TYPING_MISTAKE (WRONG_CHAR_CTYPES): Intended '{char_to_type}', typed '{wrong_char}'")
-                        type_char_ctypes(wrong_char) # Type mistake
+                        typing_batch.char(wrong_char); typing_batch.flush() # Type mistake
                         time.sleep(random.uniform(BACKSPACE_PAUSE_MIN, BACKSPACE_PAUSE_MAX))
-                        press_key_ctypes(VK_BACK); release_key_ctypes(VK_BACK) # Backspace
+                        typing_batch.press(VK_BACK); typing_batch.flush() # Backspace
                         time.sleep(random.uniform(CORRECTION_PAUSE_MIN, CORRECTION_PAUSE_MAX))
-                        type_char_ctypes(char_to_type) # Type correct char immediately
+                        typing_batch.char(char_to_type); typing_batch.flush() # Type correct char immediately
                         made_mistake_and_corrected = True
                 elif mistake_type == 'extra_char_corrected':
                     extra_wrong_char = get_nearby_char(char_to_type)
                     if extra_wrong_char == char_to_type and char_to_type.isalpha(): extra_wrong_char = random.choice('estnriola')
                     logger.debug(f"TYPING_MISTAKE (EXTRA_CHAR_CTYPES): Intended '{char_to_type}', typed '{char_to_type}{extra_wrong_char}'")
-                    type_char_ctypes(char_to_type) # Type correct
+                    typing_batch.char(char_to_type); typing_batch.flush() # Type correct
                     time.sleep(random.uniform(0.01, 0.05))
-                    type_char_ctypes(extra_wrong_char) # Type extra wrong char
+                    typing_batch.char(extra_wrong_char); typing_batch.flush() # Type extra wrong char
                     time.sleep(random.uniform(BACKSPACE_PAUSE_MIN, BACKSPACE_PAUSE_MAX))
-                    press_key_ctypes(VK_BACK); release_key_ctypes(VK_BACK) # Backspace extra
+                    typing_batch.press(VK_BACK); typing_batch.flush() # Backspace extra
                     time.sleep(random.uniform(CORRECTION_PAUSE_MIN, CORRECTION_PAUSE_MAX))
                     made_mistake_and_corrected = True
             
             if not made_mistake_and_corrected:
                 # Type normally if no mistake or correction occurred
-                if char_to_type == '\n': press_key_ctypes(VK_RETURN); release_key_ctypes(VK_RETURN)
-                elif char_to_type == '\t': press_key_ctypes(VK_TAB); release_key_ctypes(VK_TAB)
-                # Add other special chars if needed (\r, etc.)
-                else: type_char_ctypes(char_to_type)
+                typing_batch.char(char_to_type); typing_batch.flush() # \n and \t go as VK_RETURN/VK_TAB
             
             current_interval = BASE_TYPING_INTERVAL + random.uniform(-TYPING_INTERVAL_VARIATION, TYPING_INTERVAL_VARIATION)
             time.sleep(max(0.02, current_interval))
@@ -353,6 +286,41 @@ def execute_typing_task():
     finally:
         is_typing_active = False
 
+def execute_bulk_typing_task():
+    # Fast path for large pastes: the text becomes one INPUT array up front and goes out BULK_TYPING_BATCH records per
+    # SendInput call. Stop and pause are honoured between batches, which always end on a character boundary, so a
+    # stopped task leaves exactly the untyped characters in remaining_text_to_type.
+    global remaining_text_to_type, is_typing_active
+    text = remaining_text_to_type; remaining_text_to_type = ""
+    done = 0 # Characters fully injected
+    try:
+        inputs, starts = input_injection.build_text_inputs(text)
+        logger.info(f"TYPING_BULK_START: {len(text)} chars as {len(inputs)} inputs, {BULK_TYPING_BATCH} per batch.")
+        started = last_report = time.time(); report_typing_progress(0, len(text))
+        while done < len(text):
+            if typing_stop_event.is_set(): logger.info("TYPING_BULK_STOP_EVENT"); break
+            if is_typing_paused: time.sleep(0.1); continue
+            end = max(bisect.bisect_right(starts, starts[done] + BULK_TYPING_BATCH) - 1, done + 1) # Whole characters only
+            count = starts[end] - starts[done]
+            sent = input_injection.send_input_slice(inputs, starts[done], count) if count else 0
+            if sent != count: # Blocked (UIPI, secure desktop); keep the rest for a retry
+                logger.error(f"TYPING_BULK_ERROR: SendInput took {sent}/{count} inputs, error {input_injection.last_error()}"); break
+            done = end
+            if time.time() - last_report >= BULK_TYPING_PROGRESS_INTERVAL: last_report = time.time(); report_typing_progress(done, len(text))
+            if BULK_TYPING_PAUSE: time.sleep(BULK_TYPING_PAUSE)
+        report_typing_progress(done, len(text))
+        if done == len(text): logger.info(f"TYPING_BULK_COMPLETE: {len(text)} chars in {time.time() - started:.2f}s.")
+    except Exception as e:
+        logger.error(f"TYPING_BULK_ERROR: {e}", exc_info=True)
+    finally:
+        remaining_text_to_type = text[done:]; is_typing_active = False
+
+def report_typing_progress(done, total):
+    logger.info(f"TYPING_PROGRESS: {done}/{total} chars")
+    if sio.connected and is_registered:
+        try: sio.emit('typing_progress', {'done': done, 'total': total})
+        except Exception as e: logger.debug(f"TYPING_PROGRESS_EMIT_ERROR: {e}")
+
 
 # --- Local F2 Key Press Handler (Manages Typing Task) ---
 # (This function on_local_f2_press remains THE SAME as the previous version)
@@ -408,7 +376,7 @@ def local_key_listener_loop():
 # are IDENTICAL to the previous version. `on_command` is below.
 
 @sio.event
-def connect(): sio.emit('register_client', {'token': ACCESS_PASSWORD})
+def connect(): sio.emit('register_client', {'token': ACCESS_PASSWORD, 'host': HOST_ID})
 @sio.event
 def connect_error(data): logger.error(f"CLIENT_SOCKET_CONNECT_ERROR: {data}"); global is_registered; is_registered=False; screen_capture_stop_event.set();
 @sio.event
@@ -441,73 +409,684 @@ def on_receive_injection_text(data):
     text_to_inject_globally = new_text
     logger.info(f"CLIENT_INJECT_TEXT_SET: Text for local F2 updated: '{text_to_inject_globally[:30]}...'")
 
+def pipelines_for(data): # Pipelines an event addresses: its 'stream' if given, else all of them
+    stream = data.get('stream') if isinstance(data, dict) else None
+    pipelines = dict(active_pipelines)
+    return [pipelines[stream]] if stream in pipelines else ([] if stream is not None else list(pipelines.values()))
+
+@sio.on('request_keyframe')
+def on_request_keyframe(data=None):
+    for pipeline in pipelines_for(data): pipeline.keyframe_request.set()
+
+@sio.on('frame_ack')
+def on_frame_ack(data):
+    if not isinstance(data, dict) or data.get('seq') is None: return
+    for pipeline in pipelines_for(data):
+        if pipeline.controller: pipeline.controller.on_ack(data['seq'])
+
+@sio.on('viewport_update')
+def on_viewport_update(data):
+    global viewer_viewport
+    viewer_viewport = (int(data['w']), int(data['h'])) if data and data.get('w') and data.get('h') else None
+    logger.info(f"CLIENT_VIEWPORT_UPDATE: {viewer_viewport or 'native'}")
+    for pipeline in list(active_pipelines.values()): pipeline.set_viewport(viewer_viewport)
+
+@sio.on('active_streams')
+def on_active_streams(data):
+    global active_stream_ids
+    streams = data.get('streams') if isinstance(data, dict) else None
+    active_stream_ids = set(streams) if isinstance(streams, list) else None
+    logger.info(f"CLIENT_ACTIVE_STREAMS: {sorted(active_stream_ids) if active_stream_ids is not None else 'all'}")
+    for stream_id, pipeline in list(active_pipelines.items()): pipeline.set_active(active_stream_ids is None or stream_id in active_stream_ids)
+
+@sio.on('set_roi')
+def on_set_roi(data):
+    if not isinstance(data, dict): return
+    for pipeline in pipelines_for(data): pipeline.set_roi(data.get('rect'))
+
+@sio.on('stream_codecs')
+def on_stream_codecs(data):
+    global viewer_codecs
+    codecs = data.get('codecs') if isinstance(data, dict) else None
+    viewer_codecs = set(codecs) if codecs else None
+    logger.info(f"CLIENT_STREAM_CODECS: Viewers can decode {sorted(viewer_codecs) if viewer_codecs else 'no video codecs'}")
+
 @sio.on('command')
-def on_command(data: dict): # USES CTYPES FOR INPUT ON WINDOWS
-    global selected_monitor_details
-    if not is_registered: return
+def on_command(data: dict): # Legacy JSON control_command, one event per message
+    if not is_registered or not isinstance(data, dict): return
+    event = control_protocol.from_command(data)
+    if event: run_input_events(data.get('stream'), [event])
 
+@sio.on('control_batch')
+def on_control_batch(data): # Binary batch of viewer input events, see control_protocol.py
+    if not is_registered: return
+    # Returning acks the batch; the relay holds newer input (merging superseded moves) until then
+    try: stream, events = control_protocol.decode_batch(data)
+    except ValueError as e: logger.warning(f"CLIENT_CONTROL_BATCH_INVALID: {e}"); return
+    run_input_events(stream, [(kind, arg, a, b, control_protocol.key_name(a) if kind in (control_protocol.KEY_DOWN, control_protocol.KEY_UP) else None)
+                              for kind, arg, _dt, a, b in control_protocol.coalesce_moves(events)])
+
+def run_input_events(stream, events): # USES CTYPES FOR INPUT ON WINDOWS
+    # events: [(kind, arg, a, b, key)] as control_protocol defines them; a, b are x, y for pointer events
     if platform.system() != "Windows":
-        logger.debug(f"CTYPES_COMMAND: Ignoring command {data} on non-Windows.")
+        logger.debug(f"CTYPES_COMMAND: Ignoring {len(events)} input events on non-Windows.")
         return # Only process commands on Windows with ctypes
+    input_executor.submit(stream, events)
+
+def inject_input_event(stream, event): # Runs on the input executor thread
+    kind, arg, a, b, key = event
+    if kind == control_protocol.KEY_DOWN:
+        if key is None or key == "F2": return # F2 from server does nothing for typing
+        pyautogui_key_name = map_key_to_pyautogui_name(key)
+        if pyautogui_key_name:
+            vk_code = CTYPES_VK_MAP.get(pyautogui_key_name.lower())
+            if vk_code: input_batch.key(vk_code)
+            # else: logger.debug(f"CTYPES_KEYDOWN: No VK_MAP for '{pyautogui_key_name}'.") # Can be noisy
+    elif kind == control_protocol.KEY_UP:
+        pyautogui_key_name = map_key_to_pyautogui_name(key) if key is not None else None
+        if pyautogui_key_name:
+            vk_code = CTYPES_VK_MAP.get(pyautogui_key_name.lower())
+            if vk_code: input_batch.key(vk_code, up=True)
+            # else: logger.debug(f"CTYPES_KEYUP: No VK_MAP for '{pyautogui_key_name}'.")
+    elif kind == control_protocol.SCROLL:
+        if b: input_batch.scroll(b) # Server dy>0 is scroll down
+    elif kind in (control_protocol.MOVE, control_protocol.CLICK) and a is not None and b is not None:
+        # Coordinates are relative to the display the viewer clicked on; without a stream id use the first one
+        monitor = stream_monitors.get(stream) or next(iter(stream_monitors.values()), None)
+        pipeline = active_pipelines.get(stream) or next(iter(active_pipelines.values()), None)
+        roi = pipeline.roi if pipeline else None # A zoomed viewer sends coordinates within the region
+        x = a + (monitor.get('left', 0) if monitor else 0) + (roi[0] if roi else 0)
+        y = b + (monitor.get('top', 0) if monitor else 0) + (roi[1] if roi else 0)
+        input_batch.move(x, y) # A click moves first to ensure the correct position
+        if kind == control_protocol.CLICK:
+            input_batch.flush(); time.sleep(0.02) # Small delay after move before click; only the input thread waits
+            input_batch.click(control_protocol.BUTTONS[arg] if arg < len(control_protocol.BUTTONS) else 'left')
+    input_batch.flush()
+
+
+# --- Delta Tile Helpers ---
+def find_dirty_tiles(prev_raw, cur_raw, width, height, tile, scratch=None):
+    # Compares two BGRA buffers one uint32 per pixel and reduces the change mask to a [rows, cols] tile grid.
+    # scratch, if given, is a reusable bool array of shape (height, width) for the per-pixel mask.
+    prev_px = np.frombuffer(prev_raw, dtype=np.uint32).reshape(height, width)
+    cur_px = np.frombuffer(cur_raw, dtype=np.uint32).reshape(height, width)
+    changed = np.not_equal(prev_px, cur_px, out=scratch if scratch is not None and scratch.shape == (height, width) else None)
+    changed = np.logical_or.reduceat(changed, np.arange(0, height, tile), axis=0)
+    return np.logical_or.reduceat(changed, np.arange(0, width, tile), axis=1)
+
+def damage_tiles(damage, width, height, tile):
+    # Damage rects reported by the capture backend -> the same [rows, cols] tile grid find_dirty_tiles produces
+    dirty = np.zeros((-(-height // tile), -(-width // tile)), dtype=bool)
+    for x0, y0, x1, y1 in damage: dirty[y0 // tile:-(-y1 // tile), x0 // tile:-(-x1 // tile)] = True
+    return dirty
+
+def dirty_tile_rects(dirty, width, height, tile):
+    # Merges runs of dirty tiles in a row, then stacks identical runs from consecutive rows, into pixel rects (x0, y0, x1, y1)
+    rects = []; open_runs = {} # (c0, c1) -> index in rects of a run that reached the previous row
+    for r in range(dirty.shape[0]):
+        cols = np.flatnonzero(dirty[r]); row_runs = {}
+        if cols.size:
+            breaks = np.flatnonzero(np.diff(cols) > 1)
+            starts = np.concatenate((cols[:1], cols[breaks + 1])); ends = np.concatenate((cols[breaks], cols[-1:]))
+            y0 = r * tile; y1 = min(y0 + tile, height)
+            for c0, c1 in zip(starts.tolist(), ends.tolist()):
+                idx = open_runs.get((c0, c1))
+                if idx is not None: x0, ry0, x1, _ = rects[idx]; rects[idx] = (x0, ry0, x1, y1)
+                else: idx = len(rects); rects.append((c0 * tile, y0, min((c1 + 1) * tile, width), y1))
+                row_runs[(c0, c1)] = idx
+        open_runs = row_runs
+    return rects
+
+# --- Latency Tracing ---
+def server_ms(t): return round((t + server_clock_offset) * 1000) # Local time.time() -> server clock, epoch ms
+
+def sync_server_clock(samples=5):
+    # NTP-style: the lowest round trip of a few clock_sync calls gives the tightest offset estimate
+    global server_clock_offset
+    best = None
+    for _ in range(samples):
+        try:
+            sent = time.time(); reply = sio.call('clock_sync', {}, timeout=5); received = time.time()
+        except Exception as e: logger.warning(f"CLOCK_SYNC_ERROR: {e}"); return
+        if not isinstance(reply, dict) or 't' not in reply: return
+        if best is None or received - sent < best[0]: best = (received - sent, reply['t'] / 1000.0 - (sent + received) / 2)
+    server_clock_offset = best[1]
+    logger.info(f"CLOCK_SYNC: offset {1000 * server_clock_offset:.1f} ms, rtt {1000 * best[0]:.1f} ms")
+
+def clock_sync_loop(should_run):
+    while should_run():
+        sync_server_clock()
+        deadline = time.time() + CLOCK_SYNC_INTERVAL
+        while should_run() and time.time() < deadline: time.sleep(1)
+
+# --- Capture Pipeline ---
+# capture -> [LatestSlot] -> encode -> [LatestSlot] -> send, each stage on its own thread so a slow emit
+# never stalls the next grab. Slots hold one item and an unconsumed item is replaced (drop-oldest).
+class LatestSlot:
+    def __init__(self):
+        self._cond = threading.Condition(); self._item = None; self.dropped = 0
+
+    def put(self, item, merge=None): # Returns the superseded item, if any
+        # merge(old, new) may fold an unconsumed item into the new one instead of dropping it; None means drop
+        with self._cond:
+            superseded = self._item
+            if superseded is not None and merge is not None:
+                merged = merge(superseded, item)
+                if merged is not None: item, superseded = merged, None
+            if superseded is not None: self.dropped += 1
+            self._item = item; self._cond.notify()
+            return superseded
+
+    def get(self, timeout):
+        with self._cond:
+            if self._item is None: self._cond.wait(timeout)
+            item = self._item; self._item = None
+            return item
+
+
+class StageTimer:
+    def __init__(self, window=300):
+        self.samples = collections.deque(maxlen=window); self.count = 0; self.total = 0.0
+
+    def add(self, seconds): self.samples.append(seconds); self.count += 1; self.total += seconds
+
+    def summary(self): # Milliseconds over the recent window
+        if not self.samples: return {'count': self.count, 'avg_ms': 0.0, 'p95_ms': 0.0, 'max_ms': 0.0}
+        ordered = sorted(self.samples)
+        return {'count': self.count, 'avg_ms': round(1000 * sum(ordered) / len(ordered), 2),
+                'p95_ms': round(1000 * ordered[int(0.95 * (len(ordered) - 1))], 2), 'max_ms': round(1000 * ordered[-1], 2)}
+
+
+# --- Input Executor ---
+# Socket.IO handlers only enqueue; one thread injects in arrival order, so SendInput and the move->click pause never
+# hold up pings, acks or other events on the network thread. A move is skipped when the next queued event is
+# another move or a click, so a backlog jumps straight to the latest pointer position.
+class InputExecutor:
+    def __init__(self):
+        self._queue = collections.deque() # (enqueued at, stream, event)
+        self._ready = threading.Condition(); self._thread = None
+        self.latency = StageTimer() # Enqueued -> injected, per event
+        self.inject = StageTimer() # Time spent injecting, per event
+        self.max_depth = 0; self.coalesced = 0; self._last_stats = time.time()
+
+    def submit(self, stream, events):
+        enqueued = time.perf_counter()
+        with self._ready:
+            self._queue.extend((enqueued, stream, event) for event in events)
+            self.max_depth = max(self.max_depth, len(self._queue))
+            if not (self._thread and self._thread.is_alive()):
+                self._thread = threading.Thread(target=self._run, name="InputExecutorThread", daemon=True); self._thread.start()
+            self._ready.notify()
+
+    def _next(self):
+        with self._ready:
+            while not self._queue: self._ready.wait()
+            item = self._queue.popleft()
+            while item[2][0] == control_protocol.MOVE and self._queue and self._queue[0][2][0] in (control_protocol.MOVE, control_protocol.CLICK):
+                item = self._queue.popleft(); self.coalesced += 1
+            return item
+
+    def _run(self):
+        while True:
+            enqueued, stream, event = self._next()
+            started = time.perf_counter()
+            try: inject_input_event(stream, event)
+            except Exception as e: logger.error(f"CLIENT_CMD_ERROR (ctypes): Processing {event}: {e}", exc_info=True)
+            done = time.perf_counter(); self.inject.add(done - started); self.latency.add(done - enqueued)
+            if PIPELINE_STATS_INTERVAL and time.time() - self._last_stats >= PIPELINE_STATS_INTERVAL:
+                self._last_stats = time.time()
+                with self._ready: depth, max_depth, self.max_depth = len(self._queue), self.max_depth, len(self._queue)
+                logger.info(f"INPUT_STATS: latency {self.latency.summary()} inject {self.inject.summary()} "
+                            f"queue {depth} (max {max_depth}) coalesced moves {self.coalesced}")
+
+input_executor = InputExecutor()
+input_batch = input_injection.InputBatch() # Owned by the input executor thread
+
+
+class CapturedFrame:
+    __slots__ = ('raw', 'width', 'height', 'captured_at', 'damage', 'roi')
+    def __init__(self, raw, width, height, captured_at, damage=None, roi=None):
+        self.raw, self.width, self.height, self.captured_at = raw, width, height, captured_at
+        self.damage = damage # Changed rects since the previous capture if the backend knows them, else None (diff against it)
+        self.roi = roi # (x, y, w, h) within the monitor if this is a zoomed region, else None
+
+    @staticmethod
+    def merge(old, new):
+        # A frame superseded before encoding takes its damage with it; unknown damage on either side means diff
+        if (old.damage is None and new.damage is None) or old.roi != new.roi: return None
+        damage = old.damage + new.damage if old.damage is not None and new.damage is not None else None
+        return CapturedFrame(new.raw, new.width, new.height, new.captured_at, damage, new.roi)
+
+
+class EncodePlan: # What the encode stage decided to send for one captured frame
+    __slots__ = ('seq', 'width', 'height', 'key', 'rects', 'dirty', 'quality', 'size', 'video', 'roi')
+    def __init__(self, seq, width, height, key, rects, dirty, quality, size, video=None, roi=None):
+        self.seq, self.width, self.height, self.key, self.rects, self.dirty = seq, width, height, key, rects, dirty
+        self.quality, self.size = quality, size # size is the scaled (w, h) or None for native
+        self.video = video # Video codec name when this frame goes through the inter-frame encoder
+        self.roi = roi # Zoomed region the frame shows, passed on to the viewer
+
+
+class EncodedFrame:
+    __slots__ = ('event', 'payload', 'seq', 'key', 'dirty', 'nbytes', 'captured_at')
+    def __init__(self, event, payload, seq, key, dirty, nbytes, captured_at):
+        self.event, self.payload, self.seq, self.key, self.dirty, self.nbytes, self.captured_at = event, payload, seq, key, dirty, nbytes, captured_at
+
+
+class AdaptiveController:
+    # Holds capture->ack latency near a target: backs off quality first, then FPS, then scale, and
+    # recovers in the reverse order once latency stays well under target.
+    def __init__(self, quality, fps, scale=1.0):
+        self.quality, self.fps, self.scale = quality, fps, scale
+        self._lock = threading.Lock()
+        self._sent = collections.OrderedDict() # seq -> captured_at, for frames awaiting a viewer ack
+        self._latencies = []; self._emit_seconds = []; self._bytes = 0; self._frames = 0
+        self._acks_seen = False; self._calm_ticks = 0; self.last_report = {}
+
+    def on_sent(self, seq, nbytes, captured_at, emit_seconds):
+        with self._lock:
+            self._bytes += nbytes; self._frames += 1; self._emit_seconds.append(emit_seconds)
+            if seq is not None:
+                self._sent[seq] = captured_at
+                while len(self._sent) > 256: self._sent.popitem(last=False)
+
+    def on_ack(self, seq):
+        with self._lock:
+            captured_at = self._sent.pop(seq, None)
+            if captured_at is None: return # Already acked by another viewer, or too old
+            self._acks_seen = True; self._latencies.append(time.time() - captured_at)
+            for older in [s for s in self._sent if s < seq]: self._sent.pop(older) # Superseded before they were painted
+
+    def update(self, interval):
+        # Returns the new operating point if it changed, else None
+        with self._lock:
+            latencies, emit_seconds = sorted(self._latencies), self._emit_seconds
+            nbytes, frames = self._bytes, self._frames
+            oldest_unacked = next(iter(self._sent.values()), None) if self._acks_seen else None
+            self._latencies, self._emit_seconds, self._bytes, self._frames = [], [], 0, 0
+        target = ADAPTIVE_LATENCY_TARGET_MS / 1000.0
+        latency = latencies[len(latencies) // 2] if latencies else None
+        if oldest_unacked is not None and time.time() - oldest_unacked > 2 * target: # Acks stopped arriving: link is backed up
+            latency = max(latency or 0.0, time.time() - oldest_unacked)
+        emit_avg = sum(emit_seconds) / len(emit_seconds) if emit_seconds else 0.0
+        congested = (latency is not None and latency > 1.2 * target) or emit_avg > 1.0 / self.fps
+        calm = not congested and (latency is None or latency < 0.5 * target)
+        previous = (self.quality, self.fps, self.scale)
+        if congested:
+            self._calm_ticks = 0
+            if self.quality > ADAPTIVE_MIN_QUALITY: self.quality = max(ADAPTIVE_MIN_QUALITY, self.quality - 10)
+            elif self.fps > ADAPTIVE_MIN_FPS: self.fps = max(ADAPTIVE_MIN_FPS, round(self.fps * 0.75, 2))
+            elif self.scale > ADAPTIVE_MIN_SCALE: self.scale = max(ADAPTIVE_MIN_SCALE, round(self.scale - 0.15, 2))
+        elif calm:
+            self._calm_ticks += 1
+            if self._calm_ticks >= 3:
+                self._calm_ticks = 0
+                if self.scale < 1.0: self.scale = min(1.0, round(self.scale + 0.1, 2))
+                elif self.fps < ADAPTIVE_MAX_FPS: self.fps = min(ADAPTIVE_MAX_FPS, self.fps + 1)
+                elif self.quality < ADAPTIVE_MAX_QUALITY: self.quality = min(ADAPTIVE_MAX_QUALITY, self.quality + 5)
+        else: self._calm_ticks = 0
+        self.last_report = {'quality': self.quality, 'fps': self.fps, 'scale': self.scale,
+                            'latency_ms': round(1000 * latency) if latency is not None else None,
+                            'emit_ms': round(1000 * emit_avg, 1), 'kbps': round(8 * nbytes / 1000 / interval, 1),
+                            'avg_frame_kb': round(nbytes / frames / 1024, 1) if frames else 0.0}
+        return self.last_report if (self.quality, self.fps, self.scale) != previous else None
+
+
+class CapturePipeline:
+    def __init__(self, monitor, emit, should_run, fps=CLIENT_TARGET_FPS, quality=JPEG_QUALITY, delta=DELTA_MODE, pool=None, adaptive=ADAPTIVE_MODE, stream_id=None):
+        self.monitor, self.emit, self.should_run, self.stream_id = monitor, emit, should_run, stream_id
+        self.keyframe_request = threading.Event(); self.keyframe_request.set() # Set when a viewer needs a full frame (e.g. it just joined)
+        self.active = True # False while no viewer displays this stream; it then captures at BACKGROUND_FPS
+        self._wake = threading.Event() # Cuts a long background-rate sleep short when the stream becomes active
+        self.roi = None # (x, y, w, h) region a viewer zoomed into, captured at native resolution; None = whole monitor
+        self._roi_request = None; self._roi_changed = False # Applied to the backend on the capture thread
+        self.fps, self.quality, self.scale = fps, quality, 1.0 # Current operating point, read by the stages every frame
+        self.viewport = viewer_viewport if VIEWPORT_SCALING else None
+        self.controller = AdaptiveController(quality, fps) if adaptive else None
+        self.delta = delta and np is not None
+        self.palette_colors = min(PALETTE_MAX_COLORS, 256) if self.delta else 0 # Codec-tagged tiles need the screen_update format
+        self.video_mode = VIDEO_MODE if VIDEO_MODE in VideoEncoder.CODECS and frame_encoder.av is not None else None
+        if VIDEO_MODE != 'off' and not self.video_mode: logger.warning(f"CAPTURE_PIPELINE_VIDEO: VIDEO_MODE={VIDEO_MODE} unavailable (unknown codec or PyAV missing), using tiles.")
+        self.pool = pool # Optional EncoderPool; frames it can't take are encoded inline
+        self.timers = {'capture': StageTimer(), 'encode': StageTimer(), 'send': StageTimer(), 'latency': StageTimer()} # latency: grab -> emitted
+        self.encode_slot, self.send_slot = LatestSlot(), LatestSlot()
+        self.frames_sent = 0; self.bytes_sent = 0
+        # Encoder state (encode thread only)
+        self._prev_raw = None; self._prev_size = None; self._prev_out_size = None; self._last_keyframe_time = 0.0; self._seq = 0
+        self._buffers = FrameBuffers(); self._diff_scratch = None # Reused across frames to keep the encode path allocation-free
+        self._prev_video = None; self._video_encoder = None; self._video_seq = 0; self._video_failed = False
+        # Pool jobs in submission order; the collect stage waits on the head so frames are sent in order
+        self._in_flight = queue.Queue(maxsize=max(1, 2 * getattr(pool, 'workers', 1)))
+        self._carry_lock = threading.Lock()
+        self._carry_dirty = None # Tiles of a superseded delta packet that still have to reach the viewer
+
+    def stats(self):
+        stats = {name: timer.summary() for name, timer in self.timers.items()}
+        stats['dropped'] = {'encode': self.encode_slot.dropped, 'send': self.send_slot.dropped}
+        stats['frames_sent'] = self.frames_sent; stats['bytes_sent'] = self.bytes_sent
+        return stats
+
+    def run(self, backend):
+        # Runs the capture stage on the calling thread with a capture_backends backend; encode and send get their own threads
+        workers = [threading.Thread(target=self._encode_stage, name="FrameEncodeThread", daemon=True),
+                   threading.Thread(target=self._send_stage, name="FrameSendThread", daemon=True)]
+        if self.pool: workers.append(threading.Thread(target=self._collect_stage, name="FrameCollectThread", daemon=True))
+        for worker in workers: worker.start()
+        try: self._capture_stage(backend)
+        finally:
+            for worker in workers: worker.join(timeout=2.0)
+
+    def _capture_stage(self, backend):
+        next_capture = time.time(); last_stats = last_adapt = time.time()
+        while self.should_run():
+            now = time.time()
+            if now < next_capture: self._wake.wait(next_capture - now); self._wake.clear()
+            fps = (max(self.fps, ROI_FPS) if self.roi else self.fps) if self.active else min(self.fps, BACKGROUND_FPS)
+            next_capture = max(next_capture + 1.0 / fps, time.time())
+            try:
+                if self._roi_changed: self._apply_roi(backend)
+                # Damage-driven backends block here while nothing changes; the FPS pacing above still caps the rate
+                if backend.wait(0.5) or self.keyframe_request.is_set():
+                    started = time.perf_counter()
+                    grabbed = backend.grab()
+                    frame = CapturedFrame(grabbed.raw, grabbed.width, grabbed.height, time.time(), grabbed.damage, self.roi)
+                    self.timers['capture'].add(time.perf_counter() - started)
+                    self.encode_slot.put(frame, merge=CapturedFrame.merge)
+            except Exception as e: logger.error(f"CAPTURE_STAGE_ERROR: {e}"); time.sleep(0.1)
+            if self.controller and time.time() - last_adapt >= ADAPTIVE_INTERVAL:
+                self._adapt(time.time() - last_adapt); last_adapt = time.time()
+            if PIPELINE_STATS_INTERVAL and time.time() - last_stats >= PIPELINE_STATS_INTERVAL:
+                last_stats = time.time(); logger.info(f"PIPELINE_STATS: {self.stats()}")
+
+    def _encode_stage(self):
+        while self.should_run():
+            frame = self.encode_slot.get(timeout=0.5)
+            if frame is None: continue
+            try:
+                started = time.perf_counter()
+                plan = self._plan(frame)
+                if plan is None: self.timers['encode'].add(time.perf_counter() - started); continue
+                if plan.video:
+                    self._drain_in_flight()
+                    encoded = self._encode_video(frame, plan)
+                    self.timers['encode'].add(time.perf_counter() - started)
+                    if encoded is not None: self._publish(encoded)
+                    continue
+                if self.pool and self.pool.fits(plan.width, plan.height):
+                    try: future = self.pool.submit(frame.raw, plan.width, plan.height, plan.rects, plan.quality, plan.size, self.palette_colors, DELTA_TILE_SIZE)
+                    except Exception as e: logger.error(f"ENCODE_STAGE_POOL_ERROR: {e}. Encoding inline from now on."); self.pool = None; future = None
+                    if future is not None:
+                        self._in_flight.put((future, plan, frame.captured_at, started)); continue
+                self._drain_in_flight() # Pool busy or gone: older frames still in the pool must be published first
+                img = self._buffers.load(frame.raw, plan.width, plan.height)
+                tiles = encode_regions(img, plan.rects, plan.quality, plan.size, self._buffers.output, self.palette_colors, DELTA_TILE_SIZE)
+                self.timers['encode'].add(time.perf_counter() - started)
+                self._publish(self._package(plan, tiles, frame.captured_at))
+            except Exception as e: logger.error(f"ENCODE_STAGE_ERROR: {e}"); self.keyframe_request.set(); time.sleep(0.1)
+
+    def _collect_stage(self):
+        while self.should_run():
+            try: future, plan, captured_at, started = self._in_flight.get(timeout=0.5)
+            except queue.Empty: continue
+            try:
+                try: tiles = future.result(timeout=10)
+                except Exception as e: logger.error(f"COLLECT_STAGE_ERROR: Frame {plan.seq}: {e}"); self.keyframe_request.set(); continue
+                self.timers['encode'].add(time.perf_counter() - started)
+                self._publish(self._package(plan, tiles, captured_at))
+            finally: self._in_flight.task_done()
+
+    def _drain_in_flight(self):
+        # Blocks the encode stage until every pool job has been published, so a frame encoded inline can't overtake them
+        with self._in_flight.all_tasks_done:
+            while self._in_flight.unfinished_tasks and self.should_run(): self._in_flight.all_tasks_done.wait(0.1)
+
+    def _adapt(self, interval):
+        point = self.controller.update(interval)
+        if point is None: return
+        self.quality, self.fps, self.scale = point['quality'], point['fps'], point['scale']
+        logger.info(f"ADAPTIVE_POINT[{self.stream_id}]: {point}")
+        try: self.emit('stream_status', dict(point, stream=self.stream_id))
+        except Exception as e: logger.warning(f"ADAPTIVE_REPORT_ERROR: {e}")
+
+    def set_viewport(self, viewport):
+        self.viewport = viewport if VIEWPORT_SCALING else None
+
+    def set_roi(self, rect):
+        # rect = [x, y, w, h] in native monitor pixels, or None to go back to the whole monitor
+        if rect is not None:
+            try: x, y, w, h = (int(v) for v in rect)
+            except (TypeError, ValueError): logger.warning(f"ROI_INVALID: {rect}"); return
+            mw, mh = self.monitor['width'], self.monitor['height']
+            x, y = min(max(0, x), mw - 16), min(max(0, y), mh - 16)
+            rect = (x, y, min(max(16, w), mw - x), min(max(16, h), mh - y))
+        self._roi_request = rect; self._roi_changed = True; self._wake.set()
+
+    def _apply_roi(self, backend):
+        self._roi_changed = False; roi = self._roi_request
+        region = None if roi is None else {'left': self.monitor['left'] + roi[0], 'top': self.monitor['top'] + roi[1], 'width': roi[2], 'height': roi[3]}
+        try: backend.set_region(region)
+        except Exception as e: logger.error(f"ROI_ERROR[{self.stream_id}]: {backend.name} cannot capture {roi}: {e}"); backend.set_region(None); roi = None
+        self.roi = roi; self.keyframe_request.set() # Same-size regions elsewhere on screen would otherwise be diffed
+        logger.info(f"ROI[{self.stream_id}]: {roi or 'whole monitor'}")
+
+    def set_active(self, active):
+        if active and not self.active: self.keyframe_request.set(); self._wake.set() # Viewer switched to it: full frame right away
+        self.active = active
+
+    @property
+    def video_codec(self): # Video only while every viewer can decode it; otherwise tiles
+        codecs = viewer_codecs
+        return self.video_mode if self.video_mode and not self._video_failed and codecs and self.video_mode in codecs else None
+
+    def _plan(self, frame):
+        width, height = frame.width, frame.height
+        scale = self.scale if frame.roi is None else 1.0 # Zoomed regions are the point of zooming: always native
+        quality = self.quality if frame.roi is None else max(self.quality, ROI_QUALITY)
+        if self.viewport and frame.roi is None: # Fit inside the viewport like object-fit: contain, rounded up to 5% steps so small resizes don't force keyframes
+            fit = min(self.viewport[0] / width, self.viewport[1] / height)
+            scale = min(scale, -int(-fit * 20) / 20)
+        out_size = (max(16, round(width * scale)), max(16, round(height * scale))) if scale < 1.0 else None
+        video = self.video_codec
+        self._seq += 1
+        if not self.delta and not video: return EncodePlan(self._seq, width, height, True, None, None, quality, out_size, roi=frame.roi)
+
+        is_keyframe = (self._prev_size != (width, height) or self._prev_out_size != out_size or self._prev_video != video
+                       or self.keyframe_request.is_set() or (self.delta and self._prev_raw is None)
+                       or time.time() - self._last_keyframe_time >= KEYFRAME_INTERVAL)
+        dirty = rects = None; changed = True
+        if not is_keyframe and self.delta:
+            if self._diff_scratch is None or self._diff_scratch.shape != (height, width): self._diff_scratch = np.empty((height, width), dtype=bool)
+            if frame.damage is not None: dirty = damage_tiles(frame.damage, width, height, DELTA_TILE_SIZE) # Backend already knows what changed
+            else: dirty = find_dirty_tiles(self._prev_raw, frame.raw, width, height, DELTA_TILE_SIZE, self._diff_scratch)
+            with self._carry_lock: carry, self._carry_dirty = self._carry_dirty, None
+            if carry is not None:
+                if carry.shape == dirty.shape: dirty |= carry
+                else: is_keyframe = True
+            if video: changed = bool(dirty.any()); dirty = None # The video codec finds its own changes; tiles only gate whether to encode
+            elif dirty.mean() > DELTA_MAX_DIRTY_RATIO: is_keyframe = True
+            else: rects = dirty_tile_rects(dirty, width, height, DELTA_TILE_SIZE); changed = bool(rects)
+        self._prev_raw, self._prev_size, self._prev_out_size, self._prev_video = frame.raw, (width, height), out_size, video
+        if not is_keyframe and not changed: self._seq -= 1; return None # Nothing changed
+        if is_keyframe:
+            self.keyframe_request.clear(); self._last_keyframe_time = time.time(); dirty = rects = None
+            with self._carry_lock: self._carry_dirty = None
+        return EncodePlan(self._seq, width, height, is_keyframe, rects, dirty, quality, out_size, video, frame.roi)
+
+    def _encode_video(self, frame, plan):
+        out_width, out_height = plan.size or (plan.width, plan.height)
+        out_width, out_height = out_width - out_width % 2, out_height - out_height % 2 # yuv420p needs even dimensions
+        bitrate = int(VIDEO_BITRATE_KBPS * 1000 * plan.quality / max(1, JPEG_QUALITY))
+        try:
+            encoder, force_key = self._video_encoder, plan.key
+            if (encoder is None or (encoder.codec, encoder.width, encoder.height) != (plan.video, out_width, out_height)
+                    or abs(encoder.bitrate - bitrate) > 0.2 * encoder.bitrate): # PyAV can't retarget bitrate on an open encoder
+                encoder = self._video_encoder = VideoEncoder(plan.video, out_width, out_height, bitrate, max(1, int(self.fps * KEYFRAME_INTERVAL)))
+                force_key = True
+            data, is_key = encoder.encode(make_video_frame(frame.raw, plan.width, plan.height, self._buffers), force_key)
+        except Exception as e:
+            logger.error(f"VIDEO_ENCODE_ERROR: {e}. Falling back to tiles."); self._video_failed = True; self._video_encoder = None
+            self.keyframe_request.set(); return None
+        if data is None: return None
+        self._video_seq += 1
+        # frames is a list so unsent packets can be merged losslessly; vseq lets the viewer spot gaps and ask for a keyframe
+        packet = {'stream': self.stream_id, 'seq': plan.seq, 'codec': plan.video, 'w': out_width, 'h': out_height, 'nw': plan.width, 'nh': plan.height,
+                  'frames': [[self._video_seq, is_key, data]]}
+        if plan.roi: packet['roi'] = list(plan.roi)
+        if LATENCY_TRACING: packet['ts'] = {'cap': server_ms(frame.captured_at), 'enc': server_ms(time.time())}
+        return EncodedFrame('screen_video', packet, plan.seq, is_key, None, len(data), frame.captured_at)
+
+    @staticmethod
+    def _merge_video(old, new):
+        # Inter-frame packets depend on their predecessors, so a superseded one is folded into the next
+        # instead of dropped, up to VIDEO_MAX_BACKLOG_FRAMES; a keyframe makes the backlog moot.
+        if old.event != 'screen_video' or new.event != 'screen_video' or new.key: return None
+        frames = old.payload['frames'] + new.payload['frames']
+        if len(frames) > VIDEO_MAX_BACKLOG_FRAMES: return None
+        return EncodedFrame('screen_video', dict(new.payload, frames=frames), new.seq, old.key, None, old.nbytes + new.nbytes, new.captured_at)
+
+    def _package(self, plan, tiles, captured_at):
+        if not self.delta: return EncodedFrame('screen_data_bytes', tiles[0][2], None, True, None, len(tiles[0][2]), captured_at)
+        out_width, out_height = plan.size or (plan.width, plan.height)
+        # w/h size the viewer canvas; nw/nh are native pixels, which is what mouse coordinates map to
+        packet = {'stream': self.stream_id, 'seq': plan.seq, 'w': out_width, 'h': out_height, 'nw': plan.width, 'nh': plan.height, 'key': plan.key, 'tiles': tiles}
+        if plan.roi: packet['roi'] = list(plan.roi) # nw/nh are then the region's size; input is region-relative
+        if LATENCY_TRACING: packet['ts'] = {'cap': server_ms(captured_at), 'enc': server_ms(time.time())} # Server relays and viewer echo these back
+        return EncodedFrame('screen_update', packet, plan.seq, plan.key, plan.dirty, sum(len(t[2]) for t in tiles), captured_at)
+
+    def _publish(self, encoded):
+        superseded = self.send_slot.put(encoded, merge=self._merge_video if encoded.event == 'screen_video' else None)
+        if superseded is None: return
+        if superseded.event == 'screen_video':
+            if not encoded.key: self.keyframe_request.set() # Backlog overflowed; the viewer will see a vseq gap until the next keyframe
+            return
+        if superseded.event != 'screen_update': return
+        if superseded.key or superseded.dirty is None: self.keyframe_request.set(); return
+        with self._carry_lock:
+            if self._carry_dirty is not None and self._carry_dirty.shape == superseded.dirty.shape: self._carry_dirty |= superseded.dirty
+            else: self._carry_dirty = superseded.dirty
+
+    def _send_stage(self):
+        while self.should_run():
+            encoded = self.send_slot.get(timeout=0.5)
+            if encoded is None: continue
+            try:
+                started = time.perf_counter()
+                if isinstance(encoded.payload, dict) and 'ts' in encoded.payload: encoded.payload['ts']['sent'] = server_ms(time.time())
+                self.emit(encoded.event, encoded.payload)
+                emit_seconds = time.perf_counter() - started
+                self.timers['send'].add(emit_seconds); self.timers['latency'].add(time.time() - encoded.captured_at)
+                if self.controller: self.controller.on_sent(encoded.seq, encoded.nbytes, encoded.captured_at, emit_seconds)
+                self.frames_sent += 1; self.bytes_sent += encoded.nbytes
+            except Exception as e: logger.error(f"SEND_STAGE_EMIT_ERROR: {e}"); self.keyframe_request.set(); time.sleep(1)
 
-    action = data.get('action')
-    abs_x, abs_y = data.get('x'), data.get('y')
-    if selected_monitor_details and abs_x is not None and abs_y is not None:
-        abs_x += selected_monitor_details.get('left', 0); abs_y += selected_monitor_details.get('top', 0)
 
+# --- Screen Capture Loop ---
+def parse_capture_monitors(monitors):
+    # CAPTURE_MONITORS -> list of valid mss indexes; 'all' means every physical display (index 0 is the combined virtual screen)
+    if CAPTURE_MONITORS.strip().lower() == 'all': return list(range(1, len(monitors))) or [0]
+    indexes = []
+    for part in CAPTURE_MONITORS.split(','):
+        try: index = int(part)
+        except ValueError: logger.warning(f"CAPTURE_MONITORS: Ignoring '{part}'."); continue
+        if index >= len(monitors): logger.warning(f"Monitor index {index} out of range, skipping."); continue
+        if index not in indexes: indexes.append(index)
+    return indexes or [0]
+
+def locate_cursor(x, y): # Virtual-screen point -> (stream id, x, y relative to that display), or None if off every stream
+    for stream_id, monitor in list(stream_monitors.items()):
+        rx, ry = x - monitor['left'], y - monitor['top']
+        if 0 <= rx < monitor['width'] and 0 <= ry < monitor['height']: return stream_id, rx, ry
+    return None
+
+def cursor_loop(should_run):
+    # Pointer motion travels as a few-byte event instead of dirtying frame tiles; frames never contain the cursor
+    if get_cursor_state_ctypes() is None: logger.info("CURSOR_THREAD: Cursor position unavailable on this platform, not reporting."); return
+    interval = 1.0 / max(CURSOR_POLL_HZ, 1.0); last_sent = None
+    while should_run():
+        started = time.time()
+        state = get_cursor_state_ctypes()
+        if state is not None:
+            x, y, shape, visible = state; located = locate_cursor(x, y)
+            update = {'stream': located[0], 'x': located[1], 'y': located[2], 'shape': shape, 'visible': visible} if located else {'visible': False}
+            if update != last_sent:
+                try: sio.emit('cursor_update', update); last_sent = update
+                except Exception as e: logger.error(f"CURSOR_THREAD_EMIT_ERROR: {e}"); time.sleep(1)
+        time.sleep(max(0.0, interval - (time.time() - started)))
+
+def run_capture_stream(pipeline):
+    # Backends (mss handles, X connections) are per-thread, so each stream opens its own
     try:
-        if action == 'keydown':
-            key_name_js = data['key']
-            if key_name_js == "F2": return # F2 from server does nothing for typing
-            pyautogui_key_name = map_key_to_pyautogui_name(key_name_js)
-            if pyautogui_key_name:
-                vk_code = CTYPES_VK_MAP.get(pyautogui_key_name.lower())
-                if vk_code: press_key_ctypes(vk_code)
-                # else: logger.debug(f"CTYPES_KEYDOWN: No VK_MAP for '{pyautogui_key_name}'.") # Can be noisy
-        elif action == 'keyup':
-            pyautogui_key_name = map_key_to_pyautogui_name(data['key'])
-            if pyautogui_key_name:
-                vk_code = CTYPES_VK_MAP.get(pyautogui_key_name.lower())
-                if vk_code: release_key_ctypes(vk_code)
-                # else: logger.debug(f"CTYPES_KEYUP: No VK_MAP for '{pyautogui_key_name}'.")
-        elif action == 'move' and abs_x is not None and abs_y is not None:
-            move_mouse_ctypes(abs_x, abs_y, absolute=True)
-        elif action == 'click' and abs_x is not None and abs_y is not None:
-            # It's often better to move then click to ensure correct position
-            move_mouse_ctypes(abs_x, abs_y, absolute=True)
-            time.sleep(0.02) # Small delay after move before click
-            click_mouse_ctypes(button=data.get('button','left').lower())
-        elif action == 'scroll':
-            scroll_amount = data.get('dy', 0) # Server dy>0 is scroll down
-            if scroll_amount != 0: scroll_mouse_ctypes(scroll_amount)
-    except Exception as e: logger.error(f"CLIENT_CMD_ERROR (ctypes): Processing {data}: {e}", exc_info=True)
-
+        backend = capture_backends.open_backend(CAPTURE_BACKEND, pipeline.monitor)
+        try: pipeline.run(backend)
+        finally: backend.close()
+    except Exception as e: logger.error(f"CAPTURE_STREAM_ERROR[{pipeline.stream_id}]: {e}")
+    logger.info(f"CAPTURE_STREAM_STATS[{pipeline.stream_id}]: {pipeline.stats()}")
 
-# --- Screen Capture Loop ---
-# (Identical to previous version)
 def screen_capture_loop():
-    global selected_monitor_details
-    logger.info(f"CAPTURE_THREAD_START: FPS: {CLIENT_TARGET_FPS}, Quality: {JPEG_QUALITY}, Monitor: {CAPTURE_MONITOR_INDEX}")
+    if DELTA_MODE and np is None: logger.warning("CAPTURE_THREAD_DELTA: numpy not installed, sending full frames only.")
+    with mss.mss() as sct: monitors = sct.monitors
+    if not monitors: logger.error("CAPTURE_THREAD_ERROR: No mss monitors. Exiting."); return
+    indexes = parse_capture_monitors(monitors)
+    input_injection.invalidate_metrics() # Monitor layout may have changed since the last capture start
+    logger.info(f"CAPTURE_THREAD_START: FPS: {CLIENT_TARGET_FPS}, Quality: {JPEG_QUALITY}, Monitors: {indexes}, Delta: {DELTA_MODE and np is not None} (tile {DELTA_TILE_SIZE}px)")
+    pool = None
+    if ENCODER_POOL_WORKERS > 0: # One pool shared by all streams, slots sized for the largest display
+        try: pool = EncoderPool(ENCODER_POOL_WORKERS, max(monitors[i]['width'] * monitors[i]['height'] for i in indexes) * 4)
+        except Exception as e: logger.error(f"CAPTURE_THREAD_POOL_ERROR: Could not start encoder pool, encoding inline: {e}")
+    should_run = lambda: not screen_capture_stop_event.is_set() and is_registered and sio.connected
+    stream_threads = []
+    for index in indexes:
+        monitor = monitors[index]; stream_monitors[index] = monitor
+        logger.info(f"CAPTURE_THREAD_MONITOR: Stream {index}: {monitor}")
+        pipeline = CapturePipeline(monitor, sio.emit, should_run, pool=pool, stream_id=index)
+        pipeline.set_active(active_stream_ids is None or index in active_stream_ids)
+        active_pipelines[index] = pipeline
+        stream_threads.append(threading.Thread(target=run_capture_stream, args=(pipeline,), name=f"ScreenCaptureThread-{index}", daemon=True))
+    try:
+        sio.emit('stream_info', {'streams': [{'id': i, 'w': monitors[i]['width'], 'h': monitors[i]['height'], 'left': monitors[i]['left'],
+                                              'top': monitors[i]['top']} for i in indexes]})
+    except Exception as e: logger.error(f"CAPTURE_THREAD_STREAM_INFO_ERROR: {e}")
+    if LATENCY_TRACING: stream_threads.append(threading.Thread(target=clock_sync_loop, args=(should_run,), name="ClockSyncThread", daemon=True))
+    if CURSOR_CHANNEL: stream_threads.append(threading.Thread(target=cursor_loop, args=(should_run,), name="CursorThread", daemon=True))
+    for thread in stream_threads: thread.start()
+    try:
+        for thread in stream_threads: thread.join()
+    finally:
+        active_pipelines.clear(); stream_monitors.clear()
+        if pool: pool.close()
+    logger.info("CAPTURE_THREAD_STOP")
+
+
+# --- Capture Path Measurement ---
+def measure_capture_path(frames=CAPTURE_PATH_BENCH_FRAMES):
+    # Grab -> RGB -> JPEG on the selected monitor, old path (sct_img.rgb + Image.frombytes + new BytesIO)
+    # against the reuse path (BGRX decode into a preallocated image + reused output buffer).
+    # tracemalloc sees Python-heap bytes; Pillow's core stats count image buffers allocated in C.
+    import tracemalloc
+    def legacy(sct_img, _buffers):
+        img = Image.frombytes("RGB", (sct_img.width, sct_img.height), sct_img.rgb, "raw", "RGB")
+        buffer = io.BytesIO(); img.save(buffer, format="JPEG", quality=JPEG_QUALITY); return buffer.getvalue()
+    def reuse(sct_img, buffers):
+        img = buffers.load(sct_img.raw, sct_img.width, sct_img.height)
+        return encode_regions(img, None, JPEG_QUALITY, None, buffers.output)[0][2]
     with mss.mss() as sct:
         monitors = sct.monitors
-        if not monitors: logger.error("CAPTURE_THREAD_ERROR: No mss monitors. Exiting."); return
-        actual_monitor_idx = CAPTURE_MONITOR_INDEX if CAPTURE_MONITOR_INDEX < len(monitors) else 0
-        if CAPTURE_MONITOR_INDEX >= len(monitors): logger.warning(f"Monitor index {CAPTURE_MONITOR_INDEX} out of range, using {actual_monitor_idx}.")
-        monitor_definition = monitors[actual_monitor_idx]; selected_monitor_details = monitor_definition
-        logger.info(f"CAPTURE_THREAD_MONITOR: Capturing Index {actual_monitor_idx}: {monitor_definition}")
-        last_frame_send_time = time.time(); target_interval = 1.0 / CLIENT_TARGET_FPS
-        while not screen_capture_stop_event.is_set() and is_registered and sio.connected:
-            capture_start_time = time.time()
-            if (capture_start_time - last_frame_send_time) < target_interval: time.sleep(target_interval - (capture_start_time - last_frame_send_time))
-            try:
-                sct_img = sct.grab(monitor_definition)
-                img = Image.frombytes("RGB", (sct_img.width, sct_img.height), sct_img.rgb, "raw", "RGB")
-                buffer = io.BytesIO(); img.save(buffer, format="JPEG", quality=JPEG_QUALITY); jpeg_bytes = buffer.getvalue()
-                if jpeg_bytes:
-                    try: sio.emit('screen_data_bytes', jpeg_bytes); last_frame_send_time = time.time()
-                    except Exception as e: logger.error(f"CAPTURE_THREAD_EMIT_ERROR: {e}"); time.sleep(1)
-            except Exception as e: logger.error(f"CAPTURE_THREAD_UNEXPECTED_ERROR: {e}"); time.sleep(0.1)
-    logger.info("CAPTURE_THREAD_STOP"); selected_monitor_details = None
+        monitor = monitors[CAPTURE_MONITOR_INDEX if CAPTURE_MONITOR_INDEX < len(monitors) else 0]
+        logger.info(f"CAPTURE_PATH_BENCH: {frames} frames of {monitor['width']}x{monitor['height']} at quality {JPEG_QUALITY}")
+        for name, path in (("legacy", legacy), ("reuse", reuse)):
+            buffers = FrameBuffers(); path(sct.grab(monitor), buffers) # Warm-up allocates the reusable buffers
+            grab_time = encode_time = 0.0; out_bytes = 0
+            blocks_before = Image.core.get_stats().get('allocated_blocks', 0) if hasattr(Image.core, 'get_stats') else None
+            tracemalloc.start(); tracemalloc.reset_peak()
+            for _ in range(frames):
+                started = time.perf_counter(); sct_img = sct.grab(monitor); grabbed = time.perf_counter()
+                out_bytes += len(path(sct_img, buffers)); encode_time += time.perf_counter() - grabbed; grab_time += grabbed - started
+                del sct_img
+            _, peak = tracemalloc.get_traced_memory(); tracemalloc.stop()
+            blocks_after = Image.core.get_stats().get('allocated_blocks', 0) if blocks_before is not None else None
+            logger.info(f"CAPTURE_PATH_BENCH[{name}]: grab {1000 * grab_time / frames:.1f} ms/frame, convert+encode {1000 * encode_time / frames:.1f} ms/frame, "
+                        f"python heap peak {peak / 1024:.0f} KiB, pillow blocks allocated {blocks_after - blocks_before if blocks_before is not None else 'n/a'}, "
+                        f"avg JPEG {out_bytes / frames / 1024:.1f} KiB")
 
 
 # --- Main Execution Block ---
@@ -515,6 +1094,7 @@ def screen_capture_loop():
 def main():
     threading.current_thread().name = "MainThread"
     if LIST_MONITORS_ONLY: list_available_monitors(); return
+    if CAPTURE_PATH_BENCH_ONLY: measure_capture_path(); return
     logger.info(f"Starting Remote Client (ctypes). Server: {SERVER_URL}, FPS: {CLIENT_TARGET_FPS}, Quality: {JPEG_QUALITY}, Monitor: {CAPTURE_MONITOR_INDEX}")
     if ACCESS_PASSWORD == '1': logger.warning("USING DEFAULT CLIENT ACCESS PASSWORD '1'!")
     global capture_thread_obj, local_key_listener_thread_obj, typing_thread_obj
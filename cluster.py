@@ -0,0 +1,186 @@
+# --- Relay Cluster Bus ---
+# Lets several app.py processes (gunicorn workers or separate nodes) serve one set of hosts. Shared state is which
+# node holds each host's PC socket and which nodes have viewers subscribed to it. Messages are addressed to a node,
+# so a host's frames only travel to the nodes that will deliver them instead of fanning out to every process.
+# LocalBus is the single-process stand-in (state in dicts, nothing is ever published); RedisBus shares the state
+# and carries messages over Redis pub/sub.
+import json
+import os
+import socket
+import struct
+import logging
+import time
+try: import redis # Only needed for RELAY_CLUSTER_URL=redis://...
+except ImportError: redis = None
+
+logger = logging.getLogger(__name__)
+
+NODE_HEARTBEAT = 10 # Seconds between liveness refreshes; a node missing three is treated as gone
+
+def default_node_id(): return f"{socket.gethostname()}-{os.getpid()}" # One per gunicorn worker
+
+
+# --- Wire Format ---
+# JSON header plus raw byte blobs, so frame tiles cross the bus without base64 and nothing is unpickled from Redis.
+# bytes anywhere in the message become {'$b': index} in the header and are appended after it.
+def pack(message):
+    blobs = []
+    def strip(value):
+        if isinstance(value, (bytes, bytearray, memoryview)): blobs.append(bytes(value)); return {'$b': len(blobs) - 1}
+        if isinstance(value, dict): return {k: strip(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)): return [strip(v) for v in value]
+        return value
+    header = json.dumps({'m': strip(message), 'b': [len(b) for b in blobs]}, separators=(',', ':')).encode()
+    return b''.join([struct.pack('!I', len(header)), header] + blobs)
+
+def unpack(data):
+    (size,) = struct.unpack_from('!I', data); header = json.loads(data[4:4 + size])
+    blobs, offset = [], 4 + size
+    for length in header['b']: blobs.append(data[offset:offset + length]); offset += length
+    def restore(value):
+        if isinstance(value, dict): return blobs[value['$b']] if value.keys() == {'$b'} else {k: restore(v) for k, v in value.items()}
+        if isinstance(value, list): return [restore(v) for v in value]
+        return value
+    return restore(header['m'])
+
+
+class LocalBus:
+    clustered = False
+
+    def __init__(self, node_id=None):
+        self.node_id = node_id or default_node_id()
+        self._owners = {} # Host id -> (node id, PC SID)
+        self._subscribers = {} # Host id -> set of node ids with viewers subscribed
+        self._thumbnails = {} # Host id -> (updated, JPEG bytes, expires)
+
+    def start(self, handler, spawn): pass
+
+    def claim_host(self, host_id, sid): # Returns the previous (node, sid) owner, if any
+        previous = self._owners.get(host_id); self._owners[host_id] = (self.node_id, sid); return previous
+
+    def release_host(self, host_id, sid):
+        if self._owners.get(host_id) == (self.node_id, sid): del self._owners[host_id]
+
+    def host_owner(self, host_id): return self._owners.get(host_id)
+
+    def online_hosts(self): return dict(self._owners)
+
+    def add_subscriber(self, host_id): self._subscribers.setdefault(host_id, set()).add(self.node_id)
+
+    def remove_subscriber(self, host_id):
+        nodes = self._subscribers.get(host_id, set()); nodes.discard(self.node_id)
+        if not nodes: self._subscribers.pop(host_id, None)
+
+    def subscriber_nodes(self, host_id): return set(self._subscribers.get(host_id, ()))
+
+    def store_thumbnail(self, host_id, jpeg, ttl):
+        now = time.time(); self._thumbnails[host_id] = (now, jpeg, now + ttl)
+        for stale in [h for h, (_, _, expires) in self._thumbnails.items() if expires < now]: del self._thumbnails[stale]
+
+    def thumbnail(self, host_id): # (updated, JPEG bytes) or None
+        entry = self._thumbnails.get(host_id)
+        return entry[:2] if entry and entry[2] >= time.time() else None
+
+    def thumbnail_times(self): # Host id -> updated, for every host with a live thumbnail
+        now = time.time(); return {h: updated for h, (updated, _, expires) in self._thumbnails.items() if expires >= now}
+
+    def publish(self, node_id, message): pass # There are no other nodes
+    def broadcast(self, message): pass
+
+
+class RedisBus(LocalBus):
+    clustered = True
+    # Keys: <prefix>:hosts hash (host id -> "node sid"), <prefix>:subs:<host id> sets of node ids,
+    # <prefix>:alive:<node id> expiring liveness keys, <prefix>:thumb:<host id> expiring JPEGs with their times in the
+    # <prefix>:thumbs hash. Channels: <prefix>:node:<node id> and <prefix>:all.
+    _RELEASE = "if redis.call('hget', KEYS[1], ARGV[1]) == ARGV[2] then return redis.call('hdel', KEYS[1], ARGV[1]) end return 0"
+
+    def __init__(self, url, node_id=None, prefix='relay'):
+        if redis is None: raise RuntimeError("RELAY_CLUSTER_URL needs the 'redis' package (pip install redis)")
+        super().__init__(node_id)
+        self.prefix = prefix
+        self.redis = redis.Redis.from_url(url)
+        self._release = self.redis.register_script(self._RELEASE)
+        self._handler = None
+
+    def _channel(self, node_id): return f"{self.prefix}:node:{node_id}"
+    def _alive(self, node_id): return f"{self.prefix}:alive:{node_id}"
+
+    def start(self, handler, spawn):
+        self._handler = handler
+        self.redis.set(self._alive(self.node_id), 1, ex=3 * NODE_HEARTBEAT)
+        spawn(self._listen); spawn(self._heartbeat)
+        logger.info(f"CLUSTER_BUS_START: node {self.node_id}")
+
+    def _listen(self):
+        while True:
+            pubsub = self.redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                pubsub.subscribe(self._channel(self.node_id), f"{self.prefix}:all")
+                for item in pubsub.listen():
+                    try: self._handler(unpack(item['data']))
+                    except Exception as e: logger.error(f"CLUSTER_BUS_HANDLER_ERROR: {e}", exc_info=True)
+            except redis.RedisError as e:
+                logger.error(f"CLUSTER_BUS_LISTEN_ERROR: {e}, resubscribing"); time.sleep(1)
+            finally: pubsub.close()
+
+    def _heartbeat(self):
+        while True:
+            time.sleep(NODE_HEARTBEAT)
+            try: self.redis.set(self._alive(self.node_id), 1, ex=3 * NODE_HEARTBEAT)
+            except redis.RedisError as e: logger.warning(f"CLUSTER_BUS_HEARTBEAT_ERROR: {e}")
+
+    def claim_host(self, host_id, sid):
+        previous, _ = self.redis.pipeline().hget(f"{self.prefix}:hosts", host_id).hset(f"{self.prefix}:hosts", host_id, f"{self.node_id} {sid}").execute()
+        return tuple(previous.decode().split(' ', 1)) if previous else None
+
+    def release_host(self, host_id, sid): self._release(keys=[f"{self.prefix}:hosts"], args=[host_id, f"{self.node_id} {sid}"])
+
+    def host_owner(self, host_id):
+        value = self.redis.hget(f"{self.prefix}:hosts", host_id)
+        if not value: return None
+        node_id, sid = value.decode().split(' ', 1)
+        return (node_id, sid) if self.redis.exists(self._alive(node_id)) else None # Owner died without releasing
+
+    def online_hosts(self):
+        owners = {k.decode(): tuple(v.decode().split(' ', 1)) for k, v in self.redis.hgetall(f"{self.prefix}:hosts").items()}
+        nodes = sorted({node_id for node_id, _ in owners.values()})
+        pipe = self.redis.pipeline()
+        for node_id in nodes: pipe.exists(self._alive(node_id))
+        alive = dict(zip(nodes, pipe.execute()))
+        return {host_id: owner for host_id, owner in owners.items() if alive.get(owner[0])}
+
+    def add_subscriber(self, host_id): self.redis.sadd(f"{self.prefix}:subs:{host_id}", self.node_id)
+    def remove_subscriber(self, host_id): self.redis.srem(f"{self.prefix}:subs:{host_id}", self.node_id)
+
+    def subscriber_nodes(self, host_id):
+        nodes = sorted(n.decode() for n in self.redis.smembers(f"{self.prefix}:subs:{host_id}"))
+        pipe = self.redis.pipeline()
+        for node_id in nodes: pipe.exists(self._alive(node_id))
+        return {node_id for node_id, alive in zip(nodes, pipe.execute()) if alive}
+
+    def store_thumbnail(self, host_id, jpeg, ttl):
+        now = time.time()
+        self.redis.pipeline().set(f"{self.prefix}:thumb:{host_id}", jpeg, ex=int(ttl)).hset(f"{self.prefix}:thumbs", host_id, now).execute()
+
+    def thumbnail(self, host_id):
+        jpeg, updated = self.redis.pipeline().get(f"{self.prefix}:thumb:{host_id}").hget(f"{self.prefix}:thumbs", host_id).execute()
+        return (float(updated or 0), jpeg) if jpeg else None
+
+    def thumbnail_times(self):
+        times = {k.decode(): float(v) for k, v in self.redis.hgetall(f"{self.prefix}:thumbs").items()}
+        pipe = self.redis.pipeline()
+        for host_id in times: pipe.exists(f"{self.prefix}:thumb:{host_id}")
+        live = dict(zip(list(times), pipe.execute()))
+        expired = [h for h in times if not live[h]]
+        if expired: self.redis.hdel(f"{self.prefix}:thumbs", *expired)
+        return {h: t for h, t in times.items() if live[h]}
+
+    def publish(self, node_id, message): self.redis.publish(self._channel(node_id), pack(dict(message, origin=self.node_id)))
+    def broadcast(self, message): self.redis.publish(f"{self.prefix}:all", pack(dict(message, origin=self.node_id)))
+
+
+def open_bus(url, node_id=None):
+    if not url: return LocalBus(node_id)
+    if url.startswith(('redis://', 'rediss://', 'unix://')): return RedisBus(url, node_id)
+    raise ValueError(f"Unsupported RELAY_CLUSTER_URL scheme: {url}")
@@ -0,0 +1,89 @@
+# --- Binary Control Protocol ---
+# Viewer input travels as 'control_batch' binary messages instead of one JSON control_command per event:
+#   header  <BBH   version, stream id (NO_STREAM for keyboard-only batches), event count
+#   event   <BBHhh kind, arg, ms since the batch's first event, a, b
+# MOVE/CLICK carry x, y in the stream's native pixels (CLICK arg = button), SCROLL carries dx, dy,
+# KEY_DOWN/KEY_UP carry the key in a as uint16 (arg = modifier bits): its UTF-16 code for single characters,
+# KEY_BASE + index into NAMED_KEYS for named keys. Keys that fit neither still go as JSON control_command.
+# static/viewer.js (CTL, CTL_NAMED_KEYS, flushControl) mirrors these constants; bump VERSION in both if the layout changes.
+import struct
+
+VERSION = 1
+HEADER = struct.Struct('<BBH')
+EVENT = struct.Struct('<BBHhh')
+MAX_EVENTS = 512 # Relay/client limit; the viewer flushes at half this (CTL.MAX_EVENTS) so merge_batches can join two full batches
+NO_STREAM = 255
+
+MOVE, CLICK, SCROLL, KEY_DOWN, KEY_UP = 1, 2, 3, 4, 5
+ACTIONS = {MOVE: 'move', CLICK: 'click', SCROLL: 'scroll', KEY_DOWN: 'keydown', KEY_UP: 'keyup'}
+BUTTONS = ('left', 'right', 'middle')
+MOD_CTRL, MOD_SHIFT, MOD_ALT, MOD_META = 1, 2, 4, 8
+KEY_BASE = 0xE000 # Private-use block, never a real key character
+NAMED_KEYS = ('Enter', 'Tab', 'Escape', 'Backspace', 'Delete', 'Insert', 'Home', 'End', 'PageUp', 'PageDown',
+              'ArrowUp', 'ArrowDown', 'ArrowLeft', 'ArrowRight', 'Control', 'Shift', 'Alt', 'Meta', 'CapsLock',
+              'NumLock', 'ScrollLock', 'PrintScreen', 'Pause', 'ContextMenu', 'AltGraph',
+              'F1', 'F2', 'F3', 'F4', 'F5', 'F6', 'F7', 'F8', 'F9', 'F10', 'F11', 'F12')
+_NAMED_KEY_CODES = {name: KEY_BASE + i for i, name in enumerate(NAMED_KEYS)}
+
+
+def check_batch(data):
+    # Cheap structural check for the relay: right version and exactly count events. Returns the event count or None.
+    if not isinstance(data, (bytes, bytearray)) or len(data) < HEADER.size: return None
+    version, _, count = HEADER.unpack_from(data)
+    if version != VERSION or not 0 < count <= MAX_EVENTS or len(data) != HEADER.size + count * EVENT.size: return None
+    return count
+
+def decode_batch(data):
+    # -> (stream or None, [(kind, arg, dt_ms, a, b), ...]); raises ValueError for a malformed batch
+    if check_batch(data) is None: raise ValueError("malformed control batch")
+    _, stream, _ = HEADER.unpack_from(data)
+    events = [(kind, arg, dt, a & 0xFFFF, b) if kind in (KEY_DOWN, KEY_UP) else (kind, arg, dt, a, b)
+              for kind, arg, dt, a, b in EVENT.iter_unpack(memoryview(data)[HEADER.size:])]
+    return (None if stream == NO_STREAM else stream), events
+
+def encode_batch(stream, events):
+    # events: [(kind, arg, dt_ms, a, b), ...]
+    out = bytearray(HEADER.pack(VERSION, NO_STREAM if stream is None else stream, len(events)))
+    for kind, arg, dt, a, b in events:
+        if kind in (KEY_DOWN, KEY_UP) and a >= 0x8000: a -= 0x10000 # Same bits as the uint16 key code
+        out += EVENT.pack(kind, arg, dt, a, b)
+    return bytes(out)
+
+def key_code(name): # KeyboardEvent.key -> wire code, or None if it has to go as JSON
+    if name in _NAMED_KEY_CODES: return _NAMED_KEY_CODES[name]
+    if len(name) == 1 and ord(name) < KEY_BASE: return ord(name)
+    return None
+
+def key_name(code):
+    if KEY_BASE <= code < KEY_BASE + len(NAMED_KEYS): return NAMED_KEYS[code - KEY_BASE]
+    return chr(code) if 0 < code < KEY_BASE else None
+
+def from_command(data):
+    # Legacy JSON control_command dict -> (kind, arg, a, b, key) with key set for keyboard events
+    action = data.get('action')
+    if action == 'move': return MOVE, 0, data.get('x'), data.get('y'), None
+    if action == 'click':
+        button = data.get('button', 'left').lower()
+        return CLICK, BUTTONS.index(button) if button in BUTTONS else 0, data.get('x'), data.get('y'), None
+    if action == 'scroll': return SCROLL, 0, data.get('dx', 0), data.get('dy', 0), None
+    if action in ('keydown', 'keyup') and isinstance(data.get('key'), str):
+        mods = ((MOD_CTRL if data.get('ctrlKey') else 0) | (MOD_SHIFT if data.get('shiftKey') else 0)
+                | (MOD_ALT if data.get('altKey') else 0) | (MOD_META if data.get('metaKey') else 0))
+        return (KEY_DOWN if action == 'keydown' else KEY_UP), mods, None, None, data['key']
+    return None
+
+def coalesce_moves(events):
+    # Drops every move that is followed directly by another move or a click (which positions the pointer itself),
+    # so a backlog jumps to the latest position; keys, scrolls and clicks keep their order and the pointer position
+    # they were made at.
+    return [e for i, e in enumerate(events) if e[0] != MOVE or i + 1 == len(events) or events[i + 1][0] not in (MOVE, CLICK)]
+
+def merge_batches(first, second):
+    # Two queued batches -> (one batch with superseded moves dropped, moves dropped), or (None, 0) if they can't share
+    # a header (different streams, or too many events). The second batch's times continue from the first's last event.
+    stream_a, events_a = decode_batch(first); stream_b, events_b = decode_batch(second)
+    if stream_a is not None and stream_b is not None and stream_a != stream_b: return None, 0
+    offset = events_a[-1][2] if events_a else 0
+    events = coalesce_moves(events_a + [(kind, arg, min(dt + offset, 0xFFFF), a, b) for kind, arg, dt, a, b in events_b])
+    if len(events) > MAX_EVENTS: return None, 0
+    return encode_batch(stream_a if stream_a is not None else stream_b, events), len(events_a) + len(events_b) - len(events)
@@ -0,0 +1,190 @@
+# --- Frame Encoding Helpers & Multi-Process Encoder Pool ---
+# Shared by client.py's capture pipeline and the EncoderPool worker processes. Workers spawned on Windows re-import
+# the main module as well, so client.py keeps its startup under `if __name__ == '__main__'`.
+import io
+import queue
+import logging
+import threading
+import time
+from fractions import Fraction
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from PIL import Image
+try: import numpy as np # Exact palette mapping for text tiles; without it they fall back to RGB PNG
+except ImportError: np = None
+try: import av # PyAV, only needed for video mode
+except ImportError: av = None
+
+logger = logging.getLogger(__name__)
+
+
+class FrameBuffers:
+    # Per-thread (or per-worker) reusable decode target and JPEG output buffer, so steady-state frames
+    # allocate only the encoded bytes that go on the wire.
+    def __init__(self):
+        self.image = None; self.output = io.BytesIO()
+
+    def load(self, raw, width, height):
+        # Decodes a BGRA buffer straight into the reused RGB image via Pillow's BGRX raw decoder
+        if self.image is None or self.image.size != (width, height): self.image = Image.new("RGB", (width, height))
+        self.image.frombytes(raw if isinstance(raw, memoryview) else memoryview(raw), "raw", "BGRX")
+        return self.image
+
+
+def encode_jpeg(img, quality, output=None):
+    if output is None:
+        buffer = io.BytesIO(); img.save(buffer, format="JPEG", quality=quality); return buffer.getvalue()
+    output.seek(0); img.save(output, format="JPEG", quality=quality) # Overwrites in place; the buffer keeps its capacity
+    with output.getbuffer() as view: return bytes(view[:output.tell()])
+
+_palette_luts = threading.local() # Packed RGB -> palette index, one table per encoding thread
+
+def encode_palette_png(img, output=None, colors=None):
+    # Lossless indexed PNG for an image already known to have <= 256 colours (colors: its getcolors() list, if the
+    # caller has it). Pillow's own quantizer maps through a reduced-precision cache and can merge near-identical
+    # anti-aliasing shades, so the index map is built exactly with numpy instead.
+    colors = colors or img.getcolors(256) # None for a run of palette cells that has more colours than one palette holds
+    if np is not None and colors:
+        packed = np.frombuffer(img.tobytes("raw", "RGBX"), dtype="<u4") & 0xFFFFFF # R | G << 8 | B << 16
+        palette = np.array([r | (g << 8) | (b << 16) for _, (r, g, b) in colors], dtype=np.uint32)
+        lut = getattr(_palette_luts, 'lut', None)
+        if lut is None: lut = _palette_luts.lut = np.zeros(1 << 24, dtype=np.uint8) # Pages are only committed as colours touch them
+        lut[palette] = np.arange(len(palette), dtype=np.uint8) # Stale entries are never read: every pixel's colour is in palette
+        img = Image.frombytes("P", img.size, lut[packed].tobytes())
+        img.putpalette(np.stack((palette & 255, (palette >> 8) & 255, palette >> 16), axis=1).astype(np.uint8).tobytes())
+    if output is None:
+        buffer = io.BytesIO(); img.save(buffer, format="PNG"); return buffer.getvalue()
+    output.seek(0); img.save(output, format="PNG")
+    with output.getbuffer() as view: return bytes(view[:output.tell()])
+
+def looks_photographic(region, palette_colors, step=4):
+    # Nearest-neighbour sampling keeps real pixel values, so a sample with several palettes' worth of colours means
+    # photo/video content dominates and the per-cell palette search would only burn time before falling back to JPEG
+    sample = region.resize((max(1, region.width // step), max(1, region.height // step)), Image.NEAREST)
+    return sample.getcolors(4 * palette_colors) is None
+
+def _encode_by_content(region, x, y, quality, palette_colors, tile, output):
+    # Few-colour content (text, UI chrome) goes out as lossless palette PNG, everything else as JPEG.
+    # A region that mixes both is split into tile-sized cells and each cell row is sent as runs of one codec.
+    colors = region.getcolors(palette_colors)
+    if colors: return [[x, y, encode_palette_png(region, output, colors), 'png']]
+    if (region.width <= tile and region.height <= tile) or looks_photographic(region, palette_colors):
+        return [[x, y, encode_jpeg(region, quality, output), 'jpeg']]
+    tiles = []
+    for cy in range(0, region.height, tile):
+        row = region.crop((0, cy, region.width, min(cy + tile, region.height)))
+        cells = [(cx, row.crop((cx, 0, min(cx + tile, row.width), row.height)).getcolors(palette_colors) is not None)
+                 for cx in range(0, row.width, tile)]
+        start = 0
+        for i in range(1, len(cells) + 1):
+            if i < len(cells) and cells[i][1] == cells[start][1]: continue
+            x0, x1 = cells[start][0], cells[i][0] if i < len(cells) else row.width
+            part = row if (x0, x1) == (0, row.width) else row.crop((x0, 0, x1, row.height))
+            if cells[start][1]: tiles.append([x + x0, y + cy, encode_palette_png(part, output), 'png'])
+            else: tiles.append([x + x0, y + cy, encode_jpeg(part, quality, output), 'jpeg'])
+            start = i
+    return tiles
+
+def encode_regions(img, rects, quality, size=None, output=None, palette_colors=0, tile=64):
+    # rects=None encodes the whole frame; otherwise one tile per (x0, y0, x1, y1) rect.
+    # With size=(w, h) the frame is sent downscaled and tile offsets are in scaled pixels; each rect is
+    # resampled from its source box so tiles line up with a full-frame resize.
+    # palette_colors > 0 enables per-region codec choice and tags each tile with its codec.
+    if size is None or size == img.size:
+        if rects is None: regions = [(0, 0, img)]
+        else: regions = [(x0, y0, img.crop((x0, y0, x1, y1))) for x0, y0, x1, y1 in rects]
+    elif rects is None: regions = [(0, 0, img.resize(size, Image.BILINEAR))]
+    else:
+        fx, fy = size[0] / img.width, size[1] / img.height; regions = []
+        for x0, y0, x1, y1 in rects:
+            sx0, sy0 = max(0, int(x0 * fx) - 1), max(0, int(y0 * fy) - 1)
+            sx1, sy1 = min(size[0], -int(-x1 * fx) + 1), min(size[1], -int(-y1 * fy) + 1)
+            regions.append((sx0, sy0, img.resize((sx1 - sx0, sy1 - sy0), Image.BILINEAR, box=(sx0 / fx, sy0 / fy, sx1 / fx, sy1 / fy))))
+    if not palette_colors: return [[x, y, encode_jpeg(region, quality, output)] for x, y, region in regions]
+    tiles = []
+    for x, y, region in regions: tiles.extend(_encode_by_content(region, x, y, quality, palette_colors, tile, output))
+    return tiles
+
+
+# --- Video Mode (inter-frame codec) ---
+class VideoEncoder:
+    # CPU-only VP8/H.264 encoder via PyAV, tuned for lowest latency (no lookahead, one packet per frame).
+    # H.264 comes out as Annex B, which is what WebCodecs expects when no decoder description is given.
+    CODECS = {'vp8': ('libvpx', {'deadline': 'realtime', 'cpu-used': '8', 'lag-in-frames': '0', 'error-resilient': '1'}),
+              'h264': ('libx264', {'preset': 'ultrafast', 'tune': 'zerolatency', 'profile': 'baseline'})}
+
+    def __init__(self, codec, width, height, bitrate, gop):
+        name, options = self.CODECS[codec]
+        self.codec, self.width, self.height, self.bitrate = codec, width, height, bitrate
+        self._ctx = av.CodecContext.create(name, 'w')
+        self._ctx.width, self._ctx.height, self._ctx.pix_fmt = width, height, 'yuv420p'
+        self._ctx.bit_rate, self._ctx.gop_size, self._ctx.time_base = bitrate, gop, Fraction(1, 1000)
+        self._ctx.options = options
+        self._start = time.monotonic(); self._last_pts = -1
+        picture_type = getattr(av.video.frame, 'PictureType', None) # PyAV >= 12 uses an enum, older versions a string
+        self._keyframe_type = picture_type.I if picture_type is not None else 'I'
+
+    def encode(self, frame, force_key=False):
+        # Returns (bytes, is_keyframe), or (None, False) if the encoder produced nothing for this frame
+        frame = frame.reformat(width=self.width, height=self.height, format='yuv420p')
+        self._last_pts = max(self._last_pts + 1, int((time.monotonic() - self._start) * 1000))
+        frame.pts, frame.time_base = self._last_pts, self._ctx.time_base
+        if force_key: frame.pict_type = self._keyframe_type
+        packets = self._ctx.encode(frame)
+        if not packets: return None, False
+        return b''.join(bytes(packet) for packet in packets), any(packet.is_keyframe for packet in packets)
+
+def make_video_frame(raw, width, height, buffers=None):
+    # Wraps a BGRA capture buffer for the video encoder; swscale does the colour conversion and scaling
+    if np is not None: return av.VideoFrame.from_ndarray(np.frombuffer(raw, dtype=np.uint8).reshape(height, width, 4), format='bgra')
+    return av.VideoFrame.from_image((buffers or FrameBuffers()).load(raw, width, height))
+
+
+# --- Worker Process Side ---
+_worker_slots = []
+_worker_buffers = FrameBuffers()
+
+def _worker_init(slot_names):
+    global _worker_slots
+    _worker_slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+
+def _encode_job(slot_index, width, height, rects, quality, size, palette_colors, tile):
+    with _worker_slots[slot_index].buf[:width * height * 4] as view:
+        img = _worker_buffers.load(view, width, height)
+    return encode_regions(img, rects, quality, size, _worker_buffers.output, palette_colors, tile)
+
+
+# --- Parent Process Side ---
+class EncoderPool:
+    # One frame per job: the BGRA buffer is copied into a free shared-memory slot and a worker encodes it
+    # there, so only slot indexes, rects and the finished JPEG bytes cross the process boundary.
+    def __init__(self, workers, slot_bytes):
+        self.workers, self.slot_bytes = workers, slot_bytes
+        self._slots = [shared_memory.SharedMemory(create=True, size=slot_bytes) for _ in range(workers + 2)]
+        self._free_slots = queue.Queue()
+        for index in range(len(self._slots)): self._free_slots.put(index)
+        self._executor = ProcessPoolExecutor(max_workers=workers, initializer=_worker_init,
+                                             initargs=([slot.name for slot in self._slots],))
+        self._closed = threading.Event()
+        logger.info(f"ENCODER_POOL_START: {workers} workers, {len(self._slots)} slots of {slot_bytes // 1024} KiB")
+
+    def fits(self, width, height): return width * height * 4 <= self.slot_bytes
+
+    def submit(self, raw, width, height, rects, quality, size=None, palette_colors=0, tile=64, timeout=1.0):
+        # Returns a Future with the encoded tiles, or None if no slot freed up within timeout
+        if self._closed.is_set(): return None
+        try: slot_index = self._free_slots.get(timeout=timeout)
+        except queue.Empty: return None
+        if self._closed.is_set(): self._free_slots.put(slot_index); return None # Closed while waiting for the slot
+        self._slots[slot_index].buf[:width * height * 4] = raw
+        future = self._executor.submit(_encode_job, slot_index, width, height, rects, quality, size, palette_colors, tile)
+        future.add_done_callback(lambda _f: self._free_slots.put(slot_index))
+        return future
+
+    def close(self):
+        self._closed.set()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for slot in self._slots:
+            try: slot.close(); slot.unlink()
+            except Exception as e: logger.warning(f"ENCODER_POOL_CLOSE_WARN: {slot.name}: {e}")
+        logger.info("ENCODER_POOL_STOP")
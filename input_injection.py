@@ -0,0 +1,200 @@
+# --- Input Injection Layer ---
+# One reusable SendInput path for viewer input and the typing task. Events are written into a preallocated INPUT
+# array and go out together on flush(), so a click or a run of keys is one SendInput call and steady-state input
+# allocates nothing per event. Pointer positions are virtual-desktop pixels (the coordinates mss reports, spanning
+# every monitor) and are normalised with MOUSEEVENTF_VIRTUALDESK against cached virtual-screen metrics.
+# Off Windows the same structures are filled and flush() only counts what it would have submitted, so the layer can
+# be microbenchmarked anywhere:
+#   python input_injection.py --events 200000
+import argparse
+import ctypes
+import platform
+import sys
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+METRICS_TTL = 2.0 # Seconds the virtual-desktop metrics are trusted before the next refresh
+STUB_DESKTOP = (0, 0, 1920, 1080) # Virtual desktop the Linux stub pretends to have
+
+INPUT_MOUSE, INPUT_KEYBOARD = 0, 1
+KEYEVENTF_KEYUP, KEYEVENTF_UNICODE = 0x0002, 0x0004
+MOUSEEVENTF_MOVE, MOUSEEVENTF_ABSOLUTE, MOUSEEVENTF_VIRTUALDESK, MOUSEEVENTF_WHEEL = 0x0001, 0x8000, 0x4000, 0x0800
+BUTTON_FLAGS = {'left': (0x0002, 0x0004), 'right': (0x0008, 0x0010), 'middle': (0x0020, 0x0040)} # (down, up)
+WHEEL_DELTA = 120
+VK_TAB, VK_RETURN = 0x09, 0x0D
+SM_XVIRTUALSCREEN, SM_YVIRTUALSCREEN, SM_CXVIRTUALSCREEN, SM_CYVIRTUALSCREEN = 76, 77, 78, 79
+
+# Fixed-width fields so the layout matches Windows' INPUT on every platform (wintypes.LONG is 8 bytes on Linux)
+class MOUSEINPUT(ctypes.Structure):
+    _fields_ = (("dx", ctypes.c_int32), ("dy", ctypes.c_int32), ("mouseData", ctypes.c_uint32), ("dwFlags", ctypes.c_uint32),
+                ("time", ctypes.c_uint32), ("dwExtraInfo", ctypes.c_size_t))
+
+class KEYBDINPUT(ctypes.Structure):
+    _fields_ = (("wVk", ctypes.c_uint16), ("wScan", ctypes.c_uint16), ("dwFlags", ctypes.c_uint32), ("time", ctypes.c_uint32),
+                ("dwExtraInfo", ctypes.c_size_t))
+
+class HARDWAREINPUT(ctypes.Structure):
+    _fields_ = (("uMsg", ctypes.c_uint32), ("wParamL", ctypes.c_uint16), ("wParamH", ctypes.c_uint16))
+
+class _INPUT_UNION(ctypes.Union):
+    _fields_ = (("mi", MOUSEINPUT), ("ki", KEYBDINPUT), ("hi", HARDWAREINPUT))
+
+class INPUT(ctypes.Structure):
+    _fields_ = (("type", ctypes.c_uint32), ("union", _INPUT_UNION))
+
+INPUT_SIZE = ctypes.sizeof(INPUT)
+
+if platform.system() == "Windows":
+    _user32 = ctypes.WinDLL('user32', use_last_error=True)
+    SendInput = _user32.SendInput
+    SendInput.argtypes = (ctypes.c_uint, ctypes.POINTER(INPUT), ctypes.c_int)
+    SendInput.restype = ctypes.c_uint
+    GetSystemMetrics = _user32.GetSystemMetrics
+    GetSystemMetrics.argtypes = (ctypes.c_int,)
+    GetSystemMetrics.restype = ctypes.c_int
+    def last_error(): return ctypes.get_last_error()
+    STUB = False
+else: # Same API, nothing injected
+    def SendInput(count, inputs, size): return count
+    def GetSystemMetrics(index): return {SM_XVIRTUALSCREEN: STUB_DESKTOP[0], SM_YVIRTUALSCREEN: STUB_DESKTOP[1],
+                                         SM_CXVIRTUALSCREEN: STUB_DESKTOP[2], SM_CYVIRTUALSCREEN: STUB_DESKTOP[3]}[index]
+    def last_error(): return 0
+    STUB = True
+
+
+# --- Virtual Desktop Metrics ---
+_metrics = None # (left, top, width, height)
+_metrics_at = 0.0
+
+def desktop_metrics():
+    # Bounding box of all monitors in virtual-desktop pixels, queried at most every METRICS_TTL seconds
+    global _metrics, _metrics_at
+    now = time.monotonic()
+    if _metrics is None or now - _metrics_at >= METRICS_TTL:
+        metrics = (GetSystemMetrics(SM_XVIRTUALSCREEN), GetSystemMetrics(SM_YVIRTUALSCREEN),
+                   GetSystemMetrics(SM_CXVIRTUALSCREEN), GetSystemMetrics(SM_CYVIRTUALSCREEN))
+        if metrics != _metrics and _metrics is not None: logger.info(f"INPUT_DESKTOP_CHANGED: {_metrics} -> {metrics}")
+        _metrics, _metrics_at = metrics, now
+    return _metrics
+
+def invalidate_metrics(): # Call when the monitor layout is known to have changed; the next move re-queries it
+    global _metrics_at
+    _metrics_at = 0.0
+
+
+# --- Batches ---
+class InputBatch:
+    # Preallocated INPUT records filled in place and submitted by flush(); a full batch flushes itself.
+    # Not thread-safe: each injecting thread owns its batch.
+    def __init__(self, capacity=64):
+        self.capacity = capacity
+        self._inputs = (INPUT * capacity)(); self._count = 0
+        self.submitted = 0; self.calls = 0 # Totals for stats and benchmarks
+
+    @property
+    def pending(self): return self._count
+
+    def _slot(self, kind):
+        if self._count == self.capacity: self.flush()
+        inp = self._inputs[self._count]; self._count += 1
+        inp.type = kind; return inp
+
+    def _mouse(self, flags, dx=0, dy=0, data=0):
+        mi = self._slot(INPUT_MOUSE).union.mi
+        mi.dx, mi.dy, mi.mouseData, mi.dwFlags, mi.time, mi.dwExtraInfo = dx, dy, data, flags, 0, 0
+
+    def _key(self, vk, scan, flags):
+        ki = self._slot(INPUT_KEYBOARD).union.ki
+        ki.wVk, ki.wScan, ki.dwFlags, ki.time, ki.dwExtraInfo = vk, scan, flags, 0, 0
+
+    def move(self, x, y): # Absolute position in virtual-desktop pixels
+        left, top, width, height = desktop_metrics()
+        self._mouse(MOUSEEVENTF_MOVE | MOUSEEVENTF_ABSOLUTE | MOUSEEVENTF_VIRTUALDESK,
+                    (x - left) * 65535 // max(width - 1, 1), (y - top) * 65535 // max(height - 1, 1))
+
+    def button(self, button, up=False):
+        flags = BUTTON_FLAGS.get(button)
+        if flags is None: logger.warning(f"INPUT_BUTTON: Unknown button '{button}'"); return
+        self._mouse(flags[1] if up else flags[0])
+
+    def click(self, button='left'): self.button(button); self.button(button, up=True)
+
+    def scroll(self, notches): self._mouse(MOUSEEVENTF_WHEEL, data=-int(notches * WHEEL_DELTA)) # Positive scrolls down
+
+    def key(self, vk, up=False): self._key(vk, 0, KEYEVENTF_KEYUP if up else 0)
+
+    def press(self, vk): self.key(vk); self.key(vk, up=True)
+
+    def char(self, char):
+        # Typed as KEYEVENTF_UNICODE, one down/up pair per UTF-16 unit; \n and \t go as their keys
+        if char == '\n': self.press(VK_RETURN); return
+        if char == '\t': self.press(VK_TAB); return
+        code = ord(char)
+        units = (code,) if code < 0x10000 else (0xD800 + ((code - 0x10000) >> 10), 0xDC00 + ((code - 0x10000) & 0x3FF))
+        for unit in units: self._key(0, unit, KEYEVENTF_UNICODE); self._key(0, unit, KEYEVENTF_UNICODE | KEYEVENTF_KEYUP)
+
+    def flush(self): # Returns how many records SendInput accepted
+        count, self._count = self._count, 0
+        if not count: return 0
+        sent = SendInput(count, self._inputs, INPUT_SIZE)
+        self.submitted += sent; self.calls += 1
+        if sent != count: logger.warning(f"INPUT_SEND_SHORT: {sent}/{count} inputs, error {last_error()}")
+        return sent
+
+
+def build_text_inputs(text):
+    # Whole text -> one pre-built INPUT array for bulk typing: a KEYEVENTF_UNICODE down/up pair per UTF-16 code unit
+    # (so characters outside the BMP go as their surrogate pair), VK_RETURN for \n, \r\n and lone \r, VK_TAB for \t.
+    # Also returns the input index each character starts at, so batches can stop on a character boundary.
+    keys, starts = [], [] # (vk, scan, flags) key-down events; each gets its key-up right after it
+    for i, char in enumerate(text):
+        starts.append(2 * len(keys))
+        if char == '\n' and i and text[i - 1] == '\r': continue # Second half of \r\n
+        if char in '\r\n': keys.append((VK_RETURN, 0, 0))
+        elif char == '\t': keys.append((VK_TAB, 0, 0))
+        else:
+            units = char.encode('utf-16-le', 'surrogatepass') # A lone surrogate goes as its own unit, like InputBatch.char sends it
+            keys.extend((0, int.from_bytes(units[j:j + 2], 'little'), KEYEVENTF_UNICODE) for j in range(0, len(units), 2))
+    inputs = (INPUT * (2 * len(keys)))()
+    for n, (vk, scan, flags) in enumerate(keys):
+        for inp, up in ((inputs[2 * n], 0), (inputs[2 * n + 1], KEYEVENTF_KEYUP)):
+            inp.type = INPUT_KEYBOARD; inp.union.ki.wVk = vk; inp.union.ki.wScan = scan; inp.union.ki.dwFlags = flags | up
+    starts.append(len(inputs))
+    return inputs, starts
+
+def send_input_slice(inputs, start, count): # SendInput over inputs[start:start + count] without copying the array
+    return SendInput(count, (INPUT * count).from_buffer(inputs, start * INPUT_SIZE), INPUT_SIZE)
+
+
+# --- Microbenchmark ---
+def _bench(label, events, run):
+    started = time.perf_counter(); run(); elapsed = time.perf_counter() - started
+    print(f"{label:<28} {1e6 * elapsed / events:>8.3f} us/event  ({events} events, {elapsed:.3f}s)", flush=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the input injection layer (SendInput is a no-op off Windows).")
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--text-kb', type=int, default=20, help="Size of the text for the bulk typing build")
+    args = parser.parse_args(argv)
+    print(f"Platform {platform.system()} ({'stub' if STUB else 'SendInput'}), INPUT is {INPUT_SIZE} bytes", flush=True)
+    batch = InputBatch(); n = args.events; left, top, width, height = desktop_metrics()
+    def moves():
+        for i in range(n): batch.move(left + i % width, top + i % height); batch.flush()
+    def clicks():
+        for _ in range(n // 2): batch.click(); batch.flush()
+    def chars():
+        for i in range(n // 2): batch.char(chr(0x61 + i % 26))
+        batch.flush()
+    _bench("move + flush", n, moves)
+    _bench("click + flush", n // 2 * 2, clicks)
+    _bench("char (batched)", n // 2 * 2, chars)
+    text = ("for line in config:\n\tvalue = 'x' \U0001F600\n" * (args.text_kb * 1024 // 40))[:args.text_kb * 1024]
+    _bench(f"build_text_inputs {args.text_kb} KiB", len(text), lambda: build_text_inputs(text))
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
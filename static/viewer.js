@@ -0,0 +1,408 @@
+// Viewer page (INTERFACE_HTML in app.py): stream display, input capture and the Socket.IO connection
+document.addEventListener('DOMContentLoaded', () => {
+    const socket = io(window.location.origin, { path: '/socket.io/' });
+    const connectionStatusDot = document.getElementById('status-dot');
+    const connectionStatusText = document.getElementById('status-text');
+    const streamStatusText = document.getElementById('stream-status');
+    const screenViewArea = document.getElementById('screen-view-area');
+    const screenPlaceholder = document.getElementById('screen-placeholder');
+    const streamSelector = document.getElementById('stream-selector');
+    const hostSelector = document.getElementById('host-selector');
+    // The relay serves many PCs; this page watches one at a time and only receives that host's events
+    let wantedHost = new URLSearchParams(window.location.search).get('host') || localStorage.getItem('remoteHost'), subscribedHost = null;
+    let activeModifiers = { ctrl: false, shift: false, alt: false, meta: false };
+    // Each remote display is an independent stream with its own canvas, keyframe state and decoder
+    const streams = new Map(); // stream id -> state, see getStream()
+    let selectedStream = null, tiled = false;
+
+    // UI Elements for layout and text injection
+    const bodyElement = document.body;
+    const toggleTextModeButton = document.getElementById('toggle-text-mode-button');
+    const injectionTextarea = document.getElementById('injection-text');
+    const sendInjectionTextButton = document.getElementById('send-injection-text-button');
+    const injectionStatus = document.getElementById('injection-status');
+
+
+    document.body.focus(); // For keyboard events
+    // Avoid re-focusing if clicking inside textarea
+    document.addEventListener('click', (e) => {
+        if (e.target.tagName !== 'CANVAS' && e.target !== injectionTextarea && !injectionTextarea.contains(e.target)) {
+            document.body.focus();
+        }
+    });
+
+    function updateStatus(status, message) { connectionStatusText.textContent = message; connectionStatusDot.className = `status-dot ${status}`; }
+    function showClickFeedback(x, y) { /* ... same as before ... */ }
+
+    // --- Streams: one per remote display ---
+    function getStream(id) {
+        id = id ?? 0; // Legacy clients send a single unnamed stream
+        let st = streams.get(id);
+        if (st) return st;
+        const cell = document.createElement('div'); cell.className = 'stream-cell';
+        const canvas = document.createElement('canvas'); canvas.width = 1920; canvas.height = 1080;
+        const cursorEl = document.createElement('div'); cursorEl.className = 'remote-cursor';
+        const selectionEl = document.createElement('div'); selectionEl.className = 'zoom-selection';
+        cell.appendChild(canvas); cell.appendChild(cursorEl); cell.appendChild(selectionEl); screenViewArea.appendChild(cell);
+        st = { id, cell, canvas, ctx: canvas.getContext('2d'), remoteWidth: null, remoteHeight: null, status: '',
+               cursorEl, cursor: null, pointerInside: false, // Last cursor_update for this display; local pointer over the canvas?
+               selectionEl, roi: null, // Zoomed region [x, y, w, h] in native pixels the PC is sending, from packets
+               haveKeyframe: false, // Delta packets are only composited on top of a keyframe
+               drawChain: Promise.resolve(), // Serializes async tile decodes so packets paint in arrival order
+               decoder: null, decoderCodec: null, nextVideoSeq: null, videoNeedsKey: true, keyframeRequested: false,
+               videoFrameMeta: new Map() }; // chunk timestamp (vseq) -> packet info for dimensions and acks
+        streams.set(id, st); attachMouseHandlers(st);
+        if (selectedStream === null) selectedStream = id;
+        renderStreamSelector();
+        return st;
+    }
+    function setStreams(list) {
+        const ids = new Set(list.map(info => info.id));
+        for (const [id, st] of streams) {
+            if (ids.has(id)) continue;
+            if (st.decoder && st.decoder.state !== 'closed') st.decoder.close();
+            st.cell.remove(); streams.delete(id);
+        }
+        list.forEach(info => {
+            const st = getStream(info.id);
+            // Native size is known before the first frame, so input maps correctly from the very first paint
+            if (!st.remoteWidth && info.w && info.h) { st.remoteWidth = info.w; st.remoteHeight = info.h; }
+        });
+        if (!streams.has(selectedStream)) selectedStream = list.length ? list[0].id : null;
+        renderStreamSelector();
+    }
+    function visibleStreams() { return tiled ? [...streams.values()] : (streams.has(selectedStream) ? [streams.get(selectedStream)] : []); }
+    function renderStreamSelector() {
+        streamSelector.innerHTML = '';
+        if (streams.size > 1) {
+            [...streams.keys()].sort((a, b) => a - b).forEach((id, i) => {
+                const button = document.createElement('button'); button.className = 'stream-button' + (!tiled && id === selectedStream ? ' active' : '');
+                button.textContent = `Display ${i + 1}`; button.addEventListener('click', () => { tiled = false; selectedStream = id; renderStreamSelector(); });
+                streamSelector.appendChild(button);
+            });
+            const tileButton = document.createElement('button'); tileButton.className = 'stream-button' + (tiled ? ' active' : '');
+            tileButton.textContent = 'Tile'; tileButton.addEventListener('click', () => { tiled = !tiled; renderStreamSelector(); });
+            streamSelector.appendChild(tileButton);
+        }
+        const visible = visibleStreams();
+        streams.forEach(st => st.cell.classList.toggle('visible', visible.includes(st)));
+        screenViewArea.classList.toggle('tiled', tiled && streams.size > 1);
+        screenPlaceholder.style.display = visible.length ? 'none' : '';
+        showStreamStatus(); reportStreams(); reportViewport(); updateZoomButton();
+    }
+    function showStreamStatus() { const st = streams.get(selectedStream); streamStatusText.textContent = st ? st.status : ''; }
+    // Hidden displays keep streaming at a trickle; the PC only runs full rate for streams someone is watching
+    function reportStreams() { if (socket.connected) socket.emit('viewer_streams', { streams: visibleStreams().map(st => st.id) }); }
+
+    // --- Frame Compositing: keyframes reset the canvas, delta packets draw changed tiles at their offsets ---
+    function composite(packet, confirm) {
+        const st = getStream(packet.stream), recv = serverNow();
+        st.drawChain = st.drawChain.then(async () => {
+            if (!packet.key && !st.haveKeyframe) return;
+            // Tiles are [x, y, bytes, codec]; codec is 'png' for lossless text regions, JPEG otherwise
+            const bitmaps = await Promise.all(packet.tiles.map(t => createImageBitmap(new Blob([t[2]], { type: t[3] === 'png' ? 'image/png' : 'image/jpeg' }))));
+            const decoded = serverNow();
+            if (packet.key) {
+                const w = packet.w || bitmaps[0].width, h = packet.h || bitmaps[0].height;
+                if (st.canvas.width !== w || st.canvas.height !== h) { st.canvas.width = w; st.canvas.height = h; }
+                // The canvas may be downscaled; mouse coordinates are always sent in native pixels
+                st.remoteWidth = packet.nw || w; st.remoteHeight = packet.nh || h; st.haveKeyframe = true; setStreamRoi(st, packet.roi);
+            }
+            bitmaps.forEach((bmp, i) => { st.ctx.drawImage(bmp, packet.tiles[i][0], packet.tiles[i][1]); bmp.close(); });
+            if (packet.seq !== undefined) ackFrame(st, packet.seq, packet.ts, recv, decoded); // Feeds the client's adaptive quality controller
+        }).catch(err => console.error('Frame composite error:', err)).finally(() => { if (confirm) confirm(); }); // Server sends our next frame after this
+    }
+
+
+    // --- Latency Tracing: frames carry server-clock stamps; we add receive/decode/paint times to the ack ---
+    let serverOffset = 0; // ms to add to Date.now() for the server's clock
+    function serverNow() { return Date.now() + serverOffset; }
+    async function syncClock(samples = 5) {
+        let best = null;
+        for (let i = 0; i < samples; i++) {
+            const sent = Date.now();
+            const reply = await new Promise(resolve => { socket.timeout(5000).emit('clock_sync', {}, (err, r) => resolve(err ? null : r)); });
+            const received = Date.now();
+            if (!reply) return;
+            if (!best || received - sent < best.rtt) best = { rtt: received - sent, offset: reply.t - (sent + received) / 2 };
+        }
+        serverOffset = best.offset;
+    }
+    setInterval(() => { if (socket.connected) syncClock(); }, 60000);
+    function ackFrame(st, seq, ts, recv, decoded) {
+        // Paint time is the next animation frame after the draw, when the browser actually presents it
+        requestAnimationFrame(() => {
+            const ack = { seq, stream: st.id };
+            if (ts) ack.timing = Object.assign({}, ts, { recv, decoded, painted: serverNow() });
+            socket.emit('frame_ack', ack);
+        });
+    }
+
+    // --- Viewport Reporting: lets the PC encode at the size we actually display ---
+    let viewportTimer = null;
+    function reportViewport() {
+        const dpr = window.devicePixelRatio || 1, cells = visibleStreams().map(st => st.cell);
+        // All displays share one limit on the PC, so report the largest cell on screen
+        const w = cells.length ? Math.max(...cells.map(c => c.clientWidth)) : screenViewArea.clientWidth;
+        const h = cells.length ? Math.max(...cells.map(c => c.clientHeight)) : screenViewArea.clientHeight;
+        if (socket.connected && w && h) socket.emit('viewer_viewport', { w: Math.round(w * dpr), h: Math.round(h * dpr) });
+    }
+    new ResizeObserver(() => { clearTimeout(viewportTimer); viewportTimer = setTimeout(reportViewport, 250); }).observe(screenViewArea);
+
+    socket.on('connect', () => { updateStatus('status-connecting', 'Server connected, waiting for PC...'); subscribedHost = null; syncClock(); });
+    function subscribeHost(id) {
+        if (id === subscribedHost) return;
+        wantedHost = subscribedHost = id; localStorage.setItem('remoteHost', id);
+        setStreams([]); // Displays belong to the previous host; the new one replays its stream_info
+        socket.emit('subscribe_host', { host: id });
+        reportViewport(); reportVideoCodecs(); reportStreams(); // Per-host state on the server, so report again
+    }
+    socket.on('host_list', (data) => {
+        const list = data.hosts || [];
+        hostSelector.innerHTML = '';
+        list.forEach(h => { const option = document.createElement('option'); option.value = h.id; option.textContent = h.online ? h.id : `${h.id} (offline)`; hostSelector.appendChild(option); });
+        hostSelector.style.display = list.length > 1 ? '' : 'none';
+        const target = wantedHost && list.some(h => h.id === wantedHost) ? wantedHost : (list.length ? list[0].id : wantedHost);
+        if (target) { subscribeHost(target); hostSelector.value = target; }
+    });
+    hostSelector.addEventListener('change', () => subscribeHost(hostSelector.value));
+    socket.on('disconnect', (reason) => { updateStatus('status-disconnected', 'Server disconnected'); /* ... cleanup ... */ });
+    socket.on('connect_error', (error) => { updateStatus('status-disconnected', 'Connection Error'); /* ... cleanup ... */ });
+    socket.on('client_connected', (data) => { updateStatus('status-connected', 'Remote PC Connected'); document.body.focus(); });
+    socket.on('client_disconnected', (data) => { updateStatus('status-disconnected', 'Remote PC Disconnected'); streams.forEach(st => { st.haveKeyframe = false; st.nextVideoSeq = null; st.videoNeedsKey = true; }); /* ... cleanup ... */ });
+    socket.on('stream_info', (data) => { setStreams(data.streams || []); });
+    socket.on('stream_status', (data) => { getStream(data.stream).status = `Q${data.quality} · ${data.fps} fps · ${Math.round(data.scale * 100)}%`; showStreamStatus(); });
+    socket.on('command_error', (data) => { console.error(`IO: Command Error: ${data.message}`); });
+    socket.on('text_injection_set_ack', (data) => {
+        injectionStatus.textContent = data.status === 'success' ? 'Text saved for client!' : `Error: ${data.message || 'Failed to save.'}`;
+        setTimeout(() => { injectionStatus.textContent = ''; }, 3000);
+    });
+    socket.on('typing_progress', (data) => {
+        injectionStatus.textContent = data.done < data.total ? `Typing… ${Math.floor(100 * data.done / Math.max(data.total, 1))}%` : `Typed ${data.total} chars`;
+    });
+
+    // --- Video Mode: VP8/H.264 packets decoded with WebCodecs when every viewer supports the codec ---
+    const VIDEO_CODEC_STRINGS = { vp8: 'vp8', h264: 'avc1.42E033' };
+    async function reportVideoCodecs() {
+        const codecs = [];
+        if (window.VideoDecoder) {
+            for (const [name, codec] of Object.entries(VIDEO_CODEC_STRINGS)) {
+                try { if ((await VideoDecoder.isConfigSupported({ codec, optimizeForLatency: true })).supported) codecs.push(name); } catch (e) { /* unsupported */ }
+            }
+        }
+        socket.emit('viewer_codecs', { codecs });
+    }
+    function needVideoKeyframe(st) { st.videoNeedsKey = true; if (!st.keyframeRequested) { st.keyframeRequested = true; socket.emit('request_keyframe', { stream: st.id }); } }
+    function ensureVideoDecoder(st, codec) {
+        if (st.decoder && st.decoderCodec === codec && st.decoder.state === 'configured') return;
+        if (st.decoder && st.decoder.state !== 'closed') st.decoder.close();
+        st.decoder = new VideoDecoder({
+            output: (frame) => {
+                const meta = st.videoFrameMeta.get(frame.timestamp), decoded = serverNow(); st.videoFrameMeta.delete(frame.timestamp);
+                st.drawChain = st.drawChain.then(() => {
+                    if (st.canvas.width !== frame.displayWidth || st.canvas.height !== frame.displayHeight) { st.canvas.width = frame.displayWidth; st.canvas.height = frame.displayHeight; }
+                    st.ctx.drawImage(frame, 0, 0); frame.close();
+                    st.haveKeyframe = false; // Tile deltas must wait for a fresh tile keyframe after video
+                    if (meta) { st.remoteWidth = meta.nw; st.remoteHeight = meta.nh; setStreamRoi(st, meta.roi); if (meta.seq !== undefined) ackFrame(st, meta.seq, meta.ts, meta.recv, decoded); }
+                });
+            },
+            error: (err) => { console.error('Video decode error:', err); st.decoder = null; needVideoKeyframe(st); }
+        });
+        st.decoder.configure({ codec: VIDEO_CODEC_STRINGS[codec], optimizeForLatency: true });
+        st.decoderCodec = codec; st.videoNeedsKey = true;
+    }
+
+    socket.on('screen_update', (packet, confirm) => { composite(packet, confirm); });
+    socket.on('screen_video', (packet, confirm) => {
+        if (confirm) confirm(); // Decoding is queued inside the VideoDecoder; confirm on receipt
+        const st = getStream(packet.stream), recv = serverNow();
+        try { ensureVideoDecoder(st, packet.codec); } catch (err) { console.error('Video decoder setup failed:', err); return; }
+        packet.frames.forEach(([vseq, key, data], i) => {
+            if (st.nextVideoSeq !== null && vseq !== st.nextVideoSeq && !key) needVideoKeyframe(st); // A frame was dropped upstream
+            st.nextVideoSeq = vseq + 1;
+            if (st.videoNeedsKey && !key) { needVideoKeyframe(st); return; }
+            if (key) { st.videoNeedsKey = false; st.keyframeRequested = false; }
+            st.videoFrameMeta.set(vseq, { nw: packet.nw, nh: packet.nh, seq: i === packet.frames.length - 1 ? packet.seq : undefined, ts: packet.ts, recv, roi: packet.roi });
+            if (st.videoFrameMeta.size > 120) st.videoFrameMeta.delete(st.videoFrameMeta.keys().next().value);
+            st.decoder.decode(new EncodedVideoChunk({ type: key ? 'key' : 'delta', timestamp: vseq, data }));
+        });
+    });
+    // --- Cursor Channel: the PC reports pointer position/shape separately; frames never contain it ---
+    socket.on('cursor_update', (data) => {
+        streams.forEach(st => { if (st.id !== data.stream) st.cursor = null; });
+        if (!data.visible || data.stream === undefined) return;
+        const st = getStream(data.stream); st.cursor = data;
+        st.canvas.style.cursor = data.shape || 'default'; // While hovering, the browser draws the remote shape at our pointer
+    });
+    function drawCursors() {
+        streams.forEach(st => {
+            const c = st.cursor, base = st.roi || [0, 0]; // Cursor is monitor-relative; while zoomed the canvas shows only the ROI
+            const cx = c ? c.x - base[0] : 0, cy = c ? c.y - base[1] : 0;
+            const show = c && !st.pointerInside && st.remoteWidth && st.cell.classList.contains('visible')
+                && cx >= 0 && cy >= 0 && cx < st.remoteWidth && cy < st.remoteHeight;
+            st.cursorEl.style.display = show ? 'block' : 'none';
+            if (!show) return;
+            const rect = st.canvas.getBoundingClientRect(), cellRect = st.cell.getBoundingClientRect();
+            const x = rect.left - cellRect.left + cx / st.remoteWidth * rect.width, y = rect.top - cellRect.top + cy / st.remoteHeight * rect.height;
+            st.cursorEl.style.transform = `translate(${x}px, ${y}px)`;
+        });
+        requestAnimationFrame(drawCursors);
+    }
+    requestAnimationFrame(drawCursors);
+    // Legacy clients send one full JPEG per frame; treat it as a keyframe
+    socket.on('screen_frame_bytes', (imageDataBytes, confirm) => { composite({ key: true, tiles: [[0, 0, imageDataBytes]] }, confirm); });
+
+    // --- Zoom: drag a rectangle to have the PC stream just that region at native resolution ---
+    const zoomButton = document.getElementById('zoom-button');
+    let zoomSelecting = false, zoomDrag = null, zoomJustEnded = false; // zoomJustEnded swallows the click that follows the drag
+    function setStreamRoi(st, roi) { st.roi = roi || null; if (st.id === selectedStream) updateZoomButton(); }
+    function updateZoomButton() {
+        const st = streams.get(selectedStream);
+        zoomButton.textContent = zoomSelecting ? 'Drag to Zoom…' : (st && st.roi ? 'Exit Zoom' : 'Zoom');
+        zoomButton.classList.toggle('active', zoomSelecting || !!(st && st.roi));
+        bodyElement.classList.toggle('zoom-selecting', zoomSelecting);
+    }
+    zoomButton.addEventListener('click', () => {
+        const st = streams.get(selectedStream);
+        if (!zoomSelecting && st && st.roi) socket.emit('set_roi', { stream: st.id, rect: null });
+        else zoomSelecting = !zoomSelecting;
+        updateZoomButton(); document.body.focus();
+    });
+    function attachZoomHandlers(st) {
+        const canvas = st.canvas;
+        const toRemote = (event) => { const rect = canvas.getBoundingClientRect(); return [Math.max(0, Math.min(rect.width, event.clientX - rect.left)), Math.max(0, Math.min(rect.height, event.clientY - rect.top)), rect]; };
+        canvas.addEventListener('mousedown', (event) => { if (!zoomSelecting || !st.remoteWidth) return; event.preventDefault(); const [x, y] = toRemote(event); zoomDrag = { st, x0: x, y0: y, x1: x, y1: y }; });
+        window.addEventListener('mousemove', (event) => {
+            if (!zoomDrag || zoomDrag.st !== st) return;
+            const [x, y, rect] = toRemote(event), cellRect = st.cell.getBoundingClientRect(); zoomDrag.x1 = x; zoomDrag.y1 = y;
+            Object.assign(st.selectionEl.style, { display: 'block', left: `${rect.left - cellRect.left + Math.min(zoomDrag.x0, x)}px`, top: `${rect.top - cellRect.top + Math.min(zoomDrag.y0, y)}px`,
+                                                  width: `${Math.abs(x - zoomDrag.x0)}px`, height: `${Math.abs(y - zoomDrag.y0)}px` });
+        });
+        window.addEventListener('mouseup', () => {
+            if (!zoomDrag || zoomDrag.st !== st) return;
+            const drag = zoomDrag, rect = canvas.getBoundingClientRect(); zoomDrag = null; st.selectionEl.style.display = 'none';
+            // Selection in displayed pixels -> native pixels of what is shown, offset by any region already zoomed into
+            const sx = st.remoteWidth / rect.width, sy = st.remoteHeight / rect.height, base = st.roi || [0, 0];
+            const x = Math.round(Math.min(drag.x0, drag.x1) * sx), y = Math.round(Math.min(drag.y0, drag.y1) * sy);
+            const w = Math.round(Math.abs(drag.x1 - drag.x0) * sx), h = Math.round(Math.abs(drag.y1 - drag.y0) * sy);
+            zoomSelecting = false; updateZoomButton(); zoomJustEnded = true; setTimeout(() => { zoomJustEnded = false; }, 0);
+            if (w >= 32 && h >= 32) socket.emit('set_roi', { stream: st.id, rect: [base[0] + x, base[1] + y, w, h] });
+        });
+    }
+
+    // --- Mouse Handling: coordinates are relative to the display (or zoomed region) under the pointer ---
+    // --- Control Input: batched binary events, layout in control_protocol.py ---
+    // MAX_EVENTS is half of control_protocol.MAX_EVENTS on purpose: the relay can then merge two queued batches into one
+    const CTL = { VERSION: 1, NO_STREAM: 255, MOVE: 1, CLICK: 2, SCROLL: 3, KEY_DOWN: 4, KEY_UP: 5, KEY_BASE: 0xE000, MAX_EVENTS: 256 };
+    const CTL_BUTTONS = { left: 0, right: 1, middle: 2 };
+    const CTL_NAMED_KEYS = ['Enter', 'Tab', 'Escape', 'Backspace', 'Delete', 'Insert', 'Home', 'End', 'PageUp', 'PageDown',
+                            'ArrowUp', 'ArrowDown', 'ArrowLeft', 'ArrowRight', 'Control', 'Shift', 'Alt', 'Meta', 'CapsLock',
+                            'NumLock', 'ScrollLock', 'PrintScreen', 'Pause', 'ContextMenu', 'AltGraph',
+                            'F1', 'F2', 'F3', 'F4', 'F5', 'F6', 'F7', 'F8', 'F9', 'F10', 'F11', 'F12'];
+    let ctlStream = null, ctlEvents = [], ctlStart = 0, ctlFrame = null;
+    let ctlMove = null; // Latest [stream, x, y] pointer position; at most one move goes out per animation frame
+    function ctlKeyCode(key) { const i = CTL_NAMED_KEYS.indexOf(key); if (i >= 0) return CTL.KEY_BASE + i; return key.length === 1 && key.charCodeAt(0) < CTL.KEY_BASE ? key.charCodeAt(0) : null; }
+    function ctlModifiers(event) { return (event.ctrlKey ? 1 : 0) | (event.shiftKey ? 2 : 0) | (event.altKey ? 4 : 0) | (event.metaKey ? 8 : 0); }
+    function flushControl() {
+        if (!ctlEvents.length) return;
+        const view = new DataView(new ArrayBuffer(4 + 8 * ctlEvents.length)), clamp = v => Math.max(-32768, Math.min(32767, v | 0));
+        view.setUint8(0, CTL.VERSION); view.setUint8(1, ctlStream ?? CTL.NO_STREAM); view.setUint16(2, ctlEvents.length, true);
+        ctlEvents.forEach(([kind, arg, dt, a, b], i) => {
+            const o = 4 + 8 * i;
+            view.setUint8(o, kind); view.setUint8(o + 1, arg); view.setUint16(o + 2, Math.min(dt, 65535), true); if (kind === CTL.KEY_DOWN || kind === CTL.KEY_UP) view.setUint16(o + 4, a, true); else view.setInt16(o + 4, clamp(a), true); view.setInt16(o + 6, clamp(b), true);
+        });
+        socket.emit('control_batch', view.buffer); ctlEvents = [];
+    }
+    function pushControl(stream, kind, arg, a, b) {
+        if (stream !== null && ctlStream !== null && stream !== ctlStream) flushControl(); // One stream per batch
+        if (!ctlEvents.length) { ctlStart = performance.now(); ctlStream = stream; } else if (ctlStream === null) ctlStream = stream;
+        ctlEvents.push([kind, arg, Math.round(performance.now() - ctlStart), a, b]);
+        if (ctlEvents.length >= CTL.MAX_EVENTS) flushControl();
+    }
+    function takeMove() { if (ctlMove) { const [stream, x, y] = ctlMove; ctlMove = null; pushControl(stream, CTL.MOVE, 0, x, y); } }
+    function scheduleControl() { if (!ctlFrame) ctlFrame = requestAnimationFrame(() => { ctlFrame = null; takeMove(); flushControl(); }); }
+    function sendControl(stream, kind, arg, a, b, immediate) {
+        // Moves and scrolls go out once per animation frame; clicks and keys at once, behind anything queued before them
+        if (kind === CTL.MOVE) { ctlMove = [stream, a, b]; scheduleControl(); return; } // A newer move replaces the pending one
+        if (kind === CTL.CLICK) ctlMove = null; else takeMove(); // A click positions the pointer itself
+        pushControl(stream, kind, arg, a, b);
+        if (immediate) flushControl(); else scheduleControl();
+    }
+    function sendKey(kind, event) {
+        const code = ctlKeyCode(event.key);
+        if (code !== null) { sendControl(null, kind, ctlModifiers(event), code, 0, true); return; }
+        takeMove(); flushControl(); // Keys outside the binary table keep the JSON path, in order behind earlier input
+        const command = { action: kind === CTL.KEY_DOWN ? 'keydown' : 'keyup', key: event.key, code: event.code };
+        if (kind === CTL.KEY_DOWN) Object.assign(command, { ctrlKey: event.ctrlKey, shiftKey: event.shiftKey, altKey: event.altKey, metaKey: event.metaKey });
+        socket.emit('control_command', command);
+    }
+
+    function attachMouseHandlers(st) {
+        const canvas = st.canvas;
+        attachZoomHandlers(st);
+        canvas.addEventListener('mouseenter', () => { st.pointerInside = true; });
+        canvas.addEventListener('mouseleave', () => { st.pointerInside = false; });
+        canvas.addEventListener('mousemove', (event) => { if (!st.remoteWidth || zoomSelecting || zoomDrag) return; const rect = canvas.getBoundingClientRect(); const x = event.clientX - rect.left; const y = event.clientY - rect.top; const remoteX = Math.round((x / rect.width) * st.remoteWidth); const remoteY = Math.round((y / rect.height) * st.remoteHeight); sendControl(st.id, CTL.MOVE, 0, remoteX, remoteY, false); });
+        canvas.addEventListener('click', (event) => { if (!st.remoteWidth || zoomSelecting || zoomDrag || zoomJustEnded) return; const rect = canvas.getBoundingClientRect(); const x = event.clientX - rect.left; const y = event.clientY - rect.top; const remoteX = Math.round((x / rect.width) * st.remoteWidth); const remoteY = Math.round((y / rect.height) * st.remoteHeight); sendControl(st.id, CTL.CLICK, CTL_BUTTONS.left, remoteX, remoteY, true); if (selectedStream !== st.id) { selectedStream = st.id; showStreamStatus(); } /*showClickFeedback*/ document.body.focus(); });
+        canvas.addEventListener('contextmenu', (event) => { event.preventDefault(); if (!st.remoteWidth) return; const rect = canvas.getBoundingClientRect(); const x = event.clientX - rect.left; const y = event.clientY - rect.top; const remoteX = Math.round((x / rect.width) * st.remoteWidth); const remoteY = Math.round((y / rect.height) * st.remoteHeight); sendControl(st.id, CTL.CLICK, CTL_BUTTONS.right, remoteX, remoteY, true); /*showClickFeedback*/ document.body.focus(); });
+        canvas.addEventListener('wheel', (event) => { event.preventDefault(); const dY = event.deltaY > 0 ? 1 : (event.deltaY < 0 ? -1 : 0); const dX = event.deltaX > 0 ? 1 : (event.deltaX < 0 ? -1 : 0); if (dY || dX) sendControl(st.id, CTL.SCROLL, 0, dX, dY, false); document.body.focus(); });
+    }
+
+    // --- Keyboard Event Handling ---
+    document.body.addEventListener('keydown', (event) => {
+        if (document.activeElement === injectionTextarea || injectionTextarea.contains(document.activeElement)) {
+             // Allow typing in textarea, but capture F1 if it's for text injection trigger (handled by client)
+            if (event.key === "F1") {
+                // Optionally, prevent default F1 behavior if it does anything in browser
+                // event.preventDefault(); 
+                // We still send F1 to the client to trigger typing.
+            } else {
+                return; // Don't send other keys as control commands
+            }
+        }
+
+        // ... (rest of existing keydown logic for modifiers and sending commands)
+        if (event.key === 'Control') activeModifiers.ctrl = true; if (event.key === 'Shift') activeModifiers.shift = true; if (event.key === 'Alt') activeModifiers.alt = true; if (event.key === 'Meta') activeModifiers.meta = true;
+        let shouldPreventDefault = false; const isModifierKey = ['Control', 'Shift', 'Alt', 'Meta', 'CapsLock', 'NumLock', 'ScrollLock'].includes(event.key); const isFKey = event.key.startsWith('F') && event.key.length > 1 && !isNaN(parseInt(event.key.substring(1))); const keysToPrevent = [ 'Tab', 'Enter', 'Escape', 'Backspace', 'Delete', 'Insert', 'Home', 'End', 'PageUp', 'PageDown', 'ArrowUp', 'ArrowDown', 'ArrowLeft', 'ArrowRight', ' ' ];
+        if (event.key.length === 1 && !event.ctrlKey && !event.altKey && !event.metaKey) { shouldPreventDefault = true; } else if (keysToPrevent.includes(event.key) && !(event.altKey && event.key === 'Tab')) { shouldPreventDefault = true; }
+        if (event.metaKey && event.shiftKey && event.key.toLowerCase() === 's') { shouldPreventDefault = false; } if (event.altKey && event.key === 'Tab') { shouldPreventDefault = false; } if (event.ctrlKey && ['c', 'v', 'x', 'a', 'z', 'y', 'r', 't', 'w', 'l', 'p', 'f'].includes(event.key.toLowerCase())) { shouldPreventDefault = false; } if (isFKey && event.key !== "F1") { shouldPreventDefault = false; } /* Allow F1 to pass through */ if (event.ctrlKey && event.shiftKey && ['i', 'j', 'c'].includes(event.key.toLowerCase())) { shouldPreventDefault = false; } if (event.ctrlKey && event.key === 'Tab') { shouldPreventDefault = false; }
+
+        // For F1, we always want to send it, but might not prevent default if textarea is focused
+        // For other keys that should be prevented, do so.
+        if (shouldPreventDefault && event.key !== "F1") { event.preventDefault(); }
+
+
+        sendKey(CTL.KEY_DOWN, event);
+    });
+    document.body.addEventListener('keyup', (event) => {
+        if (document.activeElement === injectionTextarea || injectionTextarea.contains(document.activeElement)) return;
+        // ... (rest of existing keyup logic)
+         if (event.key === 'Control') activeModifiers.ctrl = false; if (event.key === 'Shift') activeModifiers.shift = false; if (event.key === 'Alt') activeModifiers.alt = false; if (event.key === 'Meta') activeModifiers.meta = false;
+         sendKey(CTL.KEY_UP, event);
+    });
+    window.addEventListener('blur', () => { /* ... same as before ... */ });
+
+    // --- UI Mode Toggle & Text Injection ---
+    toggleTextModeButton.addEventListener('click', () => {
+        bodyElement.classList.toggle('text-input-mode');
+        if (bodyElement.classList.contains('text-input-mode')) {
+            toggleTextModeButton.textContent = 'Screen View Mode';
+            toggleTextModeButton.classList.add('active');
+            injectionTextarea.focus(); // Focus textarea when mode is active
+        } else {
+            toggleTextModeButton.textContent = 'Text Input Mode';
+            toggleTextModeButton.classList.remove('active');
+            document.body.focus(); // Focus body for general controls
+        }
+    });
+
+    sendInjectionTextButton.addEventListener('click', () => {
+        const text = injectionTextarea.value;
+        // No need to check for empty here, client can receive empty string to clear
+        socket.emit('set_injection_text', { text_to_inject: text });
+        injectionStatus.textContent = 'Saving...';
+    });
+
+    updateStatus('status-connecting', 'Initializing...');
+    document.body.focus();
+});
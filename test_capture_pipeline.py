@@ -0,0 +1,79 @@
+# CapturePipeline driven end to end by SyntheticBackend, with packets collected in-process instead of emitted
+import io
+import queue
+import threading
+import pytest
+
+np = pytest.importorskip('numpy')
+Image = pytest.importorskip('PIL.Image')
+client = pytest.importorskip('client')
+from capture_backends import SyntheticBackend
+
+WIDTH, HEIGHT, SQUARE = 256, 128, 16
+WAIT = 5.0 # Seconds to wait for an expected packet
+
+
+class SquareDesktop:
+    # Grey monitor with one square; the test moves the square between frames
+    def __init__(self): self.pos = (8, 8)
+
+    def __call__(self, index):
+        frame = np.full((HEIGHT, WIDTH, 4), (64, 64, 64, 255), dtype=np.uint8)
+        x, y = self.pos; frame[y:y + SQUARE, x:x + SQUARE] = (0, 128, 255, 255)
+        return frame.tobytes(), None
+
+
+@pytest.fixture
+def stream():
+    # Yields (pipeline, desktop, packets) with the pipeline running on its own thread
+    desktop, packets, running = SquareDesktop(), queue.Queue(), threading.Event(); running.set()
+    monitor = {'left': 0, 'top': 0, 'width': WIDTH, 'height': HEIGHT}
+    pipeline = client.CapturePipeline(monitor, lambda event, data: packets.put((event, data)), running.is_set,
+                                      fps=60, delta=True, adaptive=False, stream_id=0)
+    pipeline.viewport = None
+    thread = threading.Thread(target=pipeline.run, args=(SyntheticBackend(monitor, desktop),), daemon=True); thread.start()
+    yield pipeline, desktop, packets
+    running.clear(); thread.join(timeout=5.0)
+
+def next_packet(packets):
+    event, packet = packets.get(timeout=WAIT)
+    assert event == 'screen_update'
+    return packet
+
+def tile_boxes(packet): # (x0, y0, x1, y1) of every tile in native pixels
+    boxes = []
+    for tile in packet['tiles']:
+        width, height = Image.open(io.BytesIO(bytes(tile[2]))).size
+        boxes.append((tile[0], tile[1], tile[0] + width, tile[1] + height))
+    return boxes
+
+
+def test_first_packet_is_a_keyframe(stream):
+    _, _, packets = stream
+    packet = next_packet(packets)
+    assert packet['key'] and (packet['nw'], packet['nh']) == (WIDTH, HEIGHT) and 'roi' not in packet
+    assert tile_boxes(packet) == [(0, 0, WIDTH, HEIGHT)]
+
+def test_static_source_sends_nothing_after_the_keyframe(stream):
+    _, _, packets = stream
+    next_packet(packets)
+    with pytest.raises(queue.Empty): packets.get(timeout=0.5) # ~30 identical captures at 60 fps
+
+def test_moving_square_sends_only_the_changed_tiles(stream):
+    _, desktop, packets = stream
+    next_packet(packets)
+    desktop.pos = (72, 8) # Leaves tile (0, 0) and enters tile (64, 0)
+    packet = next_packet(packets)
+    assert not packet['key']
+    boxes = tile_boxes(packet)
+    assert boxes and all(x1 <= 128 and y1 <= 64 for _, _, x1, y1 in boxes) # Only the top-left 2x1 tiles
+    for x, y in ((8, 8), (72, 8)): # Both the old and the new square are covered
+        assert any(x0 <= x and y0 <= y and x + SQUARE <= x1 and y + SQUARE <= y1 for x0, y0, x1, y1 in boxes)
+
+def test_roi_sends_region_sized_frames(stream):
+    pipeline, _, packets = stream
+    next_packet(packets)
+    pipeline.set_roi([64, 32, 96, 48])
+    packet = next_packet(packets)
+    assert packet['key'] and packet['roi'] == [64, 32, 96, 48] and (packet['nw'], packet['nh']) == (96, 48)
+    assert tile_boxes(packet) == [(0, 0, 96, 48)]
@@ -0,0 +1,30 @@
+# Round trips for the cluster bus framing (JSON header plus raw blobs) and the single-process LocalBus
+import cluster
+
+
+def test_pack_round_trips_nested_blobs():
+    message = {'type': 'frame', 'host': 'pc-1', 'event': 'screen_update',
+               'data': {'seq': 7, 'tiles': [[0, 0, b'\xff\xd8jpeg', 'jpeg'], [64, 0, bytearray(b'\x89PNG'), 'png']],
+                        'meta': {'empty': b'', 'nested': [[b'\x00\x01'], {'deep': memoryview(b'view')}]}}}
+    restored = cluster.unpack(cluster.pack(message))
+    assert restored['data']['tiles'] == [[0, 0, b'\xff\xd8jpeg', 'jpeg'], [64, 0, b'\x89PNG', 'png']]
+    assert restored['data']['meta'] == {'empty': b'', 'nested': [[b'\x00\x01'], {'deep': b'view'}]}
+    assert restored['type'] == 'frame' and restored['data']['seq'] == 7
+
+def test_pack_round_trips_bytes_only_payloads():
+    for payload in (b'', b'\x00' * 3, bytes(range(256)) * 64):
+        assert cluster.unpack(cluster.pack({'type': 'frame', 'data': payload}))['data'] == payload
+    assert cluster.unpack(cluster.pack([b'a', b'bc'])) == [b'a', b'bc']
+
+def test_pack_leaves_plain_json_alone():
+    message = {'type': 'viewers', 'viewport': [1280, 720], 'codecs': ['vp8'], 'streams': [], 'flag': None, 'b': 'not bytes'}
+    assert cluster.unpack(cluster.pack(message)) == message
+
+def test_local_bus_tracks_owner_and_subscribers():
+    bus = cluster.LocalBus('node-a')
+    assert bus.claim_host('pc', 'sid-1') is None
+    assert bus.claim_host('pc', 'sid-2') == ('node-a', 'sid-1')
+    bus.release_host('pc', 'sid-1') # Stale SID must not release the new owner
+    assert bus.host_owner('pc') == ('node-a', 'sid-2')
+    bus.add_subscriber('pc'); assert bus.subscriber_nodes('pc') == {'node-a'}
+    bus.remove_subscriber('pc'); assert bus.subscriber_nodes('pc') == set()
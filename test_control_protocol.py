@@ -0,0 +1,54 @@
+# Round trips for the binary control_batch format; static/viewer.js writes the same layout by hand
+import pytest
+import control_protocol as cp
+
+
+def test_round_trip_pointer_events_keep_negative_coordinates():
+    events = [(cp.MOVE, 0, 0, -1920, -5), (cp.CLICK, 1, 16, 32767, -32768), (cp.SCROLL, 0, 40, 0, -3)]
+    assert cp.decode_batch(cp.encode_batch(2, events)) == (2, events)
+
+def test_key_codes_at_or_above_0x8000_survive_the_int16_field():
+    events = [(cp.KEY_DOWN, cp.MOD_CTRL, 0, 0x8000, 0), (cp.KEY_UP, 0, 1, 0xFFFF, 0),
+              (cp.KEY_DOWN, 0, 2, cp.key_code('F12'), 0), (cp.KEY_DOWN, 0, 3, ord('a'), 0)]
+    stream, decoded = cp.decode_batch(cp.encode_batch(None, events))
+    assert stream is None and decoded == events
+    assert cp.key_name(decoded[2][3]) == 'F12' and cp.key_name(decoded[3][3]) == 'a'
+
+def test_decode_rejects_malformed_batches():
+    data = cp.encode_batch(0, [(cp.MOVE, 0, 0, 1, 1)])
+    for bad in (data[:-1], data + b'\0', bytes([cp.VERSION + 1]) + data[1:], cp.HEADER.pack(cp.VERSION, 0, 0)):
+        assert cp.check_batch(bad) is None
+        with pytest.raises(ValueError): cp.decode_batch(bad)
+    assert cp.check_batch(cp.HEADER.pack(cp.VERSION, 0, cp.MAX_EVENTS + 1) + b'\0' * cp.EVENT.size * (cp.MAX_EVENTS + 1)) is None
+
+def test_merge_drops_superseded_moves_and_offsets_times():
+    first = cp.encode_batch(1, [(cp.MOVE, 0, 0, 10, 10), (cp.MOVE, 0, 5, 20, 20)])
+    second = cp.encode_batch(1, [(cp.MOVE, 0, 0, 30, 30), (cp.CLICK, 0, 3, 40, 40)])
+    merged, dropped = cp.merge_batches(first, second)
+    assert dropped == 3
+    assert cp.decode_batch(merged) == (1, [(cp.CLICK, 0, 8, 40, 40)])
+
+def test_merge_keyboard_batch_takes_the_pointer_batch_stream():
+    keys = cp.encode_batch(None, [(cp.KEY_DOWN, 0, 0, 0x9000, 0)])
+    merged, _ = cp.merge_batches(keys, cp.encode_batch(3, [(cp.MOVE, 0, 0, -4, 4)]))
+    assert cp.decode_batch(merged) == (3, [(cp.KEY_DOWN, 0, 0, 0x9000, 0), (cp.MOVE, 0, 0, -4, 4)])
+
+def test_merge_refuses_different_streams_and_overfull_batches():
+    assert cp.merge_batches(cp.encode_batch(0, [(cp.MOVE, 0, 0, 1, 1)]), cp.encode_batch(1, [(cp.MOVE, 0, 0, 1, 1)])) == (None, 0)
+    full = cp.encode_batch(0, [(cp.SCROLL, 0, 0, 0, 1)] * cp.MAX_EVENTS)
+    assert cp.merge_batches(full, cp.encode_batch(0, [(cp.SCROLL, 0, 0, 0, 1)])) == (None, 0)
+
+def test_merge_clamps_time_offsets_to_uint16():
+    first = cp.encode_batch(0, [(cp.SCROLL, 0, 0xFFF0, 0, 1)])
+    second = cp.encode_batch(0, [(cp.SCROLL, 0, 0x20, 0, 1), (cp.SCROLL, 0, 0xFFFF, 0, 1)])
+    merged, _ = cp.merge_batches(first, second)
+    assert [dt for _, _, dt, _, _ in cp.decode_batch(merged)[1]] == [0xFFF0, 0xFFFF, 0xFFFF]
+
+def test_coalesce_keeps_last_move_and_moves_before_keys():
+    events = [(cp.MOVE, 0, 0, 1, 1), (cp.MOVE, 0, 1, 2, 2), (cp.KEY_DOWN, 0, 2, 65, 0), (cp.MOVE, 0, 3, 3, 3)]
+    assert cp.coalesce_moves(events) == events[1:]
+
+def test_from_command_maps_legacy_json():
+    assert cp.from_command({'action': 'click', 'x': -3, 'y': 4, 'button': 'Right'}) == (cp.CLICK, 1, -3, 4, None)
+    assert cp.from_command({'action': 'keydown', 'key': 'a', 'ctrlKey': True, 'altKey': True}) == (cp.KEY_DOWN, cp.MOD_CTRL | cp.MOD_ALT, None, None, 'a')
+    assert cp.from_command({'action': 'bogus'}) is None
@@ -0,0 +1,26 @@
+# build_text_inputs / InputBatch against the stub SendInput (run anywhere; nothing is injected off Windows)
+import input_injection as ii
+
+
+def key_events(inputs):
+    return [(inp.union.ki.wVk, inp.union.ki.wScan, inp.union.ki.dwFlags) for inp in inputs]
+
+def test_build_text_inputs_handles_newlines_tabs_and_surrogate_pairs():
+    inputs, starts = ii.build_text_inputs('a\r\n\t\U0001F600')
+    down, up = ii.KEYEVENTF_UNICODE, ii.KEYEVENTF_UNICODE | ii.KEYEVENTF_KEYUP
+    assert key_events(inputs) == [(0, ord('a'), down), (0, ord('a'), up), (ii.VK_RETURN, 0, 0), (ii.VK_RETURN, 0, ii.KEYEVENTF_KEYUP),
+                                  (ii.VK_TAB, 0, 0), (ii.VK_TAB, 0, ii.KEYEVENTF_KEYUP),
+                                  (0, 0xD83D, down), (0, 0xD83D, up), (0, 0xDE00, down), (0, 0xDE00, up)]
+    assert starts == [0, 2, 4, 4, 6, 10] # \n of \r\n adds nothing; the emoji takes four records
+
+def test_build_text_inputs_passes_lone_surrogates_through():
+    inputs, starts = ii.build_text_inputs('x\ud800y')
+    assert [scan for _, scan, _ in key_events(inputs)][::2] == [ord('x'), 0xD800, ord('y')] and starts[-1] == 6
+
+def test_send_input_slice_and_batch_flush_use_the_stub():
+    inputs, _ = ii.build_text_inputs('hello')
+    assert ii.send_input_slice(inputs, 2, 4) == 4
+    batch = ii.InputBatch(capacity=4)
+    batch.click(); batch.char('\U0001F600') # Six records: the batch flushes itself once full
+    assert batch.pending == 2 and batch.calls == 1
+    assert batch.flush() == 2 and batch.submitted == 6